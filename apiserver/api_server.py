@@ -8,9 +8,9 @@ import asyncio
 import json
 import sys
 import traceback
-import re
 import os
 import logging
+import uuid
 from contextlib import asynccontextmanager
 from typing import Dict, List, Optional, AsyncGenerator
 
@@ -25,10 +25,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi import WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-import aiohttp
 
 # 导入NagaAgent核心模块
 from conversation_core import NagaConversation
+from mcpserver.tool_request_parser import parse_tool_calls  # 与对话主循环共用的工具调用解析
 from config import config  # 使用新的配置系统
 from ui.response_utils import extract_message  # 导入消息提取工具
 
@@ -80,6 +80,8 @@ async def lifespan(app: FastAPI):
                 await naga_agent.mcp.cleanup()
             except Exception as e:
                 print(f"[WARNING] 清理MCP资源时出错: {e}")
+        if naga_agent:
+            naga_agent.sessions.close()  # 会话状态落盘，重启后按session_id恢复
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -198,48 +200,35 @@ async def chat(request: ChatRequest):
     if not request.message.strip():
         raise HTTPException(status_code=400, detail="消息内容不能为空")
     
+    session_id = request.session_id or uuid.uuid4().hex  # 未指定时新建会话，客户端用返回的session_id继续对话
+    session = naga_agent.sessions.get(session_id)
     try:
-        # 构建消息
-        messages = [
-            {"role": "user", "content": request.message}
-        ]
-        
         # 定义LLM调用函数
         async def call_llm(messages: List[Dict]) -> Dict:
             """调用LLM API"""
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{config.api.base_url}/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {config.api.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": config.api.model,
-                        "messages": messages,
-                        "temperature": config.api.temperature,
-                        "max_tokens": config.api.max_tokens,
-                        "stream": False
-                    }
-                ) as resp:
-                    if resp.status != 200:
-                        raise HTTPException(status_code=resp.status, detail="LLM API调用失败")
-                    
-                    data = await resp.json()
-                    return {
-                        'content': data['choices'][0]['message']['content'],
-                        'status': 'success'
-                    }
-        
-        # 处理工具调用循环
-        result = await tool_call_loop(messages, naga_agent.mcp, call_llm, is_streaming=False)
+            resp = await naga_agent.llm.create(
+                model=config.api.model,
+                messages=messages,
+                temperature=config.api.temperature,
+                max_tokens=config.api.max_tokens
+            )
+            return {
+                'content': resp.choices[0].message.content,
+                'status': 'success'
+            }
         
-        # 提取最终响应
-        response_text = result['content']
+        # 同一会话的请求依次处理：构建消息（含该会话历史）→ 工具调用循环 → 写回历史
+        async with session.turn():
+            with session.lock:
+                messages = naga_agent.build_messages(session.context, request.message)
+            result = await tool_call_loop(messages, naga_agent.mcp, call_llm, is_streaming=False)
+            response_text = result['content']
+            with session.lock:
+                naga_agent.record_turn(session.context, request.message, response_text)
         
         return ChatResponse(
             response=extract_message(response_text) if response_text else response_text,
-            session_id=request.session_id,
+            session_id=session_id,
             status="success"
         )
     except Exception as e:
@@ -256,48 +245,22 @@ async def chat_stream(request: ChatRequest):
     if not request.message.strip():
         raise HTTPException(status_code=400, detail="消息内容不能为空")
     
+    session_id = request.session_id or uuid.uuid4().hex
+    session = naga_agent.sessions.get(session_id)
+    
     async def generate_response() -> AsyncGenerator[str, None]:
         try:
-            # 构建消息
-            messages = [
-                {"role": "user", "content": request.message}
-            ]
-            
-            # 定义LLM调用函数
-            async def call_llm(messages: List[Dict]) -> Dict:
-                """调用LLM API"""
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"{config.api.base_url}/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {config.api.api_key}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": config.api.model,
-                            "messages": messages,
-                            "temperature": config.api.temperature,
-                            "max_tokens": config.api.max_tokens,
-                            "stream": False
-                        }
-                    ) as resp:
-                        if resp.status != 200:
-                            raise HTTPException(status_code=resp.status, detail="LLM API调用失败")
-                        
-                        data = await resp.json()
-                        return {
-                            'content': data['choices'][0]['message']['content'],
-                            'status': 'success'
-                        }
-            
-            # 处理工具调用循环
-            result = await tool_call_loop(messages, naga_agent.mcp, call_llm, is_streaming=True)
-            
-            # 流式输出最终结果
-            final_content = result['content']
-            for line in final_content.splitlines():
-                if line.strip():
-                    yield f"data: {line}\n\n"
+            async with session.turn():
+                with session.lock:
+                    messages = naga_agent.build_messages(session.context, request.message)
+                # 流式工具调用循环：文本边生成边推送，工具调用块不外发
+                async for kind, payload in naga_agent.stream_tool_call_loop(messages, is_streaming=True):
+                    if kind == "text":
+                        # SSE 每行需带 data: 前缀，同一事件内多行由客户端以换行拼回
+                        yield "".join(f"data: {line}\n" for line in payload.split("\n")) + "\n"
+                    else:
+                        with session.lock:
+                            naga_agent.record_turn(session.context, request.message, payload['content'])
             
             yield "data: [DONE]\n\n"
             
@@ -312,7 +275,8 @@ async def chat_stream(request: ChatRequest):
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "Content-Type": "text/event-stream"
+            "Content-Type": "text/event-stream",
+            "X-Session-Id": session_id
         }
     )
 
@@ -482,69 +446,6 @@ async def get_memory_stats():
 
 # 工具调用循环相关函数
 
-def parse_tool_calls(content: str) -> list:
-    """解析TOOL_REQUEST格式的工具调用，支持MCP和Agent两种类型"""
-    tool_calls = []
-    tool_request_start = "<<<[TOOL_REQUEST]>>>"
-    tool_request_end = "<<<[END_TOOL_REQUEST]>>>"
-    start_index = 0
-    while True:
-        start_pos = content.find(tool_request_start, start_index)
-        if start_pos == -1:
-            break
-        end_pos = content.find(tool_request_end, start_pos)
-        if end_pos == -1:
-            start_index = start_pos + len(tool_request_start)
-            continue
-        tool_content = content[start_pos + len(tool_request_start):end_pos].strip()
-        
-        # 先解析所有参数
-        tool_args = {}
-        param_pattern = r'(\w+)\s*:\s*「始」([\s\S]*?)「末」'
-        for match in re.finditer(param_pattern, tool_content):
-            key = match.group(1)
-            value = match.group(2).strip()
-            tool_args[key] = value
-        
-        # 判断调用类型
-        agent_type = tool_args.get('agentType', 'mcp').lower()
-        
-        if agent_type == 'agent':
-            # Agent类型调用格式
-            agent_name = tool_args.get('agent_name')
-            query = tool_args.get('query')
-            if agent_name and query:
-                tool_calls.append({
-                    'name': 'agent_call',
-                    'args': {
-                        'agentType': 'agent',
-                        'agent_name': agent_name,
-                        'query': query
-                    }
-                })
-            else:
-            # MCP类型调用格式（包括默认mcp和旧格式）
-                tool_name = tool_args.get('tool_name')
-        if tool_name:
-                # 新格式：有service_name
-                if 'service_name' in tool_args:
-                    tool_calls.append({
-                        'name': tool_name,
-                        'args': tool_args
-                    })
-                else:
-                    # 旧格式：tool_name作为服务名
-                    service_name = tool_name
-                    tool_args['service_name'] = service_name
-                    tool_args['agentType'] = 'mcp'
-                    tool_calls.append({
-                        'name': tool_name,
-                        'args': tool_args
-                    })
-        
-        start_index = end_pos + len(tool_request_end)
-    return tool_calls
-
 async def execute_tool_calls(tool_calls: list, mcp_manager) -> str:
     """执行工具调用"""
     results = []
@@ -7,7 +7,7 @@ import platform
 import json
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from pydantic import BaseModel, Field, field_validator
 
 
@@ -50,6 +50,9 @@ class SystemConfig(BaseModel):
     stream_mode: bool = Field(default=True, description="是否启用流式响应")
     debug: bool = Field(default=False, description="是否启用调试模式")
     log_level: str = Field(default="INFO", description="日志级别")
+    log_fsync_interval: float = Field(default=5.0, ge=0.0, le=300.0, description="对话日志强制落盘间隔（秒），0表示每批写入后立即落盘")
+    trace_enabled: bool = Field(default=False, description="是否记录链路追踪（LLM调用、工具调用等耗时）")
+    trace_exporter: str = Field(default="jsonl", description="追踪导出格式：jsonl（本地JSONL）/ otel（OTLP JSON文件）")
 
     @field_validator('log_level')
     @classmethod
@@ -59,6 +62,13 @@ class SystemConfig(BaseModel):
             raise ValueError(f'日志级别必须是以下之一: {valid_levels}')
         return v.upper()
 
+    @field_validator('trace_exporter')
+    @classmethod
+    def validate_trace_exporter(cls, v):
+        if v.lower() not in ('jsonl', 'otel'):
+            raise ValueError("追踪导出格式必须是 jsonl 或 otel")
+        return v.lower()
+
 
 class APIConfig(BaseModel):
     """API服务配置"""
@@ -68,10 +78,17 @@ class APIConfig(BaseModel):
     temperature: float = Field(default=0.7, ge=0.0, le=2.0, description="温度参数")
     max_tokens: int = Field(default=2000, ge=1, le=8192, description="最大token数")
     max_history_rounds: int = Field(default=10, ge=1, le=100, description="最大历史轮数")
+    context_token_budget: int = Field(default=4000, ge=256, le=128000, description="每次请求携带历史的token预算")
+    context_digest_max_tokens: int = Field(default=300, ge=50, le=4000, description="早前对话滚动摘要的最大长度")
+    history_spill_threshold: int = Field(default=40, ge=4, le=1000, description="内存中保留的历史消息数，超出后已摘要的旧消息转存磁盘")
+    session_max_count: int = Field(default=64, ge=1, le=10000, description="内存中同时保留的会话数，超出后淘汰最久未使用的会话")
+    session_idle_ttl: int = Field(default=1800, ge=60, le=604800, description="会话空闲多少秒后淘汰")
+    session_persist: bool = Field(default=True, description="淘汰的会话是否落盘，再次访问时恢复")
     # 额外可选参数
     top_p: Optional[float] = Field(default=None, ge=0.0, le=1.0, description="Top-p采样参数")
     timeout: Optional[int] = Field(default=None, ge=1, le=300, description="请求超时时间")
     retry_count: Optional[int] = Field(default=None, ge=0, le=10, description="重试次数")
+    max_concurrency: int = Field(default=8, ge=1, le=64, description="全局同时进行的LLM请求数上限")
 
     @field_validator('api_key')
     @classmethod
@@ -104,10 +121,18 @@ class GRAGConfig(BaseModel):
     auto_extract: bool = Field(default=False, description="是否自动提取对话中的三元组")  # 关闭三元组提取
     context_length: int = Field(default=5, ge=1, le=20, description="记忆上下文长度")
     similarity_threshold: float = Field(default=0.6, ge=0.0, le=1.0, description="记忆检索相似度阈值")
+    backend: Literal["auto", "local"] = Field(default="auto", description="图存储后端：auto优先Neo4j、不可用时用进程内图，local只用进程内图")
     neo4j_uri: str = Field(default="neo4j://127.0.0.1:7687", description="Neo4j连接URI")
     neo4j_user: str = Field(default="neo4j", description="Neo4j用户名")
     neo4j_password: str = Field(default="your_password", description="Neo4j密码")
     neo4j_database: str = Field(default="neo4j", description="Neo4j数据库名")
+    neo4j_batch_size: int = Field(default=500, ge=1, le=10000, description="Neo4j批量写入每批三元组数")
+    llm_max_concurrency: int = Field(default=4, ge=1, le=64, description="三元组提取/关键词查询的最大并发请求数")
+    llm_max_retries: int = Field(default=2, ge=0, le=10, description="三元组提取/关键词查询请求失败重试次数")
+    extract_batch_size: int = Field(default=4, ge=1, le=32, description="合并为一次提取请求的对话轮数")
+    extract_flush_interval: float = Field(default=2.0, ge=0.0, le=60.0, description="提取队列最长等待秒数，到时即使未满也提交")
+    extract_queue_size: int = Field(default=32, ge=1, le=1024, description="提取队列容量，满时新对话等待入队")
+    extraction_cache_size: int = Field(default=10000, ge=1, description="持久化提取缓存最多保留的文本条数，超出按最久未使用淘汰")
 
 
 class HandoffConfig(BaseModel):
@@ -115,6 +140,8 @@ class HandoffConfig(BaseModel):
     max_loop_stream: int = Field(default=5, ge=1, le=20, description="流式模式最大工具调用循环次数")
     max_loop_non_stream: int = Field(default=5, ge=1, le=20, description="非流式模式最大工具调用循环次数")
     show_output: bool = Field(default=False, description="是否显示工具调用输出")
+    tool_concurrency_per_service: int = Field(default=2, ge=1, le=32, description="同一服务同时执行的工具调用数上限")
+    tool_call_timeout: float = Field(default=60.0, ge=1.0, le=600.0, description="manifest未声明超时时单次工具调用的超时秒数")
 
 
 class MCPConfig(BaseModel):
@@ -624,6 +651,11 @@ GRAG_NEO4J_URI = config.grag.neo4j_uri
 GRAG_NEO4J_USER = config.grag.neo4j_user
 GRAG_NEO4J_PASSWORD = config.grag.neo4j_password
 GRAG_NEO4J_DATABASE = config.grag.neo4j_database
+GRAG_NEO4J_BATCH_SIZE = config.grag.neo4j_batch_size
+GRAG_BACKEND = config.grag.backend
+GRAG_EXTRACT_BATCH_SIZE = config.grag.extract_batch_size
+GRAG_EXTRACT_FLUSH_INTERVAL = config.grag.extract_flush_interval
+GRAG_EXTRACT_QUEUE_SIZE = config.grag.extract_queue_size
 
 MAX_handoff_LOOP_STREAM = config.handoff.max_loop_stream
 MAX_handoff_LOOP_NON_STREAM = config.handoff.max_loop_non_stream
@@ -0,0 +1,302 @@
+# context_window.py # 对话上下文窗口：按token预算打包历史，旧轮次滚动摘要，完整历史超阈值后转存磁盘
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import config
+from tracing import span
+
+logger = logging.getLogger("ContextWindow")
+
+MESSAGE_OVERHEAD = 4  # 每条消息的角色/分隔等固定开销（与OpenAI计数规则一致）
+_CJK = re.compile(r'[　-鿿가-힯＀-￯]')
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_failed = False
+
+
+def _get_encoding():
+    """懒加载tiktoken编码器；不可用（未安装或离线无法下载词表）时返回None"""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logger.info(f"tiktoken不可用，使用近似token计数: {e}")
+                    _encoding_failed = True
+    return _encoding
+
+
+_compaction_loop: Optional[asyncio.AbstractEventLoop] = None
+_compaction_loop_lock = threading.Lock()
+
+
+def _get_compaction_loop() -> asyncio.AbstractEventLoop:
+    """后台整理专用的常驻事件循环（守护线程）
+
+    UI 每条消息新建事件循环并在回复后关闭，挂在这些循环上的整理任务会随之永远停住
+    """
+    global _compaction_loop
+    if _compaction_loop is None:
+        with _compaction_loop_lock:
+            if _compaction_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="ContextCompaction", daemon=True).start()
+                _compaction_loop = loop
+    return _compaction_loop
+
+
+def count_tokens(text: str) -> int:
+    """本地计数文本token数"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 近似：中日韩字符约1字1token，其余约4字符1token
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: Dict) -> int:
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
+
+
+SUMMARY_PROMPT = """请把下面的对话整理为一段简洁的摘要，保留用户的身份信息、偏好、已确认的事实、未完成的任务和重要结论，省略寒暄。
+{previous}
+对话：
+{dialog}
+
+要求：不超过{limit}字，直接输出摘要正文。"""
+
+
+class ContextWindow:
+    """单个会话的上下文窗口
+
+    - window() 从最新消息往前打包，直到 token 预算或轮数上限；被挤出窗口的旧消息由滚动摘要代替
+    - compact() 把挤出窗口的消息合并进摘要（调用模型），并把已摘要的旧消息转存到磁盘，内存中只保留近期消息
+    - lock 保护 messages/digest 等状态（会话锁即此锁）：请求方读写上下文时持有；后台整理只在取快照与提交结果时持有，
+      调模型和写文件在锁外进行，提交前用 _generation 确认期间没有整体替换或改写过消息
+    """
+
+    def __init__(self, session_id: str = "default", summarize: Optional[Callable] = None,
+                 token_budget: Optional[int] = None, max_rounds: Optional[int] = None,
+                 spill_threshold: Optional[int] = None, digest_max_tokens: Optional[int] = None,
+                 history_dir: Optional[str] = None):
+        self.session_id = session_id
+        self.summarize = summarize or self._summarize_with_llm  # async (previous_digest, messages, limit) -> str
+        self.token_budget = token_budget or config.api.context_token_budget
+        self.max_rounds = max_rounds or config.api.max_history_rounds
+        self.spill_threshold = spill_threshold or config.api.history_spill_threshold
+        self.digest_max_tokens = digest_max_tokens or config.api.context_digest_max_tokens
+        self.history_dir = history_dir or os.path.join(str(config.system.log_dir), "history")
+        self.messages: List[Tuple[Dict, int]] = []  # (消息, token数)，只保存尚未转存的近期消息
+        self.digest = ""
+        self._summarized = 0  # messages 中前多少条已并入摘要
+        self._spilled = 0     # 已转存到磁盘的消息数
+        self._compacting: Optional[Future] = None
+        self._generation = 0  # 非追加式修改（replace_last/clear/import_state）的次数
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.messages)
+
+    @property
+    def history_path(self) -> str:
+        return os.path.join(self.history_dir, f"{self._safe_id}.jsonl")
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.history_dir, f"{self._safe_id}.state.json")
+
+    @property
+    def _safe_id(self) -> str:
+        return re.sub(r'[^\w.-]', '_', self.session_id)
+
+    @property
+    def compacting(self) -> bool:
+        return self._compacting is not None and not self._compacting.done()
+
+    def append(self, message: Dict):
+        self.messages.append((message, message_tokens(message)))
+
+    def replace_last(self, message: Dict):
+        if self.messages:
+            self.messages[-1] = (message, message_tokens(message))
+            self._generation += 1
+        else:
+            self.append(message)
+
+    def clear(self):
+        self.messages.clear()
+        self.digest = ""
+        self._summarized = 0
+        self._generation += 1
+
+    def _window_start(self, budget: int) -> int:
+        """能放进预算的最早消息下标（至少保留最近一条）"""
+        used = 0
+        start = len(self.messages)
+        limit = max(len(self.messages) - self.max_rounds * 2, 0)
+        while start > limit:
+            tokens = self.messages[start - 1][1]
+            if used + tokens > budget and start < len(self.messages):
+                break
+            used += tokens
+            start -= 1
+        return start
+
+    def window(self) -> List[Dict]:
+        """本轮要发送的历史消息：[摘要] + 预算内的近期消息"""
+        budget = self.token_budget
+        digest_msg = None
+        if self.digest:
+            digest_msg = {"role": "system", "content": f"【早前对话摘要】\n{self.digest}"}
+            budget = max(budget - message_tokens(digest_msg), 0)
+        start = self._window_start(budget)
+        recent = [m for m, _ in self.messages[start:]]
+        # 窗口外但尚未并入摘要的消息只能丢弃，摘要完成前不补发
+        return ([digest_msg] if digest_msg else []) + recent
+
+    def schedule_compaction(self):
+        """在后台整理（不阻塞当前轮回复，也不依赖调用方的事件循环存活）；上一次整理未结束时跳过"""
+        if self.compacting:
+            return
+        self._compacting = asyncio.run_coroutine_threadsafe(self.compact(), _get_compaction_loop())
+
+    async def compact(self):
+        with self.lock:
+            generation = self._generation
+            start = self._window_start(self.token_budget - self.digest_max_tokens)
+            # 挤出窗口的消息按整轮（用户+助手）并入摘要
+            start -= start % 2
+            previous = self.digest
+            pending = [m for m, _ in self.messages[self._summarized:start]]
+        if pending:
+            try:
+                with span("context.summarize", session=self.session_id, messages=len(pending)):
+                    digest = await self.summarize(previous, pending, self.digest_max_tokens)
+            except Exception as e:
+                logger.warning(f"对话摘要失败，下次再试: {e}")
+                digest = ""
+            with self.lock:
+                if self._generation != generation:
+                    logger.debug(f"会话 {self.session_id} 整理期间上下文已改写，放弃本次整理")
+                    return
+                if digest:
+                    self.digest = digest.strip()
+                    self._summarized = start
+        await self._spill(generation)
+
+    async def _spill(self, generation: int):
+        """把已摘要的最早消息从内存移到会话历史文件（写文件在线程池中进行，写入失败时放回内存）"""
+        with self.lock:
+            if self._generation != generation:
+                return
+            count = self._summarized
+            if len(self.messages) > self.spill_threshold * 2:
+                # 摘要长期失败时也不能让内存无限增长
+                count = max(count, len(self.messages) - self.spill_threshold)
+            count -= count % 2
+            if len(self.messages) <= self.spill_threshold or count <= 0:
+                return
+            spilled = [m for m, _ in self.messages[:count]]
+            # 先从内存移除再写文件：期间上下文被改写也不会把同一批消息再转存一次
+            removed = self.messages[:count]
+            del self.messages[:count]
+            summarized = self._summarized
+            self._summarized = max(summarized - count, 0)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_history, spilled)
+        except Exception as e:
+            logger.warning(f"会话 {self.session_id} 历史转存失败，下次再试: {e}")
+            with self.lock:
+                if self._generation == generation:
+                    self.messages[:0] = removed
+                    self._summarized = summarized
+            return
+        self._spilled += count
+        logger.debug(f"会话 {self.session_id} 已转存 {count} 条历史消息到 {self.history_path}")
+
+    def _write_history(self, messages: List[Dict]):
+        os.makedirs(self.history_dir, exist_ok=True)
+        with open(self.history_path, 'a', encoding='utf-8') as f:
+            for message in messages:
+                f.write(json.dumps(message, ensure_ascii=False) + "\n")
+
+    def export_state(self) -> Dict:
+        """内存中的会话状态（摘要 + 未转存的消息），用于会话被淘汰时落盘"""
+        return {
+            "digest": self.digest,
+            "summarized": self._summarized,
+            "messages": [m for m, _ in self.messages],
+        }
+
+    def import_state(self, state: Dict):
+        self.digest = state.get("digest", "")
+        self.messages = [(m, message_tokens(m)) for m in state.get("messages", [])]
+        self._summarized = min(state.get("summarized", 0), len(self.messages))
+        self._generation += 1
+
+    def save_state(self, state: Dict):
+        """写入会话状态文件（先写临时文件再替换，中途退出不会留下半个文件）"""
+        os.makedirs(self.history_dir, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    def restore_state(self) -> bool:
+        """从状态文件恢复并删除该文件；没有状态文件时返回False"""
+        if not os.path.exists(self.state_path):
+            return False
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self.import_state(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"会话 {self.session_id} 状态恢复失败: {e}")
+            return False
+        self.discard_state()
+        return True
+
+    def discard_state(self):
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+
+    def load_history(self) -> List[Dict]:
+        """完整历史（磁盘 + 内存），用于导出或回看"""
+        history = []
+        if os.path.exists(self.history_path):
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                history = [json.loads(line) for line in f if line.strip()]
+        return history + [m for m, _ in self.messages]
+
+    @staticmethod
+    async def _summarize_with_llm(previous: str, messages: List[Dict], limit: int) -> str:
+        from llm_gateway import get_llm_gateway
+        role_names = {"user": "用户", "assistant": "娜迦"}
+        dialog = "\n".join(f"{role_names.get(m['role'], m['role'])}: {m.get('content') or ''}" for m in messages)
+        prompt = SUMMARY_PROMPT.format(
+            previous=f"已有摘要：\n{previous}\n" if previous else "",
+            dialog=dialog,
+            limit=limit,
+        )
+        response = await get_llm_gateway().create(
+            model=config.api.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=limit * 2,
+        )
+        return response.choices[0].message.content or ""
+
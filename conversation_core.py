@@ -3,15 +3,19 @@ import os
 # import asyncio # 日志与系统
 from datetime import datetime # 时间
 from mcpserver.mcp_manager import get_mcp_manager # 多功能管理
+from mcpserver.tool_scheduler import ToolCallScheduler # 工具调用并发调度
+from mcpserver.tool_request_parser import ToolRequestParser, parse_tool_calls # 工具调用块增量解析
 from agents.extensions.handoff_prompt import RECOMMENDED_PROMPT_PREFIX # handoff提示词
 # from mcpserver.agent_playwright_master import ControllerAgent, BrowserAgent, ContentAgent # 导入浏览器相关类
-from openai import OpenAI,AsyncOpenAI # LLM
+from llm_gateway import get_llm_gateway # LLM统一网关（连接复用、重试、并发预算）
+from session_manager import SessionManager # 多会话上下文
+from log_sink import get_log_sink # 对话日志后台写入
+from tracing import span # 链路追踪（关闭时为空操作）
 # import difflib # 模糊匹配
 import sys
 import json
 import traceback
 import time # 时间戳打印
-import re # 添加re模块导入
 from typing import List, Dict # 修复List未导入
 # 恢复树状思考系统导入
 from thinking import TreeThinkingEngine # 树状思考引擎
@@ -60,10 +64,14 @@ _QUICK_MODEL_MANAGER_INITIALIZED=False
 class NagaConversation: # 对话主类
     def __init__(self):
         self.mcp = get_mcp_manager()
-        self.messages = []
+        self.sessions = SessionManager()  # 按session_id隔离的对话上下文，未指定时使用默认会话
         self.dev_mode = False
-        self.client = OpenAI(api_key=config.api.api_key, base_url=config.api.base_url.rstrip('/') + '/')
-        self.async_client = AsyncOpenAI(api_key=config.api.api_key, base_url=config.api.base_url.rstrip('/') + '/')
+        self.llm = get_llm_gateway()
+        self.tool_scheduler = ToolCallScheduler(
+            per_service_limit=config.handoff.tool_concurrency_per_service,
+            default_timeout=config.handoff.tool_call_timeout,
+        )
+        self._system_prompt_cache = None  # (服务指纹, 系统提示词)，服务注册或提示词配置变化时重建
         
         # 初始化MCP服务系统
         self._init_mcp_services()
@@ -146,49 +154,25 @@ class NagaConversation: # 对话主类
             return  # 开发者模式不写日志
         d = datetime.now().strftime('%Y-%m-%d')
         t = datetime.now().strftime('%H:%M:%S')
-        
-        # 确保日志目录存在
-        log_dir = config.system.log_dir
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir, exist_ok=True)
-            logger.info(f"已创建日志目录: {log_dir}")
-        
-        f = os.path.join(log_dir, f'{d}.txt')
-        with open(f, 'a', encoding='utf-8') as w:
-            w.write('-'*50 + f'\n时间: {d} {t}\n用户: {u}\nRen: {a}\n\n')
+        # 交给后台写入线程，不在事件循环上做磁盘IO
+        get_log_sink().write(d, '-'*50 + f'\n时间: {d} {t}\n用户: {u}\nRen: {a}\n\n')
 
     async def _call_llm(self, messages: List[Dict]) -> Dict:
         """调用LLM API"""
         try:
-            resp = await self.async_client.chat.completions.create(
-                model=config.api.model, 
-                messages=messages, 
-                temperature=config.api.temperature, 
-                max_tokens=config.api.max_tokens, 
-                stream=False  # 工具调用循环中不使用流式
-            )
+            with span("llm.call", model=config.api.model, messages=len(messages)) as s:
+                resp = await self.llm.create(
+                    model=config.api.model, 
+                    messages=messages, 
+                    temperature=config.api.temperature, 
+                    max_tokens=config.api.max_tokens
+                )  # 工具调用循环中不使用流式
+                if s:
+                    s.set(content=resp.choices[0].message.content)
             return {
                 'content': resp.choices[0].message.content,
                 'status': 'success'
             }
-        except RuntimeError as e:
-            if "handler is closed" in str(e):
-                logger.debug(f"忽略连接关闭异常: {e}")
-                # 重新创建客户端并重试
-                self.async_client = AsyncOpenAI(api_key=config.api.api_key, base_url=config.api.base_url.rstrip('/') + '/')
-                resp = await self.async_client.chat.completions.create(
-                    model=config.api.model, 
-                    messages=messages, 
-                    temperature=config.api.temperature, 
-                    max_tokens=config.api.max_tokens, 
-                    stream=False
-                )
-                return {
-                    'content': resp.choices[0].message.content,
-                    'status': 'success'
-                }
-            else:
-                raise
         except Exception as e:
             logger.error(f"LLM API调用失败: {e}")
             return {
@@ -196,151 +180,100 @@ class NagaConversation: # 对话主类
                 'status': 'error'
             }
 
+    async def _call_llm_stream(self, messages: List[Dict], trace_parent=None):
+        """流式调用LLM API，逐个产出内容增量"""
+        # 跨越多次 yield，不作为当前 span，结束时手动 end()
+        s = span("llm.stream", parent=trace_parent or None, model=config.api.model, messages=len(messages))
+        chunks = 0
+        error = None
+        try:
+            async for chunk in self.llm.stream(
+                model=config.api.model,
+                messages=messages,
+                temperature=config.api.temperature,
+                max_tokens=config.api.max_tokens
+            ):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if s and not chunks:
+                        s.set(first_chunk_ms=round((time.time_ns() - s.start_ns) / 1e6, 3))
+                    chunks += 1
+                    yield chunk.choices[0].delta.content
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            s.set(chunks=chunks)
+            s.end(error)
+
     # 工具调用循环相关方法
     def _parse_tool_calls(self, content: str) -> list:
         """解析TOOL_REQUEST格式的工具调用，支持MCP和Agent两种类型"""
-        tool_calls = []
-        tool_request_start = "<<<[TOOL_REQUEST]>>>"
-        tool_request_end = "<<<[END_TOOL_REQUEST]>>>"
-        start_index = 0
-        call_count = 0
-        
-        print(f"[DEBUG] 开始解析工具调用，内容长度: {len(content)}")
-        
-        while True:
-            start_pos = content.find(tool_request_start, start_index)
-            if start_pos == -1:
-                break
-            end_pos = content.find(tool_request_end, start_pos)
-            if end_pos == -1:
-                start_index = start_pos + len(tool_request_start)
-                continue
-                
-            call_count += 1
-            tool_content = content[start_pos + len(tool_request_start):end_pos].strip()
-            print(f"[DEBUG] 找到工具调用{call_count}，原始内容: {tool_content}")
-            
-            # 先解析所有参数
-            tool_args = {}
-            param_pattern = r'(\w+)\s*:\s*「始」([\s\S]*?)「末」'
-            for match in re.finditer(param_pattern, tool_content):
-                key = match.group(1)
-                value = match.group(2).strip()
-                tool_args[key] = value
-            
-            print(f"[DEBUG] 工具调用{call_count}解析参数: {tool_args}")
-            
-            # 判断调用类型
-            agent_type = tool_args.get('agentType', 'mcp').lower()
-            
-            if agent_type == 'agent':
-                # Agent类型调用格式
-                agent_name = tool_args.get('agent_name')
-                query = tool_args.get('query')
-                if agent_name and query:
-                    tool_call = {
-                        'name': 'agent_call',
-                        'args': {
-                            'agentType': 'agent',
-                            'agent_name': agent_name,
-                            'query': query
-                        }
-                    }
-                    tool_calls.append(tool_call)
-                    print(f"[DEBUG] 解析为Agent调用: {tool_call}")
-            else:
-                # MCP类型调用格式（包括默认mcp和旧格式）
-                tool_name = tool_args.get('tool_name')
-                if tool_name:
-                    # 新格式：有service_name
-                    if 'service_name' in tool_args:
-                        tool_call = {
-                            'name': tool_name,
-                            'args': tool_args
-                        }
-                        tool_calls.append(tool_call)
-                        print(f"[DEBUG] 解析为MCP调用(新格式): {tool_call}")
-                    else:
-                        # 旧格式：tool_name作为服务名
-                        service_name = tool_name
-                        tool_args['service_name'] = service_name
-                        tool_args['agentType'] = 'mcp'
-                        tool_call = {
-                            'name': tool_name,
-                            'args': tool_args
-                        }
-                        tool_calls.append(tool_call)
-                        print(f"[DEBUG] 解析为MCP调用(旧格式): {tool_call}")
-            
-            start_index = end_pos + len(tool_request_end)
-        
-        print(f"[DEBUG] 工具调用解析完成，共解析到 {len(tool_calls)} 个调用")
+        with span("tool.parse", chars=len(content)) as s:
+            tool_calls = parse_tool_calls(content)
+            s.set(calls=len(tool_calls))
         return tool_calls
 
-    async def _execute_tool_calls(self, tool_calls: list) -> str:
-        """执行工具调用"""
-        results = []
-        for i, tool_call in enumerate(tool_calls):
+    async def _execute_tool_call(self, tool_call: dict) -> str:
+        """执行单个工具调用，返回结果文本"""
+        tool_name = tool_call['name']
+        with span("tool.call", tool=tool_name, agent_type=tool_call['args'].get('agentType', 'mcp').lower()) as s:
+            if s:
+                s.set(args=tool_call['args'])
+            result = await self._dispatch_tool_call(tool_call)
+            if s:
+                s.set(result=result)
+        return f"来自工具 \"{tool_name}\" 的结果:\n{result}"
+
+    async def _dispatch_tool_call(self, tool_call: dict):
+        """按agentType把工具调用交给AgentManager或MCP handoff"""
+        tool_name = tool_call['name']
+        args = tool_call['args']
+        agent_type = args.get('agentType', 'mcp').lower()
+        
+        # 根据agentType分流处理
+        if agent_type == 'agent':
+            # Agent类型：交给AgentManager处理
             try:
-                print(f"[DEBUG] 开始执行工具调用{i+1}: {tool_call['name']}")
+                from mcpserver.agent_manager import get_agent_manager
+                agent_manager = get_agent_manager()
                 
-                # 解析工具调用格式
-                tool_name = tool_call['name']
-                args = tool_call['args']
-                agent_type = args.get('agentType', 'mcp').lower()
+                agent_name = args.get('agent_name')
+                query = args.get('query')
                 
-                print(f"[DEBUG] 工具类型: {agent_type}, 参数: {args}")
-                
-                # 根据agentType分流处理
-                if agent_type == 'agent':
-                    # Agent类型：交给AgentManager处理
-                    try:
-                        from mcpserver.agent_manager import get_agent_manager
-                        agent_manager = get_agent_manager()
-                        
-                        agent_name = args.get('agent_name')
-                        query = args.get('query')
-                        
-                        print(f"[DEBUG] Agent调用: {agent_name}, query: {query}")
-                        
-                        if not agent_name or not query:
-                            result = "Agent调用失败: 缺少agent_name或query参数"
-                        else:
-                            # 直接调用Agent
-                            result = await agent_manager.call_agent(agent_name, query)
-                            if result.get("status") == "success":
-                                result = result.get("result", "")
-                            else:
-                                result = f"Agent调用失败: {result.get('error', '未知错误')}"
-                                
-                    except Exception as e:
-                        result = f"Agent调用失败: {str(e)}"
-                        
+                if not agent_name or not query:
+                    result = "Agent调用失败: 缺少agent_name或query参数"
                 else:
-                    # MCP类型：走handoff流程
-                    service_name = args.get('service_name')
-                    actual_tool_name = args.get('tool_name', tool_name)
-                    # 只过滤掉系统参数，保留tool_name给Agent使用
-                    tool_args = {k: v for k, v in args.items() 
-                               if k not in ['service_name', 'agentType']}
-                    
-                    print(f"[DEBUG] MCP调用: service={service_name}, tool={actual_tool_name}, args={tool_args}")
-                    
-                    if not service_name:
-                        result = "MCP调用失败: 缺少service_name参数"
+                    # 直接调用Agent
+                    result = await agent_manager.call_agent(agent_name, query)
+                    if result.get("status") == "success":
+                        result = result.get("result", "")
                     else:
-                        result = await self.mcp.unified_call(
-                        service_name=service_name,
-                        tool_name=actual_tool_name,
-                        args=tool_args
-                    )
-                
-                print(f"[DEBUG] 工具调用{i+1}执行结果: {result}")
-                results.append(f"来自工具 \"{tool_name}\" 的结果:\n{result}")
+                        result = f"Agent调用失败: {result.get('error', '未知错误')}"
+                        
             except Exception as e:
-                error_result = f"执行工具 {tool_call['name']} 时发生错误：{str(e)}"
-                print(f"[DEBUG] 工具调用{i+1}执行异常: {error_result}")
-                results.append(error_result)
+                result = f"Agent调用失败: {str(e)}"
+                
+        else:
+            # MCP类型：走handoff流程
+            service_name = args.get('service_name')
+            actual_tool_name = args.get('tool_name', tool_name)
+            # 只过滤掉系统参数，保留tool_name给Agent使用
+            tool_args = {k: v for k, v in args.items() 
+                       if k not in ['service_name', 'agentType']}
+            
+            if not service_name:
+                result = "MCP调用失败: 缺少service_name参数"
+            else:
+                result = await self.mcp.unified_call(
+                service_name=service_name,
+                tool_name=actual_tool_name,
+                args=tool_args
+            )
+        return result
+
+    async def _execute_tool_calls(self, tool_calls: list) -> str:
+        """执行工具调用：相互独立的调用并发执行，结果按原顺序拼接"""
+        results = await self.tool_scheduler.run(tool_calls, self._execute_tool_call)
         return "\n\n---\n\n".join(results)
 
     async def handle_tool_call_loop(self, messages: List[Dict], is_streaming: bool = False) -> Dict:
@@ -351,25 +284,14 @@ class NagaConversation: # 对话主类
         current_ai_content = ''
         while recursion_depth < max_recursion:
             try:
-                resp = await self._call_llm(current_messages)
-                current_ai_content = resp.get('content', '')
-                
-                # DEBUG: 输出LLM回复内容，方便检查工具调用格式
-                print(f"[DEBUG] 第{recursion_depth + 1}轮LLM回复:")
-                print(f"[DEBUG] 回复内容: {current_ai_content}")
-                
-                tool_calls = self._parse_tool_calls(current_ai_content)
-                print(f"[DEBUG] 解析到工具调用数量: {len(tool_calls)}")
-                
-                if not tool_calls:
-                    print(f"[DEBUG] 无工具调用，退出循环")
-                    break
-                    
-                # DEBUG: 输出解析到的工具调用详情
-                for i, tool_call in enumerate(tool_calls):
-                    print(f"[DEBUG] 工具调用{i+1}: {tool_call}")
-                
-                tool_results = await self._execute_tool_calls(tool_calls)
+                with span("tool_loop.round", depth=recursion_depth + 1) as s:
+                    resp = await self._call_llm(current_messages)
+                    current_ai_content = resp.get('content', '')
+                    tool_calls = self._parse_tool_calls(current_ai_content)
+                    s.set(calls=len(tool_calls))
+                    if not tool_calls:
+                        break
+                    tool_results = await self._execute_tool_calls(tool_calls)
                 current_messages.append({'role': 'assistant', 'content': current_ai_content})
                 current_messages.append({'role': 'user', 'content': tool_results})
                 recursion_depth += 1
@@ -382,6 +304,66 @@ class NagaConversation: # 对话主类
             'messages': current_messages
         }
 
+    async def stream_tool_call_loop(self, messages: List[Dict], is_streaming: bool = True):
+        """流式工具调用循环
+
+        每轮边生成边产出 ("text", 增量)：工具调用块之外的文本立即输出，块内内容只缓冲；
+        每个工具调用块一结束就提交执行，一轮结束后等待全部结果并进入下一轮。最后产出 ("done", 结果)，结果格式同 handle_tool_call_loop。
+        """
+        recursion_depth = 0
+        max_recursion = config.handoff.max_loop_stream if is_streaming else config.handoff.max_loop_non_stream
+        current_messages = messages.copy()
+        current_ai_content = ''
+        while recursion_depth < max_recursion:
+            parser = ToolRequestParser()
+            batch = self.tool_scheduler.batch(self._execute_tool_call)
+            parts = []
+            # 区间跨越 yield，不用 with；提交工具调用时临时设为当前 span，工具调用任务挂到本轮下
+            round_span = span("tool_loop.round", depth=recursion_depth + 1, stream=True)
+            try:
+                try:
+                    async for delta in self._call_llm_stream(current_messages, trace_parent=round_span):
+                        parts.append(delta)
+                        text, tool_calls = parser.feed(delta)
+                        # 结束标记一到就开始执行，不等模型把整段回复说完
+                        if tool_calls:
+                            with round_span.activate():
+                                for tool_call in tool_calls:
+                                    batch.submit(tool_call)
+                        if text:
+                            yield ("text", text)
+                    tail = parser.flush()
+                    if tail:
+                        yield ("text", tail)
+                except Exception as e:
+                    logger.error(f"LLM API调用失败: {e}")
+                    if not parts:
+                        current_ai_content = f"API调用失败: {str(e)}"
+                        yield ("text", current_ai_content)
+                        break
+                except BaseException:
+                    batch.cancel()
+                    raise
+                current_ai_content = ''.join(parts)
+                if not batch:
+                    break
+                try:
+                    tool_results = "\n\n---\n\n".join(await batch.results())
+                    current_messages.append({'role': 'assistant', 'content': current_ai_content})
+                    current_messages.append({'role': 'user', 'content': tool_results})
+                    recursion_depth += 1
+                except Exception as e:
+                    print(f"工具调用循环错误: {e}")
+                    break
+            finally:
+                round_span.set(calls=len(batch))
+                round_span.end()
+        yield ("done", {
+            'content': current_ai_content,
+            'recursion_depth': recursion_depth,
+            'messages': current_messages
+        })
+
     def handle_llm_response(self, a, mcp):
         # 只保留普通文本流式输出逻辑 #
         async def text_stream():
@@ -389,25 +371,64 @@ class NagaConversation: # 对话主类
                 yield ("Ren", line)
         return text_stream()
 
+    @property
+    def context(self):
+        """默认会话（本地UI/命令行）的上下文窗口"""
+        return self.sessions.get().context
+
+    @property
+    def messages(self) -> List[Dict]:
+        """内存中的近期对话历史（更早的已摘要并转存磁盘）"""
+        return [message for message, _ in self.context.messages]
+
+    def _services_fingerprint(self) -> tuple:
+        """服务注册表与提示词配置的轻量指纹，每轮只比较对象身份，不重建服务列表"""
+        from mcpserver.mcp_registry import MCP_REGISTRY, MANIFEST_CACHE
+        try:
+            from mcpserver.agent_registry import get_agent_registry
+            agents = tuple((name, id(agent)) for name, agent in get_agent_registry().agents.items())
+        except Exception:
+            agents = ()
+        return (
+            tuple((name, id(instance)) for name, instance in MCP_REGISTRY.items()),
+            tuple((name, id(manifest)) for name, manifest in MANIFEST_CACHE.items()),
+            tuple(self.mcp.services),
+            agents,
+            config.prompts.naga_system_prompt,
+        )
+
+    def get_system_prompt(self) -> str:
+        """返回缓存的系统提示词；内容不含逐轮变化的信息，保证前缀在各轮之间逐字节一致"""
+        fingerprint = self._services_fingerprint()
+        cached = self._system_prompt_cache
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        # 添加handoff提示词
+        system_prompt = f"{RECOMMENDED_PROMPT_PREFIX}\n{config.prompts.naga_system_prompt}"
+        # 获取过滤后的服务列表
+        services_text = self._format_services_for_prompt(self.mcp.get_available_services_filtered())
+        content = system_prompt.format(**services_text)
+        self._system_prompt_cache = (fingerprint, content)
+        return content
+
+    def invalidate_system_prompt(self):
+        """强制下一轮重建系统提示词（如本地城市等外部信息变化时）"""
+        self._system_prompt_cache = None
+
     def _format_services_for_prompt(self, available_services: dict) -> str:
         """格式化可用服务列表为prompt字符串，MCP服务和Agent服务分开，包含具体调用格式"""
         mcp_services = available_services.get("mcp_services", [])
         agent_services = available_services.get("agent_services", [])
         
-        # 获取本地城市信息和当前时间
+        # 获取本地城市信息（当前时间加在每轮用户消息开头，不放进系统提示词）
         local_city = "未知城市"
-        current_time = ""
         try:
             # 从WeatherTimeAgent获取本地城市信息
             from mcpserver.agent_weather_time.agent_weather_time import WeatherTimeTool
             weather_tool = WeatherTimeTool()
             local_city = getattr(weather_tool, '_local_city', '未知城市') or '未知城市'
-            
-            # 获取当前时间
-            from datetime import datetime
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         except Exception as e:
-            print(f"[DEBUG] 获取本地信息失败: {e}")
+            logger.debug(f"获取本地信息失败: {e}")
         
         # 格式化MCP服务列表，包含具体调用格式
         mcp_list = []
@@ -495,7 +516,7 @@ class NagaConversation: # 对话主类
             pass
         
         # 添加本地信息说明
-        local_info = f"\n\n【当前环境信息】\n- 本地城市: {local_city}\n- 当前时间: {current_time}\n\n【使用说明】\n- 天气/时间查询时，请使用上述本地城市信息作为city参数\n- 所有时间相关查询都基于当前系统时间"
+        local_info = f"\n\n【当前环境信息】\n- 本地城市: {local_city}\n- 当前时间: 见用户消息前的【当前时间】\n\n【使用说明】\n- 天气/时间查询时，请使用上述本地城市信息作为city参数\n- 所有时间相关查询都基于当前系统时间"
         
         # 返回格式化的服务列表
         result = {
@@ -505,7 +526,32 @@ class NagaConversation: # 对话主类
         
         return result
 
-    async def process(self, u, is_voice_input=False):  # 添加is_voice_input参数
+    def build_messages(self, context, u: str) -> List[Dict]:
+        """组装本轮请求：系统提示词 + 摘要与近期历史 + 带当前时间前缀的用户消息"""
+        sysmsg = {"role": "system", "content": self.get_system_prompt()}  # 缓存的系统提示词，各轮前缀不变
+        msgs = [sysmsg] if sysmsg else []
+        msgs += context.window()  # 摘要 + token预算内的近期历史
+        # 逐轮变化的时间只加在本轮用户消息开头（历史里记录原始消息），系统提示词与历史前缀保持不变，命中模型服务端的前缀缓存
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        msgs.append({"role": "user", "content": f"【当前时间】{now}\n{u}"})
+        return msgs
+
+    @staticmethod
+    def record_turn(context, u: str, a: str):
+        """把一轮问答写入会话历史，并在后台整理"""
+        context.append({"role": "user", "content": u})
+        context.append({"role": "assistant", "content": a})
+        context.schedule_compaction()
+
+    async def process(self, u, is_voice_input=False, session_id=None):  # 添加is_voice_input参数
+        session = self.sessions.get(session_id)
+        with span("conversation.turn", session=session.session_id):
+            async with session.turn():  # 同一会话的请求依次处理，不同会话互不阻塞
+                async for item in self._process(session, u, is_voice_input):
+                    yield item
+
+    async def _process(self, session, u, is_voice_input=False):
+        context = session.context
         try:
             # 开发者模式优先判断
             if u.strip() == "#devmode":
@@ -540,41 +586,35 @@ class NagaConversation: # 对话主类
             # except Exception as e:
             #     logger.error(f"MCP记忆查询失败: {e}")
             
-            # 添加handoff提示词
-            system_prompt = f"{RECOMMENDED_PROMPT_PREFIX}\n{config.prompts.naga_system_prompt}"
-            
-            # 获取过滤后的服务列表
-            available_services = self.mcp.get_available_services_filtered()
-            services_text = self._format_services_for_prompt(available_services)
-            
-            sysmsg = {"role": "system", "content": system_prompt.format(**services_text)}  # 直接使用系统提示词
-            msgs = [sysmsg] if sysmsg else []
-            msgs += self.messages[-20:] + [{"role": "user", "content": u}]
-
-            print(f"GTP请求发送：{now()}")  # AI请求前
+            with session.lock:
+                msgs = self.build_messages(context, u)
             
-            # 非线性思考判断：启动后台异步判断任务
+            # 非线性思考判断：启动后台异步判断任务；本地估计难度够高时思考路线同时推测性开始生成
             thinking_task = None
+            speculative_task = None
             if hasattr(self, 'tree_thinking') and self.tree_thinking and getattr(self.tree_thinking, 'is_enabled', False):
                 # 启动异步思考判断任务
                 import asyncio
                 thinking_task = asyncio.create_task(self._async_thinking_judgment(u))
+                speculative_task = self._start_speculative_thinking(u, thinking_task)
             
-            # 普通模式：走工具调用循环（不等待思考树判断）
+            # 普通模式：走流式工具调用循环（不等待思考树判断），文本边生成边输出
             try:
-                result = await self.handle_tool_call_loop(msgs, is_streaming=True)
+                result = None
+                async for kind, payload in self.stream_tool_call_loop(msgs, is_streaming=True):
+                    if kind == "text":
+                        yield ("Ren", payload)
+                    else:
+                        result = payload
                 final_content = result['content']
                 recursion_depth = result['recursion_depth']
                 
                 if recursion_depth > 0:
                     print(f"工具调用循环完成，共执行 {recursion_depth} 轮")
                 
-                # 流式输出最终结果
-                for line in final_content.splitlines():
-                    yield ("Ren", line)
-                
                 # 保存对话历史
-                self.messages += [{"role": "user", "content": u}, {"role": "assistant", "content": final_content}]
+                with session.lock:
+                    self.record_turn(context, u, final_content)
                 self.save_log(u, final_content)
                 
                 # 完全禁用GRAG记忆存储
@@ -586,40 +626,46 @@ class NagaConversation: # 对话主类
                 #         logger.error(f"GRAG记忆存储失败: {e}")
                 
                 # 检查异步思考判断结果，如果建议深度思考则提示用户
-                if thinking_task and not thinking_task.done():
-                    # 等待思考判断完成（最多等待3秒）
+                should_think = False
+                if thinking_task:
+                    # 等待思考判断完成（最多等待3秒，已完成则立即返回）
                     try:
-                        await asyncio.wait_for(thinking_task, timeout=3.0)
-                        if thinking_task.result():
-                            yield ("Ren", "\n💡 这个问题较为复杂，下面我会更详细地解释这个流程...")
-                            # 启动深度思考
-                            try:
-                                thinking_result = await self.tree_thinking.think_deeply(u)
-                                if thinking_result and "answer" in thinking_result:
-                                    # 直接使用thinking系统的结果，避免重复处理
-                                    yield ("Ren", f"\n{thinking_result['answer']}")
-                                    
-                                    # 更新对话历史
-                                    final_thinking_answer = thinking_result['answer']
-                                    self.messages[-1] = {"role": "assistant", "content": final_content + "\n\n" + final_thinking_answer}
-                                    self.save_log(u, final_content + "\n\n" + final_thinking_answer)
-                                    
-                                    # GRAG记忆存储（开发者模式不写入）
-                                    if self.memory_manager and not self.dev_mode:
-                                        try:
-                                            await self.memory_manager.add_conversation_memory(u, final_content + "\n\n" + final_thinking_answer)
-                                        except Exception as e:
-                                            logger.error(f"GRAG记忆存储失败: {e}")
-                            except Exception as e:
-                                logger.error(f"深度思考处理失败: {e}")
-                                yield ("Ren", f"🌳 深度思考系统出错: {str(e)}")
+                        should_think = await asyncio.wait_for(thinking_task, timeout=3.0)
                     except asyncio.TimeoutError:
-                        # 超时取消任务
-                        thinking_task.cancel()
+                        pass  # wait_for 超时已取消判断任务
                     except Exception as e:
                         logger.debug(f"思考判断任务异常: {e}")
+                if not should_think:
+                    if speculative_task:
+                        speculative_task.cancel()  # 推测生成的思考路线作废
+                else:
+                    yield ("Ren", "\n💡 这个问题较为复杂，下面我会更详细地解释这个流程...")
+                    # 启动深度思考（推测性任务已在生成思考路线时直接沿用）
+                    try:
+                        thinking_result = await (speculative_task or self.tree_thinking.think_deeply(u))
+                        if thinking_result and "answer" in thinking_result:
+                            # 直接使用thinking系统的结果，避免重复处理
+                            yield ("Ren", f"\n{thinking_result['answer']}")
+                            
+                            # 更新对话历史
+                            final_thinking_answer = thinking_result['answer']
+                            with session.lock:
+                                context.replace_last({"role": "assistant", "content": final_content + "\n\n" + final_thinking_answer})
+                            self.save_log(u, final_content + "\n\n" + final_thinking_answer)
+                            
+                            # GRAG记忆存储（开发者模式不写入）
+                            if self.memory_manager and not self.dev_mode:
+                                try:
+                                    await self.memory_manager.add_conversation_memory(u, final_content + "\n\n" + final_thinking_answer)
+                                except Exception as e:
+                                    logger.error(f"GRAG记忆存储失败: {e}")
+                    except Exception as e:
+                        logger.error(f"深度思考处理失败: {e}")
+                        yield ("Ren", f"🌳 深度思考系统出错: {str(e)}")
                 
             except Exception as e:
+                if speculative_task:
+                    speculative_task.cancel()
                 print(f"工具调用循环失败: {e}")
                 yield ("Ren", f"[MCP异常]: {e}")
                 return
@@ -635,32 +681,50 @@ class NagaConversation: # 对话主类
     async def get_response(self, prompt: str, temperature: float = 0.7) -> str:
         """为树状思考系统等提供API调用接口""" # 统一接口
         try:
-            response = await self.async_client.chat.completions.create(
+            response = await self.llm.create(
                 model=config.api.model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=temperature,
                 max_tokens=config.api.max_tokens
             )
             return response.choices[0].message.content
-        except RuntimeError as e:
-            if "handler is closed" in str(e):
-                logger.debug(f"忽略连接关闭异常，重新创建客户端: {e}")
-                # 重新创建客户端并重试
-                self.async_client = AsyncOpenAI(api_key=config.api.api_key, base_url=config.api.base_url.rstrip('/') + '/')
-                response = await self.async_client.chat.completions.create(
-                    model=config.api.model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=temperature,
-                    max_tokens=config.api.max_tokens
-                )
-                return response.choices[0].message.content
-            else:
-                logger.error(f"API调用失败: {e}")
-                return f"API调用出错: {str(e)}"
         except Exception as e:
             logger.error(f"API调用失败: {e}")
             return f"API调用出错: {str(e)}"
 
+    async def get_response_stream(self, prompt: str, temperature: float = 0.7):
+        """get_response 的流式版本，逐个产出内容增量；调用方可随时中止（树状思考据此提前取消路线）"""
+        stream = self.llm.stream(
+            model=config.api.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=config.api.max_tokens
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.aclose()  # 立即释放并发额度与连接，不等垃圾回收
+
+    def _start_speculative_thinking(self, question: str, judgment):
+        """本地快速估计难度达到阈值时，与主回答并行启动深度思考；最终判断 judgment 为否时它会自行放弃"""
+        from thinking.config import TREE_THINKING_CONFIG
+        if not TREE_THINKING_CONFIG.get("speculative_start", True):
+            return None
+        try:
+            estimate = self.tree_thinking.difficulty_judge.quick_assessment(question)
+        except Exception as e:
+            logger.debug(f"快速难度估计失败: {e}")
+            return None
+        if estimate["score"] < TREE_THINKING_CONFIG.get("speculative_threshold", 3.2):
+            return None
+        logger.info(f"快速估计难度 {estimate['score']:.2f}，推测性启动深度思考")
+        import asyncio
+        return asyncio.create_task(self.tree_thinking.think_deeply(
+            question, difficulty_assessment=estimate, proceed=judgment
+        ))
+
     async def _async_thinking_judgment(self, question: str) -> bool:
         """异步判断问题是否需要深度思考
         
@@ -0,0 +1,416 @@
+# llm_gateway.py # 统一的大模型调用网关：按 base_url 复用长连接、全局并发预算、抖动重试、相同请求合并
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI
+
+from config import config
+
+logger = logging.getLogger("LLMGateway")
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRY_BACKOFF = 0.5        # 首次重试的退避上限（秒），之后指数增长，实际等待在 [0, 上限] 内随机
+MAX_RETRY_WAIT = 20.0      # 单次退避（含 Retry-After）上限
+KEEPALIVE_EXPIRY = 120.0   # 空闲长连接保留秒数，覆盖常见的对话间隔
+EXTRA_BODY_PARAMS = ("format", "options", "keep_alive")  # Ollama 等兼容服务的私有字段，SDK 不接受，需放入 extra_body
+
+try:
+    import h2  # noqa: F401  # 安装了 h2 才能走 HTTP/2
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+
+def _max_concurrency() -> int:
+    return config.api.max_concurrency
+
+
+def _max_retries() -> int:
+    return config.api.retry_count if config.api.retry_count is not None else 2
+
+
+def _normalize(base_url: Optional[str], api_key: Optional[str]) -> Tuple[str, str]:
+    return (base_url or config.api.base_url).rstrip('/') + '/', api_key or config.api.api_key
+
+
+def _split_extra(params: Dict[str, Any]) -> Dict[str, Any]:
+    """把 SDK 不认识的私有字段移入 extra_body（直接作为关键字参数传给 SDK 会抛 TypeError）"""
+    extra = {k: params.pop(k) for k in EXTRA_BODY_PARAMS if k in params}
+    if extra:
+        params['extra_body'] = {**extra, **(params.get('extra_body') or {})}
+    return params
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=_max_concurrency() * 2,
+                        max_keepalive_connections=_max_concurrency(),
+                        keepalive_expiry=KEEPALIVE_EXPIRY)
+
+
+class _Budget:
+    """跨线程、跨事件循环共享的并发预算，异步与同步调用共用同一份额度"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._used = 0
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()  # (loop, future) 或 (None, threading.Event)
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._used < self.limit and not self._waiters:
+                self._used += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            if not waiter[1].cancelled():
+                self.release()  # 额度已转交给本协程但它被取消了，归还
+            raise
+
+    def acquire_sync(self):
+        with self._lock:
+            if self._used < self.limit and not self._waiters:
+                self._used += 1
+                return
+            event = threading.Event()
+            self._waiters.append((None, event))
+        event.wait()
+
+    def release(self):
+        """归还额度：有等待者时直接转交，不减计数"""
+        with self._lock:
+            while self._waiters:
+                loop, waiter = self._waiters.popleft()
+                if loop is None:
+                    waiter.set()
+                    return
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(self._hand_over, waiter)
+                    return
+            self._used -= 1
+
+    def _hand_over(self, future: asyncio.Future):
+        if future.cancelled():
+            self.release()  # 等待者在转交前已取消，额度继续往下传
+        else:
+            future.set_result(None)
+
+
+class _LeaderCancelled(Exception):
+    """合并请求的发起方被取消，跟随者需要自己重新发起"""
+
+
+_END = object()  # 流结束标记
+
+
+def _backoff(attempt: int, error: Exception) -> float:
+    retry_after = None
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get('retry-after'))
+        except (TypeError, ValueError):
+            pass
+    if retry_after is None:
+        retry_after = random.uniform(0, RETRY_BACKOFF * (2 ** attempt))
+    return min(retry_after, MAX_RETRY_WAIT)
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRY_STATUS
+    return isinstance(error, APIConnectionError)  # 含超时
+
+
+class LLMGateway:
+    """全局唯一的网关实例
+
+    - 客户端按 (base_url, api_key) 复用。httpx 异步连接不能跨事件循环，而 UI 每条消息新建并关闭一个循环，
+      因此全部异步请求都在网关自己的常驻事件循环（守护线程）上执行，调用方在自己的循环里等待结果，长连接得以跨轮复用
+    - 所有请求共用 config.api.max_concurrency 的并发额度，流式请求在整个流期间占用额度
+    - 429/5xx/连接错误按带抖动的指数退避重试（优先遵守 Retry-After）
+    - 确定性请求（temperature 为 0，或显式 coalesce=True）参数完全相同时在飞行中只发一次，结果共享；
+      对话等有随机性的请求各自独立生成
+    """
+
+    def __init__(self):
+        self.budget = _Budget(_max_concurrency())
+        self._lock = threading.Lock()
+        self._sync_clients: Dict[Tuple[str, str], OpenAI] = {}
+        self._async_clients: Dict[Tuple[str, str], AsyncOpenAI] = {}  # 只在网关循环上使用
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight: Dict[str, Future] = {}
+
+    def endpoint(self, base_url: Optional[str] = None, api_key: Optional[str] = None) -> "LLMEndpoint":
+        """绑定到固定 base_url / api_key 的调用入口（如快速小模型、Agent 各自的模型）"""
+        return LLMEndpoint(self, base_url, api_key)
+
+    # 客户端池
+    def sync_client(self, base_url: Optional[str] = None, api_key: Optional[str] = None) -> OpenAI:
+        key = _normalize(base_url, api_key)
+        with self._lock:
+            client = self._sync_clients.get(key)
+            if client is None:
+                client = self._sync_clients[key] = OpenAI(
+                    base_url=key[0], api_key=key[1], max_retries=0, timeout=config.api.timeout,
+                    http_client=httpx.Client(http2=HTTP2, limits=_limits()))
+        return client
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """网关的常驻事件循环，首次使用时在守护线程中启动"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="LLMGateway", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    async def _on_loop(self, coro):
+        """在网关循环上执行协程，调用方在自己的循环里等待；调用方被取消时一并取消"""
+        loop = self._get_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def async_client(self, base_url: Optional[str] = None, api_key: Optional[str] = None) -> AsyncOpenAI:
+        """异步客户端（只能在网关循环上使用）"""
+        key = _normalize(base_url, api_key)
+        client = self._async_clients.get(key)
+        if client is None:
+            client = self._async_clients[key] = AsyncOpenAI(
+                base_url=key[0], api_key=key[1], max_retries=0, timeout=config.api.timeout,
+                http_client=httpx.AsyncClient(http2=HTTP2, limits=_limits()))
+        return client
+
+    async def aclose(self):
+        """关闭全部异步连接（在网关循环上关闭，之后的请求会重新建连）"""
+        if self._loop is not None:
+            await self._on_loop(self._close_async_clients())
+
+    async def _close_async_clients(self):
+        clients, self._async_clients = self._async_clients, {}
+        for client in clients.values():
+            await client.close()
+
+    def close(self):
+        with self._lock:
+            clients, self._sync_clients = self._sync_clients, {}
+        for client in clients.values():
+            client.close()
+
+    # 请求
+    @staticmethod
+    def _flight_key(key: Tuple[str, str], params: Dict[str, Any]) -> str:
+        raw = json.dumps([key, params], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _join(self, flight_key: str) -> Tuple[Future, bool]:
+        """返回 (共享结果, 是否由本调用负责发起)"""
+        with self._lock:
+            future = self._inflight.get(flight_key)
+            if future is not None:
+                return future, False
+            future = self._inflight[flight_key] = Future()
+            future.set_running_or_notify_cancel()  # 跟随者被取消时不会连带取消共享结果
+            return future, True
+
+    def _land(self, flight_key: str, future: Future):
+        with self._lock:
+            if self._inflight.get(flight_key) is future:
+                del self._inflight[flight_key]
+
+    async def _create_with_retry(self, client: AsyncOpenAI, params: Dict[str, Any], retries: Optional[int]):
+        retries = _max_retries() if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                return await client.chat.completions.create(**params)
+            except Exception as e:
+                if attempt >= retries or not _retryable(e):
+                    raise
+                wait = _backoff(attempt, e)
+                logger.warning(f"LLM请求失败，{wait:.1f}秒后重试（{attempt + 1}/{retries}）: {e}")
+                await asyncio.sleep(wait)
+
+    @staticmethod
+    def _coalescible(params: Dict[str, Any], coalesce: Optional[bool]) -> bool:
+        """只合并确定性请求：显式指定时按指定，否则仅 temperature 为 0 的请求"""
+        return coalesce if coalesce is not None else params.get('temperature') == 0
+
+    async def create(self, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                     retries: Optional[int] = None, coalesce: Optional[bool] = None, **params):
+        """非流式 chat.completions.create，返回 SDK 的响应对象；retries 为空时用 config.api.retry_count"""
+        params.pop('stream', None)
+        _split_extra(params)
+        key = _normalize(base_url, api_key)
+        return await self._on_loop(self._create(key, params, retries, self._coalescible(params, coalesce)))
+
+    async def _send(self, key: Tuple[str, str], params: Dict[str, Any], retries: Optional[int]):
+        await self.budget.acquire()
+        try:
+            return await self._create_with_retry(self.async_client(*key), params, retries)
+        finally:
+            self.budget.release()
+
+    async def _create(self, key: Tuple[str, str], params: Dict[str, Any], retries: Optional[int], coalesce: bool):
+        """在网关循环上执行"""
+        if not coalesce:
+            return await self._send(key, params, retries)
+        flight_key = self._flight_key(key, params)
+        while True:
+            future, leader = self._join(flight_key)
+            if not leader:
+                try:
+                    return await asyncio.wrap_future(future)
+                except _LeaderCancelled:
+                    continue
+            try:
+                result = await self._send(key, params, retries)
+            except asyncio.CancelledError:
+                future.set_exception(_LeaderCancelled())
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                self._land(flight_key, future)
+
+    async def stream(self, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                     retries: Optional[int] = None, **params) -> AsyncIterator[Any]:
+        """流式调用，逐个产出 SDK 的 chunk；只在收到首个 chunk 之前重试
+
+        流在网关循环上读取，chunk 逐个转交到调用方的循环；调用方中途放弃（aclose）时网关侧立即断开
+        """
+        params['stream'] = True
+        _split_extra(params)
+        caller = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def deliver(item):
+            try:
+                caller.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # 调用方的循环已关闭
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._pump(base_url, api_key, params, retries, deliver), self._get_loop())
+        future.add_done_callback(lambda f: deliver(_END))
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is _END:
+                    if not future.cancelled() and future.exception() is not None:
+                        raise future.exception()
+                    return
+                yield chunk
+        finally:
+            future.cancel()
+
+    async def _pump(self, base_url: Optional[str], api_key: Optional[str], params: Dict[str, Any],
+                    retries: Optional[int], deliver):
+        """在网关循环上读取流"""
+        await self.budget.acquire()
+        try:
+            stream = await self._create_with_retry(self.async_client(base_url, api_key), params, retries)
+            try:
+                async for chunk in stream:
+                    deliver(chunk)
+            finally:
+                await stream.close()  # 中途放弃时立即断开，服务端停止生成，连接归还连接池
+        finally:
+            self.budget.release()
+
+    def create_sync(self, base_url: Optional[str] = None, api_key: Optional[str] = None,
+                    retries: Optional[int] = None, coalesce: Optional[bool] = None, **params):
+        """同步版本，供命令行等非异步入口使用"""
+        params.pop('stream', None)
+        _split_extra(params)
+        key = _normalize(base_url, api_key)
+        flight_key = self._flight_key(key, params)
+        if self._coalescible(params, coalesce):
+            future, leader = self._join(flight_key)
+        else:
+            future, leader = Future(), True
+            future.set_running_or_notify_cancel()
+        if not leader:
+            try:
+                return future.result()
+            except _LeaderCancelled:
+                pass
+            future = Future()
+            future.set_running_or_notify_cancel()
+        client = self.sync_client(*key)
+        retries = _max_retries() if retries is None else retries
+        self.budget.acquire_sync()
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    result = client.chat.completions.create(**params)
+                    break
+                except Exception as e:
+                    if attempt >= retries or not _retryable(e):
+                        raise
+                    wait = _backoff(attempt, e)
+                    logger.warning(f"LLM请求失败，{wait:.1f}秒后重试（{attempt + 1}/{retries}）: {e}")
+                    time.sleep(wait)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self.budget.release()
+            self._land(flight_key, future)
+
+
+class LLMEndpoint:
+    """固定服务地址的网关入口，连接与额度仍由全局网关统一管理"""
+
+    def __init__(self, gateway: LLMGateway, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        self.gateway = gateway
+        self.base_url = base_url
+        self.api_key = api_key
+
+    async def create(self, **params):
+        return await self.gateway.create(base_url=self.base_url, api_key=self.api_key, **params)
+
+    def stream(self, **params) -> AsyncIterator[Any]:
+        return self.gateway.stream(base_url=self.base_url, api_key=self.api_key, **params)
+
+    def create_sync(self, **params):
+        return self.gateway.create_sync(base_url=self.base_url, api_key=self.api_key, **params)
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+    """获取全局网关（首次调用时创建）"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
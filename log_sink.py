@@ -0,0 +1,142 @@
+# log_sink.py # 对话日志后台写入：入队不阻塞事件循环，批量写入、按日期切换文件、定时落盘
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Optional, TextIO
+
+from config import config
+
+logger = logging.getLogger("LogSink")
+
+BATCH_SIZE = 256  # 单次最多合并写入的记录数
+
+_STOP = object()
+
+
+class ConversationLogSink:
+    """按日期写入 <log_dir>/<YYYY-MM-DD><suffix> 的日志后台写入器
+
+    对话可能运行在多个事件循环（UI工作线程、API服务器）上，写入端用独立线程，
+    调用方只做一次无阻塞入队；当天文件句柄保持打开，日期变化时切换，每 fsync_interval 秒强制落盘一次。
+    """
+
+    def __init__(self, log_dir: Optional[str] = None, fsync_interval: Optional[float] = None,
+                 suffix: str = ".txt", name: str = "conversation-log-sink"):
+        self.log_dir = str(log_dir or config.system.log_dir)
+        self.suffix = suffix
+        self.fsync_interval = config.system.log_fsync_interval if fsync_interval is None else fsync_interval
+        self._queue: "queue.Queue" = queue.Queue()
+        self._day: Optional[str] = None
+        self._file: Optional[TextIO] = None
+        self._dirty = False
+        self._last_fsync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def write(self, day: str, text: str):
+        """追加一条记录到 day 对应的日志文件（立即返回）"""
+        self._queue.put((day, text))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前入队的记录全部写入并落盘"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 5.0):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            timeout = max(self.fsync_interval - (time.monotonic() - self._last_fsync), 0.01) if self._dirty else None
+            try:
+                batch = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            waiters = []
+            lines = []
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    day, text = item
+                    if day != self._day and lines:
+                        self._write(lines)
+                        lines = []
+                    self._switch(day)
+                    lines.append(text)
+            if lines:
+                self._write(lines)
+            if self._dirty and (stop or waiters or time.monotonic() - self._last_fsync >= self.fsync_interval):
+                self._fsync()
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                if self._file:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _switch(self, day: str):
+        """日期变化时关闭旧文件、打开新文件（目录只在打开文件时确认一次）"""
+        if day == self._day and self._file is not None:
+            return
+        if self._file is not None:
+            if self._dirty:
+                self._fsync()
+            self._file.close()
+            self._file = None
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._file = open(os.path.join(self.log_dir, f'{day}{self.suffix}'), 'a', encoding='utf-8')
+            self._day = day
+        except OSError as e:
+            logger.error(f"打开对话日志失败: {e}")
+            self._day = None
+
+    def _write(self, lines):
+        if self._file is None:
+            return
+        try:
+            self._file.write(''.join(lines))
+            self._file.flush()  # 交给操作系统，进程崩溃也不丢；掉电保护由定时fsync负责
+            self._dirty = True
+        except OSError as e:
+            logger.error(f"写入对话日志失败: {e}")
+
+    def _fsync(self):
+        try:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+        except (OSError, ValueError) as e:
+            logger.debug(f"对话日志落盘失败: {e}")
+        self._dirty = False
+        self._last_fsync = time.monotonic()
+
+
+_sink: Optional[ConversationLogSink] = None
+_sink_lock = threading.Lock()
+
+
+def get_log_sink() -> ConversationLogSink:
+    """获取全局日志写入器（首次调用时启动写入线程，进程退出时写完剩余记录）"""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = ConversationLogSink()
+                atexit.register(_sink.close)
+    return _sink
@@ -325,8 +325,8 @@ class AgentManager:
     async def _call_llm_api(self, agent_config: AgentConfig, messages: List[Dict[str, str]]) -> Dict[str, Any]:
         """调用LLM API，使用Agent配置中的参数"""
         try:
-            # 使用新版本的OpenAI API
-            from openai import AsyncOpenAI
+            # 经统一网关调用，按 base_url 复用连接
+            from llm_gateway import get_llm_gateway
             
             # 记录调试信息
             if self.debug_mode:
@@ -345,19 +345,12 @@ class AgentManager:
             if not agent_config.api_key:
                 return {"status": "error", "error": "Agent配置缺少API密钥"}
             
-            # 创建客户端，使用Agent配置中的参数
-            client = AsyncOpenAI(
-                api_key=agent_config.api_key,
-                base_url=agent_config.api_base_url or "https://api.deepseek.com/v1"
-            )
-            
-            # 准备API调用参数
+            # 准备API调用参数，使用Agent配置中的参数
             api_params = {
                 "model": agent_config.id,
                 "messages": messages,
                 "max_tokens": agent_config.max_output_tokens,
-                "temperature": agent_config.temperature,
-                "stream": False
+                "temperature": agent_config.temperature
             }
             
             # 记录API调用参数（调试模式）
@@ -365,7 +358,11 @@ class AgentManager:
                 logger.debug(f"API调用参数: {api_params}")
             
             # 调用API
-            response = await client.chat.completions.create(**api_params)
+            response = await get_llm_gateway().create(
+                base_url=agent_config.api_base_url or "https://api.deepseek.com/v1",
+                api_key=agent_config.api_key,
+                **api_params
+            )
             
             # 提取响应内容
             assistant_content = response.choices[0].message.content
@@ -38,6 +38,7 @@ class AgentConfig:
     api_base_url: str = ""  # API基础URL
     api_key: str = ""  # API密钥
     execution_method: Dict[str, str] = None  # 自定义执行方法
+    serial_execution: bool = False  # 有副作用，同一轮中需与其他串行工具按顺序逐个执行
 
 class AgentRegistry:
     """Agent注册器"""
@@ -84,7 +85,8 @@ class AgentRegistry:
                             description=agent_data.get('description', f'Assistant {agent_data.get("name", agent_key)}.'),
                             model_provider=agent_data.get('model_provider', 'openai'),
                             api_base_url=agent_data.get('api_base_url', ''),
-                            api_key=agent_data.get('api_key', '')
+                            api_key=agent_data.get('api_key', ''),
+                            serial_execution=agent_data.get('serial_execution', False)
                         )
                         
                         self.agents[agent_key] = agent_config
@@ -168,7 +170,8 @@ class AgentRegistry:
                 model_provider=agent_config.get('modelProvider', agent_config.get('model_provider', 'openai')),
                 api_base_url=self._replace_placeholders(agent_config.get('apiBaseUrl', agent_config.get('api_base_url', ''))),
                 api_key=self._replace_placeholders(agent_config.get('apiKey', agent_config.get('api_key', ''))),
-                execution_method=agent_config.get('executionMethod', None)
+                execution_method=agent_config.get('executionMethod', None),
+                serial_execution=agent_config.get('serialExecution', False)
             )
             
             # 注册到agents字典
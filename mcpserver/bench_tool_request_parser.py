@@ -0,0 +1,127 @@
+# bench_tool_request_parser.py # 工具调用解析基准：增量解析器 vs 旧的整段 find+正则 解析
+# 用法: python -m mcpserver.bench_tool_request_parser [--calls 200] [--filler 2000] [--chunk 8] [--repeat 5]
+#   （也可直接 python mcpserver/bench_tool_request_parser.py）
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+# 直接运行脚本时把项目根目录加入路径，以便导入 mcpserver 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mcpserver.tool_request_parser import (
+    TOOL_REQUEST_END, TOOL_REQUEST_START, ToolRequestParser, parse_tool_calls
+)
+
+
+def legacy_parse_tool_calls(content: str) -> list:
+    """旧实现（去掉调试输出），作为对照"""
+    tool_calls = []
+    start_index = 0
+    while True:
+        start_pos = content.find(TOOL_REQUEST_START, start_index)
+        if start_pos == -1:
+            break
+        end_pos = content.find(TOOL_REQUEST_END, start_pos)
+        if end_pos == -1:
+            start_index = start_pos + len(TOOL_REQUEST_START)
+            continue
+        tool_content = content[start_pos + len(TOOL_REQUEST_START):end_pos].strip()
+        tool_args = {}
+        for match in re.finditer(r'(\w+)\s*:\s*「始」([\s\S]*?)「末」', tool_content):
+            tool_args[match.group(1)] = match.group(2).strip()
+        if tool_args.get('agentType', 'mcp').lower() == 'agent':
+            if tool_args.get('agent_name') and tool_args.get('query'):
+                tool_calls.append({'name': 'agent_call', 'args': {
+                    'agentType': 'agent', 'agent_name': tool_args['agent_name'], 'query': tool_args['query']}})
+        elif tool_args.get('tool_name'):
+            if 'service_name' not in tool_args:
+                tool_args['service_name'] = tool_args['tool_name']
+                tool_args['agentType'] = 'mcp'
+            tool_calls.append({'name': tool_args['tool_name'], 'args': tool_args})
+        start_index = end_pos + len(TOOL_REQUEST_END)
+    return tool_calls
+
+
+def build_response(calls: int, filler: int, seed: int = 0) -> str:
+    """生成含大量普通文本与工具调用块的模拟回复"""
+    rng = random.Random(seed)
+    words = ["今天", "天气", "不错", "我们", "可以", "查询", "一下", "结果", "如下", "。", "，", "\n"]
+    parts = []
+    for i in range(calls):
+        parts.append("".join(rng.choice(words) for _ in range(filler)))
+        if i % 3 == 0:
+            parts.append(f"{TOOL_REQUEST_START}\nagentType: 「始」agent「末」\nagent_name: 「始」助手{i}「末」\n"
+                         f"query: 「始」第{i}个问题「末」\n{TOOL_REQUEST_END}")
+        else:
+            parts.append(f"{TOOL_REQUEST_START}\nagentType: 「始」mcp「末」\nservice_name: 「始」服务{i % 7}「末」\n"
+                         f"tool_name: 「始」tool_{i}「末」\ncontent: 「始」{'参数' * 50}「末」\n{TOOL_REQUEST_END}")
+    return "".join(parts)
+
+
+def chunked(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def best_of(repeat: int, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="工具调用解析器基准")
+    ap.add_argument("--calls", type=int, default=200, help="工具调用块数量")
+    ap.add_argument("--filler", type=int, default=2000, help="每个块前的普通文本词数")
+    ap.add_argument("--chunk", type=int, default=8, help="模拟流式增量的字符数")
+    ap.add_argument("--repeat", type=int, default=5, help="重复次数（取最快一次）")
+    args = ap.parse_args()
+
+    content = build_response(args.calls, args.filler)
+    chunks = chunked(content, args.chunk)
+    assert parse_tool_calls(content) == legacy_parse_tool_calls(content), "解析结果与旧实现不一致"
+
+    def legacy_stream():
+        # 旧流程：逐个增量累积回复（流式输出本身就要逐个处理增量），流结束后再对整段回复解析
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+        legacy_parse_tool_calls("".join(parts))
+
+    def incremental_stream():
+        parser = ToolRequestParser()
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            parser.feed(chunk)
+        parser.flush()
+
+    def loop_only():
+        for _ in chunks:
+            pass
+
+    # 首个工具调用可开始执行时已消费的字符数
+    parser = ToolRequestParser()
+    consumed = 0
+    for chunk in chunks:
+        consumed += len(chunk)
+        if parser.feed(chunk)[1]:
+            break
+
+    print(f"回复长度 {len(content)} 字符，{args.calls} 个工具调用，{len(chunks)} 个增量")
+    print(f"整段解析    旧实现 {best_of(args.repeat, lambda: legacy_parse_tool_calls(content)) * 1000:8.2f} ms"
+          f"    增量解析器 {best_of(args.repeat, lambda: parse_tool_calls(content)) * 1000:8.2f} ms")
+    legacy_ms = best_of(args.repeat, legacy_stream) * 1000
+    incremental_ms = best_of(args.repeat, incremental_stream) * 1000
+    print(f"流式解析    旧实现 {legacy_ms:8.2f} ms    增量解析器 {incremental_ms:8.2f} ms"
+          f"（每个增量多 {(incremental_ms - legacy_ms) * 1000 / len(chunks):.3f} µs；空循环 {best_of(args.repeat, loop_only) * 1000:.2f} ms）")
+    print(f"首个工具调用可开始执行前需接收的字符数（越小越早）：旧实现 {len(content)}（整段结束后），增量解析器 {consumed}")
+
+
+if __name__ == '__main__':
+    main()
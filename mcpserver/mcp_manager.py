@@ -16,6 +16,7 @@ from mcp.client.stdio import stdio_client
 from mcpserver.mcp_registry import MCP_REGISTRY # MCP服务注册表
 
 from config import DEBUG, LOG_LEVEL
+from tracing import span # 链路追踪（关闭时为空操作）
 
 # 配置日志
 logging.basicConfig(
@@ -180,26 +181,20 @@ class MCPManager:
         metadata: Optional[Dict[str, Any]] = None
     ) -> str:
         """执行handoff"""
+        with span("mcp.handoff", service=service_name) as s:
+            if s:
+                s.set(task=task)
+            result = await self._handoff(service_name, task)
+            if s:
+                s.set(result=result)
+            return result
+
+    async def _handoff(self, service_name: str, task: dict) -> str:
         try:
-            # 通知handoff调用开始
-            
-            # 修复中文编码问题
-            task_json = json.dumps(task, ensure_ascii=False)
-            sys.stderr.write(f"执行handoff: service={service_name}, task={task_json}\n".encode('utf-8', errors='replace').decode('utf-8'))
-            
             if service_name not in self.services:
                 raise ValueError(f"未注册的服务: {service_name}")
                 
             service = self.services[service_name]
-            # 只打印服务配置中的安全字段
-            safe_service_info = {
-                "name": service.get("name", ""),
-                "description": service.get("description", ""),
-                "agent_name": service.get("agent_name", ""),
-                "strict_schema": service.get("strict_schema", False)
-            }
-            safe_info_json = json.dumps(safe_service_info, ensure_ascii=False)
-            sys.stderr.write(f"找到服务配置: {safe_info_json}\n".encode('utf-8', errors='replace').decode('utf-8'))
             
             # 简单验证必需字段
             if service["strict_schema"]:
@@ -222,15 +217,8 @@ class MCPManager:
             agent = MCP_REGISTRY.get(agent_name)
             if not agent:
                 raise ValueError(f"找不到已注册的Agent实例: {agent_name}")
-            sys.stderr.write(f"使用注册中心中的Agent实例: {agent_name}\n".encode('utf-8', errors='replace').decode('utf-8'))
             # 执行handoff
-            sys.stderr.write("开始执行代理handoff\n".encode('utf-8', errors='replace').decode('utf-8'))
-            result = await agent.handle_handoff(task)
-            sys.stderr.write(f"代理handoff执行结果: {result}\n".encode('utf-8', errors='replace').decode('utf-8'))
-            
-            # 通知handoff调用成功
-            
-            return result
+            return await agent.handle_handoff(task)
             
         except Exception as e:
             error_msg = f"Handoff执行失败: {str(e)}"
@@ -0,0 +1,134 @@
+# tool_request_parser.py # TOOL_REQUEST 块的增量解析器，供对话主循环与API服务器共用
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+TOOL_REQUEST_START = "<<<[TOOL_REQUEST]>>>"
+TOOL_REQUEST_END = "<<<[END_TOOL_REQUEST]>>>"
+
+_NO_CALLS: Tuple[Dict[str, Any], ...] = ()  # 没有完成工具调用时共用的空结果，省去每个增量新建列表
+
+_PARAM_PATTERN = re.compile(r'(\w+)\s*:\s*「始」([\s\S]*?)「末」')
+
+
+def _partial_marker_len(text: str, marker: str, start: int = 0) -> int:
+    """text[start:] 末尾与 marker 开头重合的最长长度（标记可能被拆在两个增量里）"""
+    # 只有标记首字符出现过的位置才可能是重合起点，绝大多数增量一次 find 即可排除
+    lo = max(start, len(text) - len(marker) + 1)
+    pos = text.find(marker[0], lo)
+    while pos != -1:
+        if marker.startswith(text[pos:]):
+            return len(text) - pos
+        pos = text.find(marker[0], pos + 1)
+    return 0
+
+
+def parse_tool_block(block: str) -> Optional[Dict[str, Any]]:
+    """解析单个工具调用块的内容，支持MCP和Agent两种类型；参数不全时返回None"""
+    tool_args = {m.group(1): m.group(2).strip() for m in _PARAM_PATTERN.finditer(block)}
+    agent_type = tool_args.get('agentType', 'mcp').lower()
+
+    if agent_type == 'agent':
+        agent_name = tool_args.get('agent_name')
+        query = tool_args.get('query')
+        if agent_name and query:
+            return {
+                'name': 'agent_call',
+                'args': {
+                    'agentType': 'agent',
+                    'agent_name': agent_name,
+                    'query': query
+                }
+            }
+        return None
+
+    # MCP类型调用格式（包括默认mcp和旧格式）
+    tool_name = tool_args.get('tool_name')
+    if not tool_name:
+        return None
+    if 'service_name' not in tool_args:
+        # 旧格式：tool_name作为服务名
+        tool_args['service_name'] = tool_name
+        tool_args['agentType'] = 'mcp'
+    return {'name': tool_name, 'args': tool_args}
+
+
+class ToolRequestParser:
+    """流式增量解析器
+
+    每次 feed 一个增量，返回 (可直接输出的普通文本, 本次完成的工具调用)。
+    工具块外的文本立即放行；块内内容只缓冲，收到结束标记时立即解析出调用。
+    已扫描过的内容不再重扫：只暂扣可能是半个标记的尾部（不超过标记长度），下一个增量从它开始查找。
+    不含标记字符 "<" 的增量（绝大多数）只做一次成员检查就返回。
+    """
+
+    def __init__(self, emit_text: bool = True):
+        self.emit_text = emit_text  # 只关心工具调用时可关闭，省去普通文本的拷贝
+        self._tail = ""     # 尚不能确定归属的尾部（可能是半个标记）
+        self._block: List[str] = []
+        self.in_tool = False
+        self._plain = emit_text  # 块外、无暂扣尾部且需要输出文本：增量不含 "<" 时原样放行
+        self.tool_calls: List[Dict[str, Any]] = []
+
+    def feed(self, chunk: str) -> Tuple[str, Sequence[Dict[str, Any]]]:
+        if "<" not in chunk:
+            if self._plain:
+                return chunk, _NO_CALLS
+            if not self._tail:
+                if self.in_tool:
+                    self._block.append(chunk)
+                return "", _NO_CALLS
+        return self._scan(self._tail + chunk if self._tail else chunk)
+
+    def _scan(self, buf: str) -> Tuple[str, Sequence[Dict[str, Any]]]:
+        text: List[str] = []
+        calls: List[Dict[str, Any]] = []
+        i, n = 0, len(buf)
+        while i < n:
+            if not self.in_tool:
+                pos = buf.find(TOOL_REQUEST_START, i)
+                if pos == -1:
+                    keep = _partial_marker_len(buf, TOOL_REQUEST_START, i)
+                    if self.emit_text:
+                        text.append(buf[i:n - keep])
+                    i = n - keep
+                    break
+                if self.emit_text:
+                    text.append(buf[i:pos])
+                i = pos + len(TOOL_REQUEST_START)
+                self.in_tool = True
+                self._block = []
+            else:
+                pos = buf.find(TOOL_REQUEST_END, i)
+                if pos == -1:
+                    keep = _partial_marker_len(buf, TOOL_REQUEST_END, i)
+                    self._block.append(buf[i:n - keep])
+                    i = n - keep
+                    break
+                self._block.append(buf[i:pos])
+                call = parse_tool_block("".join(self._block))
+                if call:
+                    calls.append(call)  # 结束标记一到就交出，不等后续增量
+                i = pos + len(TOOL_REQUEST_END)
+                self.in_tool = False
+                self._block = []
+        self._tail = buf[i:]
+        self._plain = self.emit_text and not self.in_tool and not self._tail
+        if calls:
+            self.tool_calls.extend(calls)
+        return "".join(text), calls or _NO_CALLS
+
+    def flush(self) -> str:
+        """流结束时返回仍被暂扣的普通文本；未闭合的工具块被丢弃"""
+        tail = "" if self.in_tool else self._tail
+        self._tail = ""
+        self._block = []
+        self.in_tool = False
+        self._plain = self.emit_text
+        return tail
+
+
+def parse_tool_calls(content: str) -> List[Dict[str, Any]]:
+    """一次性解析完整回复中的全部工具调用"""
+    parser = ToolRequestParser(emit_text=False)
+    parser.feed(content)
+    return parser.tool_calls
@@ -0,0 +1,135 @@
+# tool_scheduler.py # 工具调用调度：无依赖的调用并发执行，按服务限流，有副作用的工具串行
+import asyncio
+import logging
+import weakref
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("ToolScheduler")
+
+DEFAULT_PER_SERVICE_LIMIT = 2  # 同一服务同时执行的调用数上限
+DEFAULT_CALL_TIMEOUT = 60.0    # manifest未声明超时时的单次调用超时（秒）
+
+
+@dataclass
+class ToolPolicy:
+    """单个工具调用的执行策略"""
+    service: str  # 限流分组键
+    serial: bool = False  # manifest声明 serialExecution 的工具按原顺序逐个执行
+    timeout: float = DEFAULT_CALL_TIMEOUT
+
+
+def resolve_tool_policy(tool_call: Dict[str, Any], default_timeout: float = DEFAULT_CALL_TIMEOUT) -> ToolPolicy:
+    """从MCP/Agent的manifest读取串行标记与超时"""
+    args = tool_call.get('args', {})
+    if args.get('agentType', 'mcp').lower() == 'agent':
+        name = args.get('agent_name', '')
+        serial = False
+        try:
+            from mcpserver.agent_registry import get_agent_registry
+            agent_config = get_agent_registry().get_agent_config(name)
+            serial = bool(agent_config and agent_config.serial_execution)
+        except Exception as e:
+            logger.debug(f"读取Agent执行策略失败 {name}: {e}")
+        return ToolPolicy(service=f"agent:{name}", serial=serial, timeout=default_timeout)
+
+    from mcpserver.mcp_registry import MANIFEST_CACHE
+    name = args.get('service_name') or tool_call.get('name', '')
+    manifest = MANIFEST_CACHE.get(name, {})
+    timeout_ms = manifest.get('communication', {}).get('timeout')
+    return ToolPolicy(
+        service=name,
+        serial=bool(manifest.get('serialExecution', False)),
+        timeout=timeout_ms / 1000 if timeout_ms else default_timeout,
+    )
+
+
+class ToolCallScheduler:
+    """一轮中的多个工具调用并发执行，结果按原顺序返回
+
+    - 每个服务最多 per_service_limit 个调用同时执行
+    - serial 工具之间按出现顺序逐个执行（与其他无副作用调用仍可并发）
+    - 每个调用单独超时，超时或异常都转为错误文本，不影响其他调用
+    """
+
+    def __init__(self, per_service_limit: int = DEFAULT_PER_SERVICE_LIMIT,
+                 default_timeout: float = DEFAULT_CALL_TIMEOUT,
+                 policy_resolver: Callable[[Dict[str, Any], float], ToolPolicy] = resolve_tool_policy):
+        self.per_service_limit = per_service_limit
+        self.default_timeout = default_timeout
+        self.policy_resolver = policy_resolver
+        # 信号量绑定事件循环（UI每条消息新建循环、API服务器另有循环），按 (循环, 服务) 分别创建
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+    def _semaphore(self, service: str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphores = self._semaphores.get(loop)
+        if semaphores is None:
+            for closed in [l for l in self._semaphores if l.is_closed()]:
+                del self._semaphores[closed]
+            semaphores = self._semaphores[loop] = {}
+        sem = semaphores.get(service)
+        if sem is None:
+            sem = semaphores[service] = asyncio.Semaphore(self.per_service_limit)
+        return sem
+
+    async def _run_one(self, tool_call: Dict[str, Any], policy: ToolPolicy,
+                       execute: Callable[[Dict[str, Any]], Awaitable[str]]) -> str:
+        async with self._semaphore(policy.service):
+            try:
+                return await asyncio.wait_for(execute(tool_call), timeout=policy.timeout)
+            except asyncio.TimeoutError:
+                return f"执行工具 {tool_call['name']} 超时（{policy.timeout:g}秒）"
+            except Exception as e:
+                return f"执行工具 {tool_call['name']} 时发生错误：{str(e)}"
+
+    def batch(self, execute: Callable[[Dict[str, Any]], Awaitable[str]]) -> "ToolCallBatch":
+        """创建一轮可逐个提交的调用批次（流式解析出一个调用就立即开始执行）"""
+        return ToolCallBatch(self, execute)
+
+    async def run(self, tool_calls: List[Dict[str, Any]],
+                  execute: Callable[[Dict[str, Any]], Awaitable[str]]) -> List[str]:
+        """执行一批工具调用，返回与 tool_calls 顺序一致的结果文本"""
+        batch = self.batch(execute)
+        for call in tool_calls:
+            batch.submit(call)
+        return await batch.results()
+
+
+class ToolCallBatch:
+    """一轮中的工具调用，按提交顺序收集结果；serial 调用链式排在前一个 serial 调用之后"""
+
+    def __init__(self, scheduler: ToolCallScheduler, execute: Callable[[Dict[str, Any]], Awaitable[str]]):
+        self.scheduler = scheduler
+        self.execute = execute
+        self.tool_calls: List[Dict[str, Any]] = []
+        self._tasks: List[asyncio.Task] = []
+        self._last_serial: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.tool_calls)
+
+    def submit(self, tool_call: Dict[str, Any]):
+        """立即开始执行（需在事件循环内调用）"""
+        scheduler = self.scheduler
+        policy = scheduler.policy_resolver(tool_call, scheduler.default_timeout)
+        previous = self._last_serial if policy.serial else None
+
+        async def run():
+            if previous is not None:
+                await asyncio.wait([previous])
+            return await scheduler._run_one(tool_call, policy, self.execute)
+
+        task = asyncio.ensure_future(run())
+        if policy.serial:
+            self._last_serial = task
+        self.tool_calls.append(tool_call)
+        self._tasks.append(task)
+
+    async def results(self) -> List[str]:
+        """等待全部已提交的调用完成，返回与提交顺序一致的结果文本"""
+        return list(await asyncio.gather(*self._tasks))
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
@@ -0,0 +1,237 @@
+# session_manager.py # 多会话管理：按 session_id 隔离对话上下文，LRU + 空闲超时淘汰，淘汰的会话落盘并在再次访问时恢复
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import config
+from context_window import ContextWindow
+
+logger = logging.getLogger("SessionManager")
+
+STALE_CHECK_INTERVAL = 1.0  # 等待轮次锁时每隔多少秒检查一次持有者的事件循环是否已关闭
+
+
+class TurnLock:
+    """跨事件循环的会话轮次锁：同一会话的请求依次处理
+
+    UI 每条消息新建并关闭事件循环、API 服务器另有事件循环，asyncio.Lock 不能在它们之间共享。
+    等待者按 (事件循环, future) 排队，释放时直接转交给下一个等待者；持有者所在的循环已关闭
+    （被放弃、来不及执行 finally 的流式生成器）时锁视为已释放，不会让会话永久卡住
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owner: Optional[asyncio.AbstractEventLoop] = None  # 持有者所在的事件循环
+        self._waiters = deque()
+
+    @property
+    def busy(self) -> bool:
+        with self._lock:
+            self._reclaim()
+            return self._owner is not None or bool(self._waiters)
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._reclaim()
+            if self._owner is None and not self._waiters:
+                self._owner = loop
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter[1]), STALE_CHECK_INTERVAL)
+                    return
+                except asyncio.TimeoutError:
+                    with self._lock:
+                        self._reclaim()
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # 锁已转交给本协程：转交回调尚未执行时由回调归还，已执行则在此归还
+            if not waiter[1].done():
+                waiter[1].cancel()
+            elif not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            self._owner = None
+            self._hand_over()
+
+    def _hand_over(self):
+        """把空闲的锁交给下一个事件循环仍在运行的等待者（调用方持有 _lock）"""
+        while self._waiters:
+            loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._grant, future)
+            except RuntimeError:
+                continue  # 等待者的循环已关闭
+            self._owner = loop
+            return
+
+    def _grant(self, future: asyncio.Future):
+        if future.cancelled():
+            self.release()  # 等待者在转交前已取消，继续往下传
+        else:
+            future.set_result(None)
+
+    def _reclaim(self):
+        """持有者的事件循环已关闭时收回锁（调用方持有 _lock）"""
+        if self._owner is not None and self._owner.is_closed():
+            logger.warning("会话轮次锁的持有者所在事件循环已关闭，收回锁")
+            self._owner = None
+            self._hand_over()
+
+
+class ConversationSession:
+    """单个会话：独立的上下文窗口 + 两把锁
+
+    - turn()：轮次锁，同一会话的请求从组装消息到写回历史依次处理，不同会话互不阻塞
+    - lock：上下文窗口的锁（后台整理提交结果时也持有它），只在读写上下文时短暂持有，不跨越 await/yield
+    """
+
+    def __init__(self, session_id: str, context: ContextWindow):
+        self.session_id = session_id
+        self.context = context
+        self.lock = context.lock
+        self.turn_lock = TurnLock()
+        self.last_active = time.monotonic()
+
+    @contextlib.asynccontextmanager
+    async def turn(self):
+        """独占本会话处理一轮请求；生成器被关闭（aclose/GeneratorExit）时同样释放"""
+        await self.turn_lock.acquire()
+        try:
+            yield self
+        finally:
+            self.turn_lock.release()
+            self.last_active = time.monotonic()
+
+    @property
+    def busy(self) -> bool:
+        """正在处理请求（含排队等待）或后台整理中的会话不能淘汰"""
+        return self.turn_lock.busy or self.context.compacting
+
+
+class SessionManager:
+    """会话表
+
+    - get() 按 session_id 取会话，不存在时创建（有落盘状态则恢复）；未指定 session_id 时使用本进程的默认会话
+    - 超过 max_sessions 时按最近最少使用淘汰，空闲超过 idle_ttl 秒的会话在下次访问会话表时淘汰
+    - persist 开启时淘汰的会话写入 logs/history/<session>.state.json（后台线程写入），再次访问时恢复
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None, idle_ttl: Optional[float] = None,
+                 persist: Optional[bool] = None, context_factory: Callable[[str], ContextWindow] = ContextWindow):
+        self.max_sessions = max_sessions or config.api.session_max_count
+        self.idle_ttl = idle_ttl or config.api.session_idle_ttl
+        self.persist = config.api.session_persist if persist is None else persist
+        self.context_factory = context_factory
+        self.default_id = f"naga-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._pending: Dict[str, Dict] = {}  # 已淘汰、状态尚未写完的会话，期间再次访问直接从内存恢复
+        self._lock = threading.Lock()  # UI线程与API服务器各自的事件循环都会访问会话表
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-writer")  # 单线程保证同一会话的写入顺序
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str):
+        return session_id in self._sessions
+
+    def get(self, session_id: Optional[str] = None) -> ConversationSession:
+        session_id = session_id or self.default_id
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = self._open(session_id)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_active = time.monotonic()
+            retired = [self._retire(old) for old in self._collect_evicted(keep=session_id)]
+        self._write(retired)
+        return session
+
+    def drop(self, session_id: str):
+        """结束会话并丢弃其状态（不落盘）"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            self._pending.pop(session_id, None)
+        if session:
+            self._writer.submit(session.context.discard_state)
+
+    def sessions(self) -> List[str]:
+        with self._lock:
+            return list(self._sessions)
+
+    def close(self):
+        """进程退出前把所有会话落盘并等待写完"""
+        with self._lock:
+            retired = [self._retire(session) for session in self._sessions.values()]
+            self._sessions.clear()
+        self._write(retired)
+        self._writer.shutdown(wait=True)
+
+    def _open(self, session_id: str) -> ConversationSession:
+        context = self.context_factory(session_id)
+        if self.persist:
+            state = self._pending.pop(session_id, None)
+            if state is not None:
+                context.import_state(state)
+                self._writer.submit(context.discard_state)  # 排在尚未完成的写入之后，避免留下过期状态
+            elif context.restore_state():
+                logger.debug(f"会话 {session_id} 已从磁盘恢复")
+        return ConversationSession(session_id, context)
+
+    def _collect_evicted(self, keep: str) -> List[ConversationSession]:
+        """取出需要淘汰的会话（调用方持有 _lock）；OrderedDict 头部即最久未使用"""
+        evicted = []
+        deadline = time.monotonic() - self.idle_ttl
+        for session_id, session in list(self._sessions.items()):
+            if session.last_active > deadline:
+                break
+            if session_id != keep and not session.busy:
+                evicted.append(self._sessions.pop(session_id))
+        if len(self._sessions) > self.max_sessions:
+            for session_id, session in list(self._sessions.items()):
+                if len(self._sessions) <= self.max_sessions:
+                    break
+                if session_id != keep and not session.busy:
+                    evicted.append(self._sessions.pop(session_id))
+        return evicted
+
+    def _retire(self, session: ConversationSession) -> Optional[Tuple[ContextWindow, Dict]]:
+        """记下被淘汰会话的状态（调用方持有 _lock，保证写完之前再次访问也能拿到）"""
+        logger.debug(f"会话 {session.session_id} 已淘汰")
+        context = session.context
+        if not self.persist or not (context.messages or context.digest):
+            return None
+        state = self._pending[session.session_id] = context.export_state()
+        return context, state
+
+    def _write(self, retired: List[Optional[Tuple[ContextWindow, Dict]]]):
+        for item in retired:
+            if item is not None:
+                self._writer.submit(self._write_state, *item)
+
+    def _write_state(self, context: ContextWindow, state: Dict):
+        try:
+            context.save_state(state)
+        except OSError as e:
+            logger.error(f"会话 {context.session_id} 状态落盘失败: {e}")
+        finally:
+            with self._lock:
+                if self._pending.get(context.session_id) is state:
+                    del self._pending[context.session_id]
@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from .extractor_ds_tri import extract_triples_async
+from .graph import store_triples
+from . import llm_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4     # 同时进行的提取请求数
+DEFAULT_RATE = 5.0          # 每秒最多发起的提取请求数
+DEFAULT_WRITE_BATCH = 200   # 累计多少个三元组写一次图谱
+WRITE_IDLE_FLUSH = 1.0      # 写入端空闲多少秒后即使未满也写入
+REPORT_INTERVAL = 10.0      # 进度日志间隔秒数
+
+_DONE = object()
+
+
+class RateLimiter:
+    """按固定间隔放行的异步限速器"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class Checkpoint:
+    """记录已连续完成的行号，导入中断后从此处继续"""
+
+    def __init__(self, source: str, path: Optional[str] = None):
+        self.source = os.path.abspath(source)
+        self.path = path or source + ".progress"
+        self.line = 0  # 此行之前（不含）的全部行已写入图谱
+        self._finished = set()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("source") == self.source:
+                self.line = int(data.get("line", 0))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"读取导入进度失败，将从头开始: {e}")
+
+    def mark(self, line_numbers):
+        self._finished.update(line_numbers)
+        advanced = False
+        while self.line in self._finished:
+            self._finished.discard(self.line)
+            self.line += 1
+            advanced = True
+        if advanced:
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"source": self.source, "line": self.line}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkIngestor:
+    """流式批量导入：逐行读取文件，并发提取三元组，批量写入图谱并记录断点"""
+
+    def __init__(self, filename: str, concurrency: int = DEFAULT_CONCURRENCY, rate: float = DEFAULT_RATE,
+                 write_batch: int = DEFAULT_WRITE_BATCH, checkpoint_path: Optional[str] = None):
+        self.filename = filename
+        self.concurrency = concurrency
+        self.write_batch = write_batch
+        self.rate = rate
+        self.checkpoint = Checkpoint(filename, checkpoint_path)
+        self.texts = 0
+        self.triples = 0
+        self.failed = 0
+        self._started = 0.0
+        self._last_report = 0.0
+
+    def _read_lines(self):
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f):
+                if line_no >= self.checkpoint.line:
+                    yield line_no, line.strip()
+
+    async def _produce(self, work: asyncio.Queue, results: asyncio.Queue):
+        for line_no, text in self._read_lines():
+            if text:
+                await work.put((line_no, text))
+            else:
+                await results.put((line_no, []))
+        for _ in range(self.concurrency):
+            await work.put(_DONE)
+
+    async def _extract(self, work: asyncio.Queue, results: asyncio.Queue, limiter: RateLimiter):
+        while True:
+            item = await work.get()
+            if item is _DONE:
+                return
+            line_no, text = item
+            await limiter.acquire()
+            try:
+                triples = await extract_triples_async(text, raise_errors=True)
+            except Exception as e:
+                # 失败的行不记入断点，下次导入从这里重新提取
+                logger.error(f"第 {line_no + 1} 行提取失败: {e}")
+                triples = None
+            else:
+                if not triples:
+                    logger.warning(f"第 {line_no + 1} 行未提取到三元组: {text[:50]}")
+            await results.put((line_no, triples))
+
+    async def _feed(self, work: asyncio.Queue, results: asyncio.Queue, limiter: RateLimiter):
+        """读取文件并由多个提取任务并发处理，全部完成后通知写入端"""
+        extractors = [asyncio.create_task(self._extract(work, results, limiter))
+                      for _ in range(self.concurrency)]
+        try:
+            await self._produce(work, results)
+            await asyncio.gather(*extractors)
+        finally:
+            for task in extractors:
+                task.cancel()
+        await results.put(_DONE)
+
+    async def _write(self, results: asyncio.Queue, executor: ThreadPoolExecutor):
+        loop = asyncio.get_running_loop()
+        buffer: List[Tuple[str, str, str]] = []
+        lines: List[int] = []
+        finished = False
+        while not finished:
+            try:
+                item = await asyncio.wait_for(results.get(), WRITE_IDLE_FLUSH)
+            except asyncio.TimeoutError:
+                item = None
+            if item is _DONE:
+                finished = True
+            elif item is not None:
+                line_no, triples = item
+                if triples is None:
+                    self.failed += 1
+                    continue
+                lines.append(line_no)
+                buffer.extend(t for t in triples if all(isinstance(x, str) and x.strip() for x in t))
+                if triples:
+                    self.texts += 1
+            if lines and (finished or item is None or len(buffer) >= self.write_batch):
+                if buffer:
+                    await loop.run_in_executor(executor, store_triples, buffer)
+                    self.triples += len(buffer)
+                self.checkpoint.mark(lines)
+                buffer, lines = [], []
+            self._report()
+
+    def _report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_report < REPORT_INTERVAL:
+            return
+        self._last_report = now
+        stats = self.stats()
+        logger.info(f"已导入至第 {self.checkpoint.line} 行：{stats['texts']} 条文本 / {stats['triples']} 个三元组，"
+                    f"{stats['texts_per_sec']:.2f} 条/秒，{stats['triples_per_sec']:.2f} 三元组/秒")
+
+    def stats(self) -> Dict:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            "texts": self.texts,
+            "triples": self.triples,
+            "failed": self.failed,
+            "seconds": elapsed,
+            "texts_per_sec": self.texts / elapsed,
+            "triples_per_sec": self.triples / elapsed,
+        }
+
+    async def run(self) -> Dict:
+        if self.checkpoint.line:
+            logger.info(f"从第 {self.checkpoint.line + 1} 行继续导入 {self.filename}")
+        self._started = self._last_report = time.monotonic()
+        work: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        limiter = RateLimiter(self.rate)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-ingest-write") as executor:
+            writer = asyncio.create_task(self._write(results, executor))
+            feeder = asyncio.create_task(self._feed(work, results, limiter))
+            try:
+                # 写入端失败时提取端会阻塞在已满的结果队列上，任一端出错都立即结束
+                done, _ = await asyncio.wait({writer, feeder}, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()
+                await asyncio.gather(feeder, writer)
+            finally:
+                for task in (feeder, writer):
+                    task.cancel()
+                await asyncio.gather(feeder, writer, return_exceptions=True)
+                await llm_client.close()
+        if self.failed:
+            logger.warning(f"{self.failed} 行提取失败，保留导入进度，重新运行将从第 {self.checkpoint.line + 1} 行继续")
+        else:
+            self.checkpoint.remove()
+        self._report(force=True)
+        return self.stats()
+
+
+def ingest_file(filename: str, **kwargs) -> Dict:
+    """同步入口：导入整个文件，返回吞吐统计"""
+    return asyncio.run(BulkIngestor(filename, **kwargs).run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发批量导入文本文件（每行一段）到知识图谱，支持断点续传")
+    parser.add_argument("file", help="输入文件路径")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="并发提取请求数")
+    parser.add_argument("-r", "--rate", type=float, default=DEFAULT_RATE, help="每秒最多请求数，0 表示不限速")
+    parser.add_argument("-b", "--write-batch", type=int, default=DEFAULT_WRITE_BATCH, help="每次写入图谱的三元组数")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stats = ingest_file(args.file, concurrency=args.concurrency, rate=args.rate, write_batch=args.write_batch)
+    print(f"导入完成：{stats['texts']} 条文本，{stats['triples']} 个三元组，用时 {stats['seconds']:.1f} 秒"
+          f"（{stats['texts_per_sec']:.2f} 条/秒，{stats['triples_per_sec']:.2f} 三元组/秒）"
+          + (f"，{stats['failed']} 行提取失败" if stats['failed'] else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import sys
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+# 添加项目根目录到路径，以便导入config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+logger = logging.getLogger(__name__)
+
+Triple = Tuple[str, str, str]
+
+CACHE_FILE = "extraction_cache.db"
+try:
+    from config import config
+    DEFAULT_MAX_ENTRIES = config.grag.extraction_cache_size
+except Exception:
+    DEFAULT_MAX_ENTRIES = 10000
+
+
+def content_digest(text: str) -> str:
+    """稳定的内容摘要（不受 PYTHONHASHSEED 影响），首尾空白不参与计算"""
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """持久化的三元组提取缓存：内容摘要 → 提取结果，超出容量时淘汰最久未使用的条目"""
+
+    def __init__(self, path: str = CACHE_FILE, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_cache ("
+            "digest TEXT PRIMARY KEY, triples TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON extraction_cache(last_used)")
+        self._conn.commit()
+
+    def get(self, text: str) -> Optional[List[Triple]]:
+        """命中时返回缓存的三元组并刷新使用时间，未命中返回 None"""
+        digest = content_digest(text)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT triples FROM extraction_cache WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE extraction_cache SET last_used = ? WHERE digest = ?", (time.time(), digest))
+            self._conn.commit()
+        return [tuple(t) for t in json.loads(row[0])]
+
+    def __contains__(self, text: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM extraction_cache WHERE digest = ?", (content_digest(text),)).fetchone() is not None
+
+    def put(self, text: str, triples: List[Triple]):
+        """写入提取结果，超出容量时按最久未使用淘汰"""
+        payload = json.dumps([list(t) for t in triples], ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache (digest, triples, last_used) VALUES (?, ?, ?)",
+                (content_digest(text), payload, time.time()))
+            overflow = self._count() - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM extraction_cache WHERE digest IN ("
+                    "SELECT digest FROM extraction_cache ORDER BY last_used LIMIT ?)", (overflow,))
+            self._conn.commit()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM extraction_cache")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """获取全局提取缓存（首次调用时打开缓存文件）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache()
+    return _cache
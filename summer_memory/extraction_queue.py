@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 4        # 每次提取合并的对话轮数
+DEFAULT_FLUSH_INTERVAL = 2.0  # 首条入队后最多等待多少秒就提交
+DEFAULT_QUEUE_SIZE = 32       # 队列上限，满时 submit 会等待（背压）
+
+BatchHandler = Callable[[List[str]], Awaitable[None]]
+
+
+class ExtractionBatcher:
+    """三元组提取批处理队列
+
+    对话轮次入队后由后台任务合并：攒够 batch_size 条或距首条入队超过 flush_interval 秒时，
+    把这一批交给 handler（一次模型调用 + 一次批量写图）。队列满时 submit 等待，
+    以背压的方式限制积压。队列与后台任务运行在首次 submit 时启动的专用事件循环（守护线程）上：
+    UI 每条消息新建并关闭事件循环，API 服务器另有事件循环，任何调用方的循环关闭都不影响积压的对话。
+    """
+
+    def __init__(self, handler: BatchHandler, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="ExtractionBatcher", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    async def _call(self, coro):
+        """在批处理循环上执行协程，调用方在自己的事件循环里等待结果"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()))
+
+    def _ensure_worker(self):
+        """在批处理循环上调用"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _put(self, text: str):
+        self._ensure_worker()
+        await self._queue.put(text)
+
+    async def submit(self, text: str):
+        """提交一轮对话文本，队列满时等待"""
+        await self._call(self._put(text))
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _next_batch(self) -> List[str]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.handler(batch)
+            except Exception as e:
+                logger.error(f"批量提取三元组失败（{len(batch)} 轮）: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _join(self):
+        if self._queue is not None and self._worker is not None and not self._worker.done():
+            await self._queue.join()
+
+    async def flush(self):
+        """等待已入队的对话全部处理完"""
+        if self._loop is not None:
+            await self._call(self._join())
+
+    async def _stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def close(self):
+        """处理完积压后停止后台任务"""
+        await self.flush()
+        if self._loop is not None:
+            await self._call(self._stop())
@@ -1,4 +1,4 @@
-import requests
+import asyncio
 import json
 import logging
 import re
@@ -9,13 +9,15 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from config import config
-API_KEY = config.api.api_key
-API_URL = f"{config.api.base_url.rstrip('/')}/chat/completions"
+from .llm_client import chat_completion, chat_completion_sync
+from .extraction_cache import get_extraction_cache
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def extract_triples(text):
+MAX_TOKENS_PER_TEXT = 300  # 每段文本预留的输出token，批量提取时按段数累加
+
+def _build_request(text):
     prompt = f"""
 从以下中文文本中抽取三元组（主语-谓语-宾语）关系，以 (主体, 动作, 客体) 的格式返回一个 JSON 数组。例如：
 输入：小明在公园里踢足球。
@@ -25,40 +27,119 @@ def extract_triples(text):
 {text}
 """
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
+    return {
+        "model": config.api.model,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": MAX_TOKENS_PER_TEXT,
+        "temperature": 0.5
     }
 
-    body = {
+def _build_batch_request(texts):
+    numbered = "\n".join(f"[{i}] {text}" for i, text in enumerate(texts, 1))
+    prompt = f"""
+以下是若干段带编号的中文文本。请分别从每段中抽取三元组（主语-谓语-宾语）关系，以 (主体, 动作, 客体) 的格式表示，
+返回一个 JSON 对象：键为文本编号，值为该段文本的三元组数组。例如：
+输入：
+[1] 小明在公园里踢足球。
+[2] 小红喜欢吃苹果。
+输出：{{"1": [["小明", "踢", "足球"]], "2": [["小红", "喜欢吃", "苹果"]]}}
+
+请从以下文本中提取所有可以识别出的三元组：
+{numbered}
+"""
+
+    return {
         "model": config.api.model,
         "messages": [
             {"role": "user", "content": prompt}
         ],
-        "max_tokens": 150,
+        "max_tokens": MAX_TOKENS_PER_TEXT * len(texts),
         "temperature": 0.5
     }
 
-    try:
-        response = requests.post(API_URL, headers=headers, json=body, timeout=10)
+def _load_json(content):
+    match = re.search(r"```json\s*(.*?)\s*```", content, re.DOTALL)
+    if match:
+        json_str = match.group(1)
+    else:
+        json_str = content.strip()  
+    return json.loads(json_str)
 
-        print("状态码:", response.status_code)
-        print("响应内容:", response.text)
+def _as_triples(items):
+    return [tuple(t) for t in items if isinstance(t, (list, tuple)) and len(t) == 3]
 
-        response.raise_for_status()
-        content_json = response.json()
+def _parse_triples(content):
+    triples = _load_json(content)
+    if not isinstance(triples, list):
+        raise ValueError(f"提取结果不是三元组数组: {content!r:.200}")
+    logger.info(f"提取到的三元组: {triples}")
+    return _as_triples(triples)
 
-        content = content_json['choices'][0]['message']['content']
-        match = re.search(r"```json\s*(.*?)\s*```", content, re.DOTALL)
-        if match:
-            json_str = match.group(1)
-        else:
-            json_str = content.strip()  
+def _parse_batch_triples(content, count):
+    """解析批量提取结果，返回与输入顺序对应的三元组列表；模型未按编号分组时返回None
+
+    模型漏掉的编号（或值不是数组）对应位置为None，表示该段没有得到结果，区别于确实没有三元组的空列表
+    """
+    data = _load_json(content)
+    if not isinstance(data, dict):
+        return None
+    results = [data.get(str(i)) for i in range(1, count + 1)]
+    results = [_as_triples(r) if isinstance(r, list) else None for r in results]
+    logger.info(f"批量提取到 {sum(len(r) for r in results if r)} 个三元组（{count} 段文本）")
+    return results
 
-        triples = json.loads(json_str)
-        logger.info(f"提取到的三元组: {triples}")
-        return [tuple(t) for t in triples if len(t) == 3]
+def _remember(text, triples):
+    """缓存成功解析的结果（包括确实没有三元组的空列表）；请求或解析失败时抛异常，走不到这里"""
+    if triples is not None:  # None 表示批量结果里漏掉了这一段，下次仍需提取
+        get_extraction_cache().put(text, triples)
+    return triples
 
+def extract_triples(text):
+    cached = get_extraction_cache().get(text)
+    if cached is not None:
+        return cached
+    try:
+        return _remember(text, _parse_triples(chat_completion_sync(_build_request(text))))
     except Exception as e:
         logger.error(f"调用 DeepSeek API 抽取三元组失败: {e}")
         return []
+
+async def extract_triples_async(text, raise_errors=False):
+    """extract_triples 的异步版本，走共享的 keep-alive 连接池；raise_errors=True 时请求或解析失败抛出异常而不是返回空列表"""
+    cached = get_extraction_cache().get(text)
+    if cached is not None:
+        return cached
+    try:
+        return _remember(text, _parse_triples(await chat_completion(_build_request(text))))
+    except Exception as e:
+        if raise_errors:
+            raise
+        logger.error(f"调用 DeepSeek API 抽取三元组失败: {e}")
+        return []
+
+async def extract_triples_batch_async(texts):
+    """一次模型调用抽取多段文本的三元组，返回与 texts 一一对应的列表（已缓存的文本不再请求）"""
+    cache = get_extraction_cache()
+    results = [cache.get(text) for text in texts]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if len(missing) == 1:
+        results[missing[0]] = await extract_triples_async(texts[missing[0]])
+    elif missing:
+        try:
+            batch = [texts[i] for i in missing]
+            extracted = _parse_batch_triples(await chat_completion(_build_batch_request(batch)), len(batch))
+        except Exception as e:
+            logger.error(f"调用 DeepSeek API 批量抽取三元组失败: {e}")
+            return [r or [] for r in results]
+        if extracted is None:
+            # 无法区分三元组来自哪一段，逐段重新提取，不把结果记到错误的文本上
+            logger.warning(f"批量提取结果未按编号分组，改为逐段提取（{len(batch)} 段）")
+            extracted = await asyncio.gather(*(extract_triples_async(text) for text in batch))
+            for i, triples in zip(missing, extracted):
+                results[i] = triples
+        else:
+            for i, triples in zip(missing, extracted):
+                results[i] = _remember(texts[i], triples)
+    return [r or [] for r in results]
@@ -1,8 +1,16 @@
 import json as _json
-from py2neo import Graph, Node, Relationship
+try:
+    from py2neo import Graph
+except ImportError:  # 进程内图引擎不依赖 py2neo
+    Graph = None
+from .triple_store import TripleStore
+from .keyword_index import REL_MATCH_WEIGHT, match_quality
+from .local_graph import LocalGraph
+from .keyword_extractor import EntityDictionary, segment
 import logging
 import sys
 import os
+import threading
 
 # 添加项目根目录到路径，以便导入config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
@@ -15,13 +23,15 @@ try:
     NEO4J_USER = config.grag.neo4j_user
     NEO4J_PASSWORD = config.grag.neo4j_password
     NEO4J_DATABASE = config.grag.neo4j_database
+    NEO4J_BATCH_SIZE = config.grag.neo4j_batch_size
+    GRAG_BACKEND = config.grag.backend
     
     try:
-        graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), name=NEO4J_DATABASE) if GRAG_ENABLED else None
+        use_neo4j = GRAG_ENABLED and GRAG_BACKEND != "local" and Graph is not None
+        graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), name=NEO4J_DATABASE) if use_neo4j else None
     except Exception as e:
-        print(f"[GRAG] Neo4j连接失败: {e}", file=sys.stderr)
+        print(f"[GRAG] Neo4j连接失败，改用进程内图引擎: {e}", file=sys.stderr)
         graph = None
-        GRAG_ENABLED = False
 except Exception as e:
     print(f"[GRAG] 无法从config模块读取Neo4j配置: {e}", file=sys.stderr)
     # 兼容旧版本，从config.json读取
@@ -34,71 +44,328 @@ except Exception as e:
         NEO4J_USER = grag_cfg['neo4j_user']
         NEO4J_PASSWORD = grag_cfg['neo4j_password']
         NEO4J_DATABASE = grag_cfg['neo4j_database']
+        NEO4J_BATCH_SIZE = grag_cfg.get('neo4j_batch_size', 500)
         GRAG_ENABLED = grag_cfg.get('enabled', True)
+        GRAG_BACKEND = grag_cfg.get('backend', 'auto')
         try:
-            graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), name=NEO4J_DATABASE) if GRAG_ENABLED else None
+            use_neo4j = GRAG_ENABLED and GRAG_BACKEND != "local" and Graph is not None
+            graph = Graph(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD), name=NEO4J_DATABASE) if use_neo4j else None
         except Exception as e:
-            print(f"[GRAG] Neo4j连接失败: {e}", file=sys.stderr)
+            print(f"[GRAG] Neo4j连接失败，改用进程内图引擎: {e}", file=sys.stderr)
             graph = None
-            GRAG_ENABLED = False
     except Exception as e:
         print(f"[GRAG] 无法从 config.json 读取Neo4j配置: {e}", file=sys.stderr)
         graph = None
         GRAG_ENABLED = False
+        NEO4J_BATCH_SIZE = 500
+        GRAG_BACKEND = "local"
 
 logger = logging.getLogger(__name__)
 TRIPLES_FILE = "triples.json"
+FULLTEXT_INDEX = "entity_name_fulltext"
+DEFAULT_QUERY_LIMIT = 20  # 关键词检索返回的三元组上限（按相关度排序后截断）
+
+_triple_store = None
+_triple_store_lock = threading.Lock()
+_local_graph = None
+
+
+def get_triple_store():
+    """获取全局三元组存储（首次调用时加载快照与追加日志）"""
+    global _triple_store
+    if _triple_store is None:
+        with _triple_store_lock:
+            if _triple_store is None:
+                _triple_store = TripleStore(TRIPLES_FILE)
+    return _triple_store
+
+
+def get_local_graph():
+    """获取进程内图引擎（首次调用时从三元组存储构建）"""
+    global _local_graph
+    if _local_graph is None:
+        store = get_triple_store()
+        with _triple_store_lock:
+            if _local_graph is None:
+                _local_graph = LocalGraph(store.ordered())
+    return _local_graph
 
 
 def load_triples():
-    try:
-        with open(TRIPLES_FILE, 'r', encoding='utf-8') as f:
-            return set(tuple(t) for t in _json.load(f))
-    except FileNotFoundError:
-        return set()
+    return get_triple_store().all()
 
 
 def save_triples(triples):
-    with open(TRIPLES_FILE, 'w', encoding='utf-8') as f:
-        _json.dump(list(triples), f, ensure_ascii=False, indent=2)
+    global _local_graph
+    store = get_triple_store()
+    with _triple_store_lock:
+        store.replace(triples)
+        _local_graph = None  # 整体替换后重建内存图
 
 
-def store_triples(new_triples):
-    all_triples = load_triples()
-    all_triples.update(new_triples)  # 集合自动去重
+def import_triples_file(path):
+    """一次性导入旧版 triples.json 文件中的三元组"""
+    global _local_graph
+    store = get_triple_store()
+    with _triple_store_lock:
+        imported = store.import_json(path)
+        _local_graph = None
+    return imported
+
 
-    # 持久化到文件
-    save_triples(all_triples)
+def store_triples(new_triples):
+    # 只追加新增三元组到日志，内存集合去重；与内存图构建共用一把锁，构建期间新增的三元组不会丢失
+    store = get_triple_store()
+    with _triple_store_lock:
+        added = store.add(new_triples)
+        if _local_graph is not None and added:
+            _local_graph.add(added)
 
     # 同步更新Neo4j图谱数据库（仅在GRAG_ENABLED时）
     if graph is not None:
-        for head, rel, tail in new_triples:
-            if not head or not tail:
-                logger.warning(f"跳过无效三元组，head或tail为空: {(head, rel, tail)}")
-                continue
-            h_node = Node("Entity", name=head)
-            t_node = Node("Entity", name=tail)
-            r = Relationship(h_node, rel, t_node)
-            graph.merge(h_node, "Entity", "name")
-            graph.merge(t_node, "Entity", "name")
-            graph.merge(r)
+        merge_triples_to_neo4j(new_triples)
+
+
+def ensure_neo4j_schema():
+    """创建 Entity.name 唯一约束（自带索引），让 MERGE 走索引而不是标签扫描"""
+    global graph
+    if graph is None:
+        return
+    try:
+        graph.run("RETURN 1")
+    except Exception as e:
+        # py2neo 延迟建连，首次查询才能发现Neo4j不可达
+        print(f"[GRAG] Neo4j不可达，改用进程内图引擎: {e}", file=sys.stderr)
+        graph = None
+        return
+    try:
+        graph.run("CREATE CONSTRAINT entity_name_unique IF NOT EXISTS FOR (e:Entity) REQUIRE e.name IS UNIQUE")
+    except Exception as e:
+        try:
+            # Neo4j 4.3 及更早版本的语法
+            graph.run("CREATE CONSTRAINT ON (e:Entity) ASSERT e.name IS UNIQUE")
+        except Exception as e2:
+            logger.warning(f"创建 Entity.name 唯一约束失败: {e} / {e2}")
+    try:
+        graph.run(f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX} IF NOT EXISTS FOR (e:Entity) ON EACH [e.name]")
+    except Exception as e:
+        try:
+            # Neo4j 4.x 的过程式语法
+            graph.run("CALL db.index.fulltext.createNodeIndex($index, ['Entity'], ['name'])", index=FULLTEXT_INDEX)
+        except Exception as e2:
+            if "already exists" not in str(e2):
+                logger.warning(f"创建 Entity.name 全文索引失败: {e} / {e2}")
+
+
+def _quote_rel_type(rel):
+    """关系类型无法参数化，只能用反引号转义后拼入查询"""
+    return "`" + str(rel).replace("`", "``") + "`"
+
+
+def merge_triples_to_neo4j(triples, batch_size=None):
+    """按关系类型分组，每批三元组用一次参数化 UNWIND ... MERGE 事务写入Neo4j"""
+    if graph is None:
+        return 0
+    batch_size = batch_size or NEO4J_BATCH_SIZE
+    rows_by_rel = {}
+    for head, rel, tail in triples:
+        if not head or not tail or not rel:
+            logger.warning(f"跳过无效三元组，head、rel或tail为空: {(head, rel, tail)}")
+            continue
+        rows_by_rel.setdefault(rel, []).append({"head": head, "tail": tail})
+
+    written = 0
+    for rel, rows in rows_by_rel.items():
+        query = (
+            "UNWIND $rows AS row "
+            "MERGE (h:Entity {name: row.head}) "
+            "MERGE (t:Entity {name: row.tail}) "
+            f"MERGE (h)-[r:{_quote_rel_type(rel)}]->(t) "
+            "ON CREATE SET r.created_at = timestamp()"
+        )
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            graph.run(query, rows=batch)
+            written += len(batch)
+    return written
 
 
 def get_all_triples():
     return load_triples()
 
 
-def query_graph_by_keywords(keywords):
-    results = []
+_LUCENE_SPECIAL = set('+-&|!(){}[]^"~*?:\\/')
+
+# 一次查询处理全部关键词：实体名走全文索引，关系类型只在类型目录里匹配；
+# 每个关键词对同一三元组取最佳匹配质量，多关键词累加后按得分与端点度数排序
+_KEYWORD_QUERY = f"""
+CALL {{
+    UNWIND $terms AS term
+    CALL db.index.fulltext.queryNodes('{FULLTEXT_INDEX}', term.phrase) YIELD node
+    WITH term, node WHERE node.name CONTAINS term.kw
+    MATCH (node)-[r]-(:Entity)
+    RETURN term.kw AS kw, r, toFloat(size(term.kw)) / size(node.name) AS quality
+    UNION ALL
+    CALL db.relationshipTypes() YIELD relationshipType
+    UNWIND $terms AS term
+    WITH term, relationshipType WHERE relationshipType CONTAINS term.kw
+    MATCH (:Entity)-[r]->(:Entity) WHERE type(r) = relationshipType
+    RETURN term.kw AS kw, r, toFloat(size(term.kw)) / size(relationshipType) * $rel_weight AS quality
+}}
+WITH kw, r, max(quality) AS quality
+WITH r, sum(quality) AS score
+WITH r, score, startNode(r) AS e1, endNode(r) AS e2
+RETURN e1.name AS head, type(r) AS rel, e2.name AS tail, score,
+       size([(e1)--() | 1]) + size([(e2)--() | 1]) AS degree
+ORDER BY score DESC, degree DESC
+LIMIT $limit
+"""
+
+
+def _lucene_phrase(keyword):
+    """把关键词转义为 Lucene 短语查询，避免特殊字符被当作查询语法"""
+    escaped = ''.join('\\' + c if c in _LUCENE_SPECIAL else c for c in keyword)
+    return f'"{escaped}"'
+
+
+def _normalize_keywords(keywords):
+    seen = []
+    for kw in keywords:
+        kw = str(kw).strip() if kw is not None else ""
+        if kw and kw not in seen:
+            seen.append(kw)
+    return seen
+
+
+def query_graph_by_keywords(keywords, limit=DEFAULT_QUERY_LIMIT):
+    """按关键词检索三元组，结果按匹配质量和实体度数排序
+
+    Neo4j 可用时发送一条参数化查询（全文索引）；不可用或查询失败时使用进程内图引擎。
+    """
+    keywords = _normalize_keywords(keywords)
+    if not keywords:
+        return []
+    if graph is not None:
+        terms = [{"kw": kw, "phrase": _lucene_phrase(kw)} for kw in keywords]
+        try:
+            res = graph.run(_KEYWORD_QUERY, terms=terms, rel_weight=REL_MATCH_WEIGHT, limit=limit).data()
+            return [(record['head'], record['rel'], record['tail']) for record in res]
+        except Exception as e:
+            logger.warning(f"Neo4j 关键词检索失败，改用进程内图引擎: {e}")
+    return get_local_graph().search(keywords, limit=limit)
+
+
+DEFAULT_EXPAND_FANOUT = (8, 4)  # 每跳每个实体最多展开的边数，长度即跳数
+DEFAULT_SEED_LIMIT = 5  # 展开的起点实体上限
+_EXPAND_ORDER_KEYS = {
+    "degree": "size([(m)--() | 1])",
+    "recency": "coalesce(r.created_at, 0)",
+}
+
+
+def _expand_query(hops, order):
+    """生成k跳展开查询：每跳一个相关子查询，对前沿实体逐个按排序键取前 fanout 条边"""
+    order_key = _EXPAND_ORDER_KEYS[order]
+    parts = [f"""
+UNWIND $terms AS term
+CALL db.index.fulltext.queryNodes('{FULLTEXT_INDEX}', term.phrase) YIELD node
+WITH term, node WHERE node.name CONTAINS term.kw
+WITH node, max(toFloat(size(term.kw)) / size(node.name)) AS quality
+ORDER BY quality DESC, size([(node)--() | 1]) DESC
+LIMIT $seed_limit
+WITH collect(node) AS frontier
+WITH frontier, frontier AS visited, [] AS edges
+"""]
+    for i in range(hops):
+        parts.append(f"""
+CALL {{
+    WITH frontier, edges
+    UNWIND frontier AS n
+    CALL {{
+        WITH n, edges
+        MATCH (n)-[r]-(m:Entity)
+        WHERE NOT r IN edges
+        WITH r, m ORDER BY {order_key} DESC
+        LIMIT $fanout{i}
+        RETURN r, m
+    }}
+    RETURN collect(DISTINCT r) AS hop_edges, collect(DISTINCT m) AS reached
+}}
+WITH edges + hop_edges AS edges, visited, [m IN reached WHERE NOT m IN visited] AS frontier
+WITH edges, frontier, visited + frontier AS visited
+""")
+    parts.append("RETURN [r IN edges | [startNode(r).name, type(r), endNode(r).name]] AS triples")
+    return "".join(parts)
+
+
+def estimate_tokens(text):
+    """粗略估算token数：中日韩字符按1个计，其余字符约4个计1个"""
+    cjk = sum(1 for c in text if '\u3040' <= c <= '\u9fff' or '\uac00' <= c <= '\ud7af')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def format_triple(triple):
+    head, rel, tail = triple
+    return f"- {head} —[{rel}]→ {tail}"
+
+
+def _seed_entities(keywords, seed_limit):
+    local = get_local_graph()
+    scored = {}
+    for kw in keywords:
+        for name in local.match_entities(kw):
+            scored[name] = max(scored.get(name, 0.0), match_quality(kw, name))
+    return sorted(scored, key=lambda n: (scored[n], local.degree(n)), reverse=True)[:seed_limit]
+
+
+def expand_neighborhood(keywords, fanout=DEFAULT_EXPAND_FANOUT, order="degree", max_tokens=None,
+                        seed_limit=DEFAULT_SEED_LIMIT):
+    """返回关键词命中实体周围的k跳子图三元组
+
+    fanout 为每跳的展开上限序列（长度即跳数）；order 为 "degree" 或 "recency"，决定每个实体
+    优先展开哪些边。结果去重并按跳数由近及远排列，给定 max_tokens 时按格式化后的行截断。
+    Neo4j 可用时只发一条查询，否则在进程内图上做BFS。
+    """
+    if order not in _EXPAND_ORDER_KEYS:
+        raise ValueError(f"不支持的展开排序方式: {order}")
+    keywords = _normalize_keywords(keywords)
+    fanouts = [int(f) for f in fanout]
+    if not keywords or not fanouts:
+        return []
+
+    triples = None
     if graph is not None:
-        for kw in keywords:
-            query = f"""
-            MATCH (e1:Entity)-[r]->(e2:Entity)
-            WHERE e1.name CONTAINS '{kw}' OR e2.name CONTAINS '{kw}' OR type(r) CONTAINS '{kw}'
-            RETURN e1.name, type(r), e2.name
-            LIMIT 5
-            """
-            res = graph.run(query).data()
-            for record in res:
-                results.append((record['e1.name'], record['type(r)'], record['e2.name']))
-    return results
+        terms = [{"kw": kw, "phrase": _lucene_phrase(kw)} for kw in keywords]
+        params = {f"fanout{i}": f for i, f in enumerate(fanouts)}
+        try:
+            res = graph.run(_expand_query(len(fanouts), order), terms=terms, seed_limit=seed_limit, **params).data()
+            triples = [tuple(t) for t in res[0]["triples"]] if res else []
+        except Exception as e:
+            logger.warning(f"Neo4j 子图展开失败，改用进程内图引擎: {e}")
+    if triples is None:
+        triples = get_local_graph().expand(_seed_entities(keywords, seed_limit), fanouts, order)
+
+    result, seen, used = [], set(), 0
+    for t in triples:
+        if t in seen:
+            continue
+        if max_tokens is not None:
+            cost = estimate_tokens(format_triple(t)) + 1
+            if used + cost > max_tokens:
+                break
+            used += cost
+        seen.add(t)
+        result.append(t)
+    return result
+
+
+_entity_dictionary = EntityDictionary(get_local_graph)
+
+
+def extract_keywords(text):
+    """本地关键词提取：优先匹配图谱中已有的实体名，未命中时退回轻量分词"""
+    return _entity_dictionary.match(text) or segment(text)
+
+
+# 启动时确保Neo4j索引约束存在
+ensure_neo4j_schema()
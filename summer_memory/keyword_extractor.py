@@ -0,0 +1,134 @@
+import re
+import threading
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .local_graph import LocalGraph
+
+try:
+    import jieba  # 可选依赖，安装后分词更准确
+    jieba.setLogLevel(60)
+except ImportError:
+    jieba = None
+
+MIN_ENTITY_LEN = 2  # 单字实体在问句中命中噪声太大，不参与词典匹配
+MAX_SEGMENT_LEN = 8
+
+_SPLIT_RE = re.compile(r"[\s，。！？、；：,.!?;:\"'“”‘’（）()【】\[\]《》<>…—\-~·]+")
+_ASCII_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9_+#.]*")
+
+# 问句中常见的虚词与疑问词，作为简易分词的切分点
+STOPWORDS = (
+    "什么", "怎么", "怎样", "为什么", "哪些", "哪个", "哪里", "多少", "是否", "有没有",
+    "请问", "告诉", "知道", "关于", "一下", "我们", "你们", "他们", "她们", "它们", "自己",
+    "这个", "那个", "这些", "那些", "可以", "还有", "以及", "或者", "还是", "就是", "一个",
+    "的", "了", "是", "吗", "呢", "吧", "啊", "呀", "和", "与", "及", "在", "有", "我", "你",
+    "他", "她", "它", "谁", "把", "被", "给", "对", "从", "都", "也", "还", "又", "就", "会",
+    "要", "想", "能", "请", "说", "过", "着", "么",
+)
+
+
+class AhoCorasick:
+    """多模式串匹配自动机，一次扫描找出文本中出现的全部词典词"""
+
+    def __init__(self, words: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        for word in words:
+            self._insert(word)
+        self._build()
+
+    def _insert(self, word: str):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(word)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> List[Tuple[int, str]]:
+        """返回 (起始位置, 词) 列表"""
+        state = 0
+        hits = []
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for word in self._out[state]:
+                hits.append((i - len(word) + 1, word))
+        return hits
+
+    def find_longest(self, text: str) -> List[str]:
+        """最左最长、互不重叠的匹配结果"""
+        hits = sorted(self.find_all(text), key=lambda h: (h[0], -len(h[1])))
+        result, end = [], 0
+        for start, word in hits:
+            if start >= end:
+                result.append(word)
+                end = start + len(word)
+        return result
+
+
+class EntityDictionary:
+    """基于图谱实体名的词典匹配，实体集合变化时惰性重建自动机
+
+    graph_source 返回当前的 LocalGraph（图整体替换后对象会变化）。
+    """
+
+    def __init__(self, graph_source: Callable[[], "LocalGraph"]):
+        self._graph_source = graph_source
+        self._automaton: Optional[AhoCorasick] = None
+        self._built_for: Tuple[int, int] = (0, -1)  # (图对象id, 实体数)
+        self._lock = threading.Lock()
+
+    def _get_automaton(self) -> AhoCorasick:
+        graph = self._graph_source()
+        key = (id(graph), graph.entity_count())
+        with self._lock:
+            if self._automaton is None or key != self._built_for:
+                self._automaton = AhoCorasick(n for n in graph.entity_names() if len(n) >= MIN_ENTITY_LEN)
+                self._built_for = key
+            return self._automaton
+
+    def match(self, text: str) -> List[str]:
+        return _dedup(self._get_automaton().find_longest(text))
+
+
+def segment(text: str) -> List[str]:
+    """轻量中文切词：有 jieba 时用 jieba，否则按标点与停用词切分"""
+    if jieba is not None:
+        words = jieba.lcut(text)
+        return _dedup(w.strip() for w in words
+                      if len(w.strip()) >= 2 and w.strip() not in STOPWORDS and not _SPLIT_RE.fullmatch(w))
+
+    words = []
+    for chunk in _SPLIT_RE.split(text):
+        words.extend(_ASCII_WORD_RE.findall(chunk))
+        chunk = _ASCII_WORD_RE.sub(" ", chunk)
+        for sw in STOPWORDS:
+            chunk = chunk.replace(sw, " ")
+        words.extend(w for w in chunk.split() if 2 <= len(w) <= MAX_SEGMENT_LEN)
+    return _dedup(words)
+
+
+def _dedup(words: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(w for w in words if w))
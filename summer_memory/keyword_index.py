@@ -0,0 +1,24 @@
+from typing import Set
+
+REL_MATCH_WEIGHT = 0.8  # 关系类型命中的权重略低于实体名命中
+
+
+def name_grams(text: str) -> Set[str]:
+    """单字 + 相邻二字片段，中文不分词也能做子串检索"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def query_grams(keyword: str) -> Set[str]:
+    """查询时只需二字片段（单字关键词退化为单字）"""
+    if len(keyword) < 2:
+        return {keyword}
+    return {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+
+
+def match_quality(keyword: str, name: str) -> float:
+    """完全匹配为1，子串匹配按覆盖比例计分，不匹配为0"""
+    if not keyword or keyword not in name:
+        return 0.0
+    return len(keyword) / len(name)
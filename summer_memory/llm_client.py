@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import sys
+import os
+import weakref
+
+# 添加项目根目录到路径，以便导入config
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from config import config
+from llm_gateway import get_llm_gateway
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 10
+MAX_CONCURRENCY = config.grag.llm_max_concurrency  # 记忆系统在全局额度内的并发上限，避免挤占对话请求
+MAX_RETRIES = config.grag.llm_max_retries
+
+
+class LLMRequestError(Exception):
+    """调用大模型接口失败（已用尽重试）"""
+
+
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        for closed in [l for l in _semaphores if l.is_closed()]:
+            del _semaphores[closed]  # 已关闭循环上的信号量随之丢弃
+        semaphore = _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return semaphore
+
+
+async def chat_completion(body: dict) -> str:
+    """异步调用 chat/completions，返回首个回复内容；连接复用与重试由统一网关负责"""
+    async with _get_semaphore():
+        try:
+            response = await get_llm_gateway().create(retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT, **body)
+        except Exception as e:
+            raise LLMRequestError(f"请求失败: {e}") from e
+    return _first_choice(response)
+
+
+def chat_completion_sync(body: dict) -> str:
+    """同步版本，供命令行等非异步入口使用"""
+    try:
+        response = get_llm_gateway().create_sync(retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT, **body)
+    except Exception as e:
+        raise LLMRequestError(f"请求失败: {e}") from e
+    return _first_choice(response)
+
+
+def _first_choice(response) -> str:
+    if not response.choices:
+        raise LLMRequestError("响应中未找到 'choices' 字段")
+    return response.choices[0].message.content
+
+
+async def close():
+    """释放当前事件循环的信号量并关闭网关的异步连接（批量导入结束时调用）"""
+    _semaphores.pop(asyncio.get_running_loop(), None)
+    await get_llm_gateway().aclose()
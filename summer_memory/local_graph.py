@@ -0,0 +1,188 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .keyword_index import name_grams, query_grams, match_quality, REL_MATCH_WEIGHT
+
+Triple = Tuple[str, str, str]
+Edge = Tuple[int, int]  # (关系ID, 对端实体ID)
+
+
+class LocalGraph:
+    """进程内图引擎：Neo4j不可用时提供与 graph.py 相同的存储/检索能力
+
+    实体名与关系名各自驻留为整数ID，邻接表按实体ID保存出边与入边；
+    名称上建 n-gram 倒排索引支持子串检索。持久化由 TripleStore 负责，本类只维护内存结构。
+    """
+
+    def __init__(self, triples: Optional[Iterable[Triple]] = None):
+        self._entity_ids: Dict[str, int] = {}
+        self._entities: List[str] = []
+        self._rel_ids: Dict[str, int] = {}
+        self._rels: List[str] = []
+        self._out: List[Set[Edge]] = []  # 实体ID → {(关系ID, 尾实体ID)}
+        self._in: List[Set[Edge]] = []   # 实体ID → {(关系ID, 头实体ID)}
+        self._rel_edges: Dict[int, Set[Tuple[int, int]]] = defaultdict(set)  # 关系ID → {(头ID, 尾ID)}
+        self._entity_grams: Dict[str, Set[int]] = defaultdict(set)
+        self._rel_grams: Dict[str, Set[int]] = defaultdict(set)
+        self._edge_seq: Dict[Tuple[int, int, int], int] = {}  # 边 → 写入序号，用于按新近程度挑边
+        self._lock = threading.RLock()
+        if triples:
+            self.add(triples)
+
+    # --- 驻留 ---
+    def _entity_id(self, name: str) -> int:
+        eid = self._entity_ids.get(name)
+        if eid is None:
+            eid = len(self._entities)
+            self._entity_ids[name] = eid
+            self._entities.append(name)
+            self._out.append(set())
+            self._in.append(set())
+            for g in name_grams(name):
+                self._entity_grams[g].add(eid)
+        return eid
+
+    def _rel_id(self, rel: str) -> int:
+        rid = self._rel_ids.get(rel)
+        if rid is None:
+            rid = len(self._rels)
+            self._rel_ids[rel] = rid
+            self._rels.append(rel)
+            for g in name_grams(rel):
+                self._rel_grams[g].add(rid)
+        return rid
+
+    # --- 写入 ---
+    def add(self, triples: Iterable[Triple]) -> int:
+        """加入三元组，返回实际新增的边数"""
+        added = 0
+        with self._lock:
+            for head, rel, tail in triples:
+                if not head or not rel or not tail:
+                    continue
+                h, r, t = self._entity_id(head), self._rel_id(rel), self._entity_id(tail)
+                if (r, t) in self._out[h]:
+                    continue
+                self._out[h].add((r, t))
+                self._in[t].add((r, h))
+                self._rel_edges[r].add((h, t))
+                self._edge_seq[(h, r, t)] = len(self._edge_seq)
+                added += 1
+        return added
+
+    # --- 读取 ---
+    def __len__(self):
+        return len(self._edge_seq)
+
+    def _triple(self, h: int, r: int, t: int) -> Triple:
+        return self._entities[h], self._rels[r], self._entities[t]
+
+    def triples(self) -> Set[Triple]:
+        with self._lock:
+            return {self._triple(h, r, t) for h, edges in enumerate(self._out) for r, t in edges}
+
+    def entity_count(self) -> int:
+        return len(self._entities)
+
+    def entity_names(self) -> List[str]:
+        with self._lock:
+            return list(self._entities)
+
+    def degree(self, entity: str) -> int:
+        eid = self._entity_ids.get(entity)
+        if eid is None:
+            return 0
+        return len(self._out[eid]) + len(self._in[eid])
+
+    def _degree_id(self, eid: int) -> int:
+        return len(self._out[eid]) + len(self._in[eid])
+
+    def edges_of(self, entity: str) -> List[Triple]:
+        """返回与实体相连的全部三元组（出边与入边）"""
+        with self._lock:
+            eid = self._entity_ids.get(entity)
+            if eid is None:
+                return []
+            return ([self._triple(eid, r, t) for r, t in self._out[eid]] +
+                    [self._triple(h, r, eid) for r, h in self._in[eid]])
+
+    @staticmethod
+    def _lookup(grams: Dict[str, Set[int]], names: List[str], keyword: str) -> Set[int]:
+        postings = [grams.get(g) for g in query_grams(keyword)]
+        if not postings or any(not p for p in postings):
+            return set()
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return {i for i in candidates if keyword in names[i]}  # n-gram交集可能误召回，逐个校验
+
+    def match_entities(self, keyword: str) -> List[str]:
+        """名称包含关键词的实体"""
+        with self._lock:
+            return [self._entities[i] for i in self._lookup(self._entity_grams, self._entities, keyword)]
+
+    def search(self, keywords: Iterable[str], limit: Optional[int] = None) -> List[Triple]:
+        """按匹配质量（多关键词累加）和端点度数排序返回三元组"""
+        scores: Dict[Tuple[int, int, int], float] = defaultdict(float)
+        with self._lock:
+            for kw in {str(k).strip() for k in keywords if k and str(k).strip()}:
+                best: Dict[Tuple[int, int, int], float] = {}
+                for eid in self._lookup(self._entity_grams, self._entities, kw):
+                    q = match_quality(kw, self._entities[eid])
+                    for r, t in self._out[eid]:
+                        key = (eid, r, t)
+                        best[key] = max(best.get(key, 0.0), q)
+                    for r, h in self._in[eid]:
+                        key = (h, r, eid)
+                        best[key] = max(best.get(key, 0.0), q)
+                for rid in self._lookup(self._rel_grams, self._rels, kw):
+                    q = match_quality(kw, self._rels[rid]) * REL_MATCH_WEIGHT
+                    for h, t in self._rel_edges[rid]:
+                        key = (h, rid, t)
+                        best[key] = max(best.get(key, 0.0), q)
+                for key, q in best.items():
+                    scores[key] += q
+            ranked = sorted(
+                scores,
+                key=lambda k: (scores[k], self._degree_id(k[0]) + self._degree_id(k[2])),
+                reverse=True,
+            )
+            if limit:
+                ranked = ranked[:limit]
+            return [self._triple(*k) for k in ranked]
+
+    def expand(self, seeds: Iterable[str], fanouts: Sequence[int], order: str = "degree") -> List[Triple]:
+        """从种子实体做逐跳BFS，返回k跳子图（k = len(fanouts)）的三元组，按发现顺序排列
+
+        每跳对每个前沿实体最多取 fanouts[i] 条尚未访问的边；order 为 "degree" 时优先连向
+        高度数邻居的边，为 "recency" 时优先最近写入的边。
+        """
+        with self._lock:
+            frontier = []
+            for name in seeds:
+                eid = self._entity_ids.get(name)
+                if eid is not None and eid not in frontier:
+                    frontier.append(eid)
+            visited = set(frontier)
+            seen_edges: Set[Tuple[int, int, int]] = set()
+            result: List[Triple] = []
+            for cap in fanouts:
+                next_frontier = []
+                for eid in frontier:
+                    candidates = [((eid, r, t), t) for r, t in self._out[eid]]
+                    candidates += [((h, r, eid), h) for r, h in self._in[eid]]
+                    candidates = [c for c in candidates if c[0] not in seen_edges]
+                    if order == "recency":
+                        candidates.sort(key=lambda c: self._edge_seq[c[0]], reverse=True)
+                    else:
+                        candidates.sort(key=lambda c: self._degree_id(c[1]), reverse=True)
+                    for edge, neighbor in candidates[:cap]:
+                        seen_edges.add(edge)
+                        result.append(self._triple(*edge))
+                        if neighbor not in visited:
+                            visited.add(neighbor)
+                            next_frontier.append(neighbor)
+                frontier = next_frontier
+                if not frontier:
+                    break
+            return result
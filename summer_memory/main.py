@@ -10,6 +10,7 @@ from .extractor_ds_tri import extract_triples
 from .graph import store_triples
 from .visualize import visualize_triples
 from .rag_query_tri import query_knowledge, set_context
+from .bulk_ingest import ingest_file
 
 # 添加上级目录以导入 config.py
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -128,12 +129,28 @@ def batch_add_from_file(filename):# 从文件批量处理文本
         return False
 
 
+def bulk_add_from_file(filename, concurrency=4, rate=5.0):# 大文件并发导入，支持断点续传
+    try:
+        if not os.path.exists(filename):
+            logger.error(f"文件 {filename} 不存在")
+            raise FileNotFoundError(f"文件 {filename} 不存在")
+        stats = ingest_file(filename, concurrency=concurrency, rate=rate)
+        print(f"导入完成：{stats['texts']} 条文本，{stats['triples']} 个三元组，"
+              f"{stats['texts_per_sec']:.2f} 条/秒，{stats['triples_per_sec']:.2f} 三元组/秒")
+        return stats['triples'] > 0
+    except Exception as e:
+        logger.error(f"批量导入文件失败: {e}")
+        traceback.print_exc()
+        return False
+
+
 def main(): # 主程序
     try:
         print("请选择输入方式：")
         print("1 - 手动输入文本")
         print("2 - 从文件读取文本")
-        choice = input("请输入 1 或 2：").strip()
+        print("3 - 并发导入大文件（可断点续传）")
+        choice = input("请输入 1、2 或 3：").strip()
 
         if choice == "1":
             print("请输入要处理的文本（每行一段，输入空行结束）：")
@@ -156,8 +173,12 @@ def main(): # 主程序
             filename = input("请输入文件路径：").strip()
             success = batch_add_from_file(filename)
 
+        elif choice == "3":
+            filename = input("请输入文件路径：").strip()
+            success = bulk_add_from_file(filename)
+
         else:
-            print("无效输入，仅支持 1 或 2。程序退出。")
+            print("无效输入，仅支持 1、2 或 3。程序退出。")
             return
 
         if success:
@@ -1,13 +1,19 @@
 import logging
 import asyncio
-from typing import List, Dict, Optional, Tuple
-from .extractor_ds_tri import extract_triples
-from .graph import store_triples, query_graph_by_keywords, get_all_triples
-from .rag_query_tri import query_knowledge, set_context
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Sequence, Tuple
+from .extractor_ds_tri import extract_triples_batch_async
+from .extraction_queue import ExtractionBatcher
+from .extraction_cache import get_extraction_cache
+from .graph import store_triples, query_graph_by_keywords, expand_neighborhood, get_triple_store, DEFAULT_EXPAND_FANOUT
+from .rag_query_tri import query_knowledge_async, set_context
 import config
+from tracing import span
 
 logger = logging.getLogger(__name__)
 
+GRAPH_IO_WORKERS = 2  # 图谱读写专用线程数，不占用默认线程池
+
 class GRAGMemoryManager:
     """GRAG知识图谱记忆管理器"""
     
@@ -17,7 +23,14 @@ class GRAGMemoryManager:
         self.context_length = config.GRAG_CONTEXT_LENGTH
         self.similarity_threshold = config.GRAG_SIMILARITY_THRESHOLD
         self.recent_context = [] # 最近对话上下文
-        self.extraction_cache = set() # 避免重复提取
+        self.extraction_cache = get_extraction_cache() # 持久化提取缓存，避免重复提取
+        self._io_executor = ThreadPoolExecutor(max_workers=GRAPH_IO_WORKERS, thread_name_prefix="grag-io")
+        self._batcher = ExtractionBatcher(
+            self._extract_and_store_batch,
+            batch_size=config.GRAG_EXTRACT_BATCH_SIZE,
+            flush_interval=config.GRAG_EXTRACT_FLUSH_INTERVAL,
+            queue_size=config.GRAG_EXTRACT_QUEUE_SIZE,
+        )
         
         if not self.enabled:
             logger.info("GRAG记忆系统已禁用")
@@ -40,35 +53,36 @@ class GRAGMemoryManager:
             conversation_text = f"用户: {user_input}\n娜迦: {ai_response}"
             # 仅用于三元组提取和写入，不存储到self.recent_context
             if self.auto_extract:
-                # 启动异步任务，不阻塞主流程
-                asyncio.create_task(self._extract_and_store_triples(conversation_text))
+                # 入队合并提取，队列满时在此等待（背压）；是否已提取过由批处理在图谱IO线程上查缓存
+                with span("memory.add", chars=len(conversation_text)):
+                    await self._batcher.submit(conversation_text)
             return True
         except Exception as e:
             logger.error(f"添加对话记忆失败: {e}")
             return False
     
-    async def _extract_and_store_triples(self, text: str) -> bool:
-        """提取并存储三元组"""
-        try:
-            # 检查是否已处理过
-            text_hash = hash(text)
-            if text_hash in self.extraction_cache:
-                return True
-                
-            # 异步提取三元组
-            loop = asyncio.get_event_loop()
-            triples = await loop.run_in_executor(None, extract_triples, text)
-            
-            if triples:
-                # 异步存储到Neo4j
-                await loop.run_in_executor(None, store_triples, triples)
-                self.extraction_cache.add(text_hash)
-                logger.info(f"成功提取并存储 {len(triples)} 个三元组")
-                return True
-            return False
-        except Exception as e:
-            logger.error(f"提取三元组失败: {e}")
-            return False
+    async def _extract_and_store_batch(self, texts: List[str]) -> int:
+        """一次模型调用提取多轮对话的三元组，并一次性批量写入图谱"""
+        loop = asyncio.get_event_loop()
+        texts = await loop.run_in_executor(self._io_executor, self._uncached, texts)  # SQLite查询不占事件循环
+        if not texts:
+            return 0
+        with span("memory.extract_batch", texts=len(texts)) as s:
+            results = await extract_triples_batch_async(texts)
+            all_triples = [t for triples in results for t in triples]
+            s.set(triples=len(all_triples))
+            if all_triples:
+                await loop.run_in_executor(self._io_executor, store_triples, all_triples)
+            logger.info(f"成功提取并存储 {len(all_triples)} 个三元组（{len(texts)} 轮对话）")
+        return len(all_triples)
+
+    def _uncached(self, texts: List[str]) -> List[str]:
+        """过滤掉已提取过（已写入图谱）的对话，在图谱IO线程上调用"""
+        return [text for text in texts if text not in self.extraction_cache]
+
+    async def flush_extraction(self):
+        """等待排队中的对话全部完成提取与写入"""
+        await self._batcher.flush()
     
     async def query_memory(self, question: str) -> Optional[str]:
         """查询记忆"""
@@ -80,8 +94,9 @@ class GRAGMemoryManager:
             set_context(self.recent_context)
             
             # 异步查询
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(None, query_knowledge, question)
+            with span("memory.query") as s:
+                result = await query_knowledge_async(question, executor=self._io_executor)
+                s.set(hit=bool(result and "未在知识图谱中找到相关信息" not in result))
             
             if result and "未在知识图谱中找到相关信息" not in result:
                 logger.info("从记忆中找到相关信息")
@@ -97,26 +112,36 @@ class GRAGMemoryManager:
             return []
             
         try:
-            # 从Neo4j查询相关三元组
+            # 从Neo4j（或本地索引）查询相关三元组，结果已按相关度排序
             loop = asyncio.get_event_loop()
-            triples = await loop.run_in_executor(None, query_graph_by_keywords, [query])
-            
-            # 限制返回数量
-            return triples[:limit]
+            return await loop.run_in_executor(self._io_executor, query_graph_by_keywords, [query], limit)
         except Exception as e:
             logger.error(f"获取相关记忆失败: {e}")
             return []
     
+    async def expand_memories(self, keywords: List[str], fanout: Sequence[int] = DEFAULT_EXPAND_FANOUT,
+                              order: str = "degree", max_tokens: Optional[int] = 400) -> List[Tuple[str, str, str]]:
+        """获取关键词命中实体周围的多跳子图（每跳限制展开数，按token预算截断）"""
+        if not self.enabled:
+            return []
+
+        try:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                self._io_executor, lambda: expand_neighborhood(keywords, fanout=fanout, order=order, max_tokens=max_tokens))
+        except Exception as e:
+            logger.error(f"展开相关记忆失败: {e}")
+            return []
+    
     def get_memory_stats(self) -> Dict:
         """获取记忆统计信息"""
         if not self.enabled:
             return {"enabled": False}
             
         try:
-            all_triples = get_all_triples()
             return {
                 "enabled": True,
-                "total_triples": len(all_triples),
+                "total_triples": len(get_triple_store()),
                 "context_length": len(self.recent_context),
                 "cache_size": len(self.extraction_cache)
             }
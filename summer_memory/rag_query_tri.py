@@ -1,4 +1,4 @@
-import requests
+import asyncio
 import json
 import logging
 import sys
@@ -8,7 +8,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from config import config
-API_URL = f"{config.api.base_url.rstrip('/')}/chat/completions"
+from .llm_client import chat_completion, chat_completion_sync, LLMRequestError
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
@@ -23,8 +23,25 @@ def set_context(texts):
     recent_context = texts[:0]  # 限制上下文长度
     logger.info(f"更新查询上下文: {recent_context}")
 
-def query_knowledge(user_question):
-    """使用 DeepSeek API 提取关键词并查询知识图谱"""
+def _format_answer(triples):
+    from .graph import format_triple
+    answer = "我在知识图谱中找到以下相关信息：\n\n"
+    for triple in triples:
+        answer += format_triple(triple) + "\n"
+    return answer
+
+def query_local(user_question):
+    """本地匹配实体名/分词并查询知识图谱，无结果时返回 None"""
+    from .graph import query_graph_by_keywords, extract_keywords
+    local_keywords = extract_keywords(user_question)
+    if local_keywords:
+        triples = query_graph_by_keywords(local_keywords)
+        if triples:
+            logger.info(f"本地提取关键词: {local_keywords}")
+            return _format_answer(triples)
+    return None
+
+def _build_keyword_request(user_question):
     context_str = "\n".join(recent_context) if recent_context else "无上下文"
     prompt = (
         f"基于以下上下文和用户问题，提取与知识图谱相关的关键词（如实体、关系），"
@@ -34,11 +51,6 @@ def query_knowledge(user_question):
         f"输出格式：```json\n[]\n```"
     )
 
-    headers = {
-        "Authorization": f"Bearer {config.api.api_key}",
-        "Content-Type": "application/json"
-    }
-
     # 检测是否使用ollama并启用结构化输出
     is_ollama = "localhost" in config.api.base_url or "11434" in config.api.base_url
     
@@ -53,7 +65,7 @@ def query_knowledge(user_question):
     
     # 为ollama添加结构化输出
     if is_ollama:
-        body["format"] = "json"
+        body["extra_body"] = {"format": "json"}  # 非OpenAI字段经 extra_body 透传
         # 简化提示词，ollama会自动处理JSON格式
         simplified_prompt = (
             f"基于以下上下文和用户问题，提取与知识图谱相关的关键词（如实体、关系），"
@@ -62,50 +74,65 @@ def query_knowledge(user_question):
             f"问题：{user_question}"
         )
         body["messages"] = [{"role": "user", "content": simplified_prompt}]
+    return body
 
+def _parse_keywords(raw_content):
+    """解析模型返回的关键词列表，失败时抛出 ValueError"""
+    raw_content = raw_content.strip()
+    if raw_content.startswith("```json") and raw_content.endswith("```"):
+        raw_content = raw_content[7:-3].strip()
+    keywords = json.loads(raw_content)
+    if not isinstance(keywords, list):
+        raise ValueError("关键词应为列表")
+    return keywords
+
+def _answer_from_llm_output(raw_content):
     try:
-        response = requests.post(API_URL, headers=headers, json=body, timeout=10)
-        response.raise_for_status()
-        content = response.json()
-
-        if "choices" not in content or not content["choices"]:
-            logger.error("DeepSeek API 响应中未找到 'choices' 字段")
-            return "无法处理 API 响应，请稍后重试。"
-
-        raw_content = content["choices"][0]["message"]["content"]
-        try:
-            raw_content = raw_content.strip()
-            if raw_content.startswith("```json") and raw_content.endswith("```"):
-                raw_content = raw_content[7:-3].strip()
-            keywords = json.loads(raw_content)
-            if not isinstance(keywords, list):
-                raise ValueError("关键词应为列表")
-        except (json.JSONDecodeError, ValueError) as e:
-            logger.error(f"解析 DeepSeek 响应失败: {raw_content}, 错误: {e}")
-            return "无法解析关键词，请检查问题格式。"
-
-        if not keywords:
-            logger.warning("未提取到关键词")
-            return "未找到相关关键词，请提供更具体的问题。"
-
-        logger.info(f"提取关键词: {keywords}")
-        from .graph import query_graph_by_keywords
-        triples = query_graph_by_keywords(keywords)
-        if not triples:
-            logger.info(f"未找到相关三元组: {keywords}")
-            return "未在知识图谱中找到相关信息。"
-
-        answer = "我在知识图谱中找到以下相关信息：\n\n"
-        for h, r, t in triples:
-            answer += f"- {h} —[{r}]→ {t}\n"
-        return answer
-
-    except requests.exceptions.HTTPError as e:
-        logger.error(f"DeepSeek API HTTP 错误: {e}")
+        keywords = _parse_keywords(raw_content)
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error(f"解析 DeepSeek 响应失败: {raw_content}, 错误: {e}")
+        return "无法解析关键词，请检查问题格式。"
+
+    if not keywords:
+        logger.warning("未提取到关键词")
+        return "未找到相关关键词，请提供更具体的问题。"
+
+    logger.info(f"提取关键词: {keywords}")
+    from .graph import query_graph_by_keywords
+    triples = query_graph_by_keywords(keywords)
+    if not triples:
+        logger.info(f"未找到相关三元组: {keywords}")
+        return "未在知识图谱中找到相关信息。"
+
+    return _format_answer(triples)
+
+def query_knowledge(user_question):
+    """提取关键词并查询知识图谱：先在本地匹配实体名/分词，无结果时才调用 DeepSeek API 提取"""
+    try:
+        answer = query_local(user_question)
+        if answer:
+            return answer
+        raw_content = chat_completion_sync(_build_keyword_request(user_question))
+        return _answer_from_llm_output(raw_content)
+    except LLMRequestError as e:
+        logger.error(f"DeepSeek API 请求失败: {e}")
         return "调用 DeepSeek API 失败，请检查 API 密钥或网络连接。"
-    except requests.exceptions.RequestException as e:
+    except Exception as e:
+        logger.error(f"查询过程中发生未知错误: {e}")
+        return "查询过程中发生未知错误，请稍后重试。"
+
+async def query_knowledge_async(user_question, executor=None):
+    """query_knowledge 的异步版本：图谱读写在 executor 中执行，模型请求走共享连接池"""
+    loop = asyncio.get_running_loop()
+    try:
+        answer = await loop.run_in_executor(executor, query_local, user_question)
+        if answer:
+            return answer
+        raw_content = await chat_completion(_build_keyword_request(user_question))
+        return await loop.run_in_executor(executor, _answer_from_llm_output, raw_content)
+    except LLMRequestError as e:
         logger.error(f"DeepSeek API 请求失败: {e}")
-        return "无法连接到 DeepSeek API，请检查网络。"
+        return "调用 DeepSeek API 失败，请检查 API 密钥或网络连接。"
     except Exception as e:
         logger.error(f"查询过程中发生未知错误: {e}")
         return "查询过程中发生未知错误，请稍后重试。"
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+Triple = Tuple[str, str, str]
+
+DEFAULT_COMPACT_THRESHOLD = 1000  # 日志累计多少行后触发后台压缩
+
+
+class TripleStore:
+    """追加写三元组存储
+
+    磁盘布局：
+    - 快照文件（默认 triples.json，与旧版格式兼容的 JSON 数组）
+    - 追加日志（快照文件名 + .log，每行一个 JSON 三元组）
+    写入只追加新三元组，代价为 O(新增数量)；日志过长时在后台线程合并进快照。
+    """
+
+    def __init__(self, snapshot_file: str = "triples.json", log_file: Optional[str] = None,
+                 compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file or snapshot_file + ".log"
+        self.compacting_file = self.log_file + ".compacting"  # 压缩期间冻结的旧日志
+        self.compact_threshold = compact_threshold
+        self._triples: Dict[Triple, None] = {}  # 内存去重索引（保留写入顺序）
+        self._lock = threading.RLock()
+        self._log_lines = 0
+        self._generation = 0  # replace() 次数，压缩据此判断期间内容是否被整体替换
+        self._compact_thread: Optional[threading.Thread] = None
+        self._load()
+
+    # --- 加载 ---
+    def _load(self):
+        """读取快照并重放日志（含上次未完成压缩遗留的日志）"""
+        with self._lock:
+            self._triples = dict.fromkeys(self._read_snapshot(self.snapshot_file))
+            for path in (self.compacting_file, self.log_file):
+                for triple in self._read_log(path):
+                    self._triples[triple] = None
+                    if path == self.log_file:
+                        self._log_lines += 1
+            logger.info(f"三元组存储已加载 {len(self._triples)} 条（日志 {self._log_lines} 行）")
+
+    @staticmethod
+    def _read_snapshot(path: str) -> List[Triple]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return [tuple(t) for t in json.load(f) if len(t) == 3]
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.error(f"读取三元组快照失败 {path}: {e}")
+            return []
+
+    @staticmethod
+    def _read_log(path: str) -> List[Triple]:
+        triples = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        t = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"跳过损坏的日志行: {line[:80]}")  # 崩溃时可能写了半行
+                        continue
+                    if len(t) == 3:
+                        triples.append(tuple(t))
+        except FileNotFoundError:
+            pass
+        return triples
+
+    # --- 读写接口 ---
+    def add(self, triples: Iterable[Triple]) -> List[Triple]:
+        """追加三元组，返回实际新增（此前不存在）的三元组"""
+        with self._lock:
+            new = []
+            for t in triples:
+                t = tuple(t)
+                if len(t) != 3 or t in self._triples:
+                    continue
+                self._triples[t] = None
+                new.append(t)
+            if new:
+                with open(self.log_file, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(t, ensure_ascii=False) + '\n' for t in new))
+                self._log_lines += len(new)
+            if self._log_lines >= self.compact_threshold:
+                self.compact_async()
+            return new
+
+    def all(self) -> Set[Triple]:
+        """返回全部三元组的副本"""
+        with self._lock:
+            return set(self._triples)
+
+    def ordered(self) -> List[Triple]:
+        """按写入顺序返回全部三元组"""
+        with self._lock:
+            return list(self._triples)
+
+    def __len__(self):
+        return len(self._triples)
+
+    def __contains__(self, triple):
+        return tuple(triple) in self._triples
+
+    def replace(self, triples: Iterable[Triple]):
+        """整体替换存储内容（兼容旧版 save_triples）"""
+        with self._lock:
+            self._triples = dict.fromkeys(tuple(t) for t in triples)
+            self._generation += 1
+            self._write_snapshot(self._triples)
+            for path in (self.log_file, self.compacting_file):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._log_lines = 0
+
+    def import_json(self, path: str) -> int:
+        """一次性导入旧版 triples.json 格式的文件，返回新增数量"""
+        new = self.add(self._read_snapshot(path))
+        logger.info(f"从 {path} 导入 {len(new)} 条新三元组")
+        return len(new)
+
+    # --- 压缩 ---
+    def compact_async(self):
+        """在后台线程中把日志合并进快照"""
+        with self._lock:
+            if self._compact_thread is not None and self._compact_thread.is_alive():
+                return
+            self._compact_thread = threading.Thread(target=self.compact, name="triple-compact", daemon=True)
+            self._compact_thread.start()
+
+    def compact(self):
+        """合并日志到快照：先冻结当前日志，写出快照后再删除冻结日志，期间写入不阻塞"""
+        with self._lock:
+            if os.path.exists(self.compacting_file):
+                # 上次压缩中断，其内容已在内存中，直接随本次快照落盘
+                if os.path.exists(self.log_file):
+                    with open(self.log_file, 'r', encoding='utf-8') as src, \
+                            open(self.compacting_file, 'a', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                    os.remove(self.log_file)
+            elif os.path.exists(self.log_file):
+                os.replace(self.log_file, self.compacting_file)
+            else:
+                return
+            self._log_lines = 0
+            snapshot = list(self._triples)
+            generation = self._generation
+        tmp_path = self.snapshot_file + ".compact.tmp"
+        try:
+            # 序列化在锁外进行；换入快照前确认期间没有 replace()，否则丢弃这份过期的快照
+            self._dump(snapshot, tmp_path)
+            with self._lock:
+                if generation != self._generation:
+                    os.remove(tmp_path)
+                    logger.info("三元组存储在压缩期间被整体替换，放弃本次压缩")
+                    return
+                os.replace(tmp_path, self.snapshot_file)
+                os.remove(self.compacting_file)
+            logger.info(f"三元组日志压缩完成，快照共 {len(snapshot)} 条")
+        except Exception as e:
+            logger.error(f"三元组日志压缩失败: {e}")
+
+    def _write_snapshot(self, triples):
+        tmp_path = self.snapshot_file + ".tmp"
+        self._dump(triples, tmp_path)
+        os.replace(tmp_path, self.snapshot_file)  # 原子替换，避免写一半的快照
+
+    @staticmethod
+    def _dump(triples, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([list(t) for t in triples], f, ensure_ascii=False)
+
+    def close(self):
+        """等待正在进行的压缩结束"""
+        thread = self._compact_thread
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,55 @@
+"""难度评估缓存：换个说法的同一问题命中，实质不同的问题不命中"""
+
+import pytest
+
+from thinking.difficulty_cache import DifficultyCache
+
+ASSESSMENT = {"difficulty": 4, "routes": 4, "score": 3.8, "reasoning": "复杂"}
+
+
+@pytest.fixture
+def cache():
+    cache = DifficultyCache(max_entries=16, ttl=60, near_threshold=0.8)
+    cache.put("请详细分析微服务架构与单体架构在大型电商系统中的优缺点", "assessment", ASSESSMENT)
+    cache.put("计算从1到1000的所有质数之和并说明算法复杂度", "assessment", ASSESSMENT)
+    cache.put("为什么量子计算机能够破解现有的公钥加密算法", "assessment", ASSESSMENT)
+    return cache
+
+
+@pytest.mark.parametrize("question, hit", [
+    ("请详细分析微服务架构与单体架构在大型电商系统中的优缺点", "exact"),
+    ("请详细分析 微服务架构与单体架构，在大型电商系统中的优缺点？", "exact"),  # 空白与标点
+    ("详细分析一下微服务架构与单体架构在大型电商系统中的优缺点", "near"),
+    ("请详细分析微服务架构和单体架构在大型电商系统中的优缺点吧", "near"),
+    ("计算从1到1000的所有质数之和并说明算法复杂度吗", "near"),
+])
+def test_rephrasing_hits(cache, question, hit):
+    result = cache.get(question, "assessment")
+    assert result is not None
+    assert result["cache_hit"] == hit
+    assert result["difficulty"] == ASSESSMENT["difficulty"]
+
+
+@pytest.mark.parametrize("question", [
+    "计算从1到1001的所有质数之和并说明算法复杂度",   # 操作数不同
+    "计算从1到100的所有质数之和并说明算法复杂度",
+    "为什么量子计算机不能够破解现有的公钥加密算法",   # 加了否定词
+    "请比较关系型数据库与文档数据库在日志分析场景中的适用性",
+])
+def test_different_question_misses(cache, question):
+    assert cache.get(question, "assessment") is None
+
+
+def test_judgment_only_matches_exactly(cache):
+    question = "请详细分析微服务架构与单体架构在大型电商系统中的优缺点"
+    cache.put(question, "judgment", {"difficulty": "困难"})
+    assert cache.get(question, "judgment")["cache_hit"] == "exact"
+    assert cache.get("详细分析一下微服务架构与单体架构在大型电商系统中的优缺点", "judgment") is None
+
+
+def test_stats(cache):
+    cache.get("请详细分析微服务架构与单体架构在大型电商系统中的优缺点", "assessment")
+    cache.get("详细分析一下微服务架构与单体架构在大型电商系统中的优缺点", "assessment")
+    cache.get("计算从1到1001的所有质数之和并说明算法复杂度", "assessment")
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["near_hits"], stats["misses"]) == (1, 1, 1)
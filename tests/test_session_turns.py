@@ -0,0 +1,75 @@
+"""同一会话的并发请求依次处理：后一轮看到前一轮写回的历史，两轮消息不交错"""
+
+import asyncio
+import threading
+
+import pytest
+
+from context_window import ContextWindow
+from conversation_core import NagaConversation
+from session_manager import SessionManager
+
+
+@pytest.fixture
+def naga(tmp_path):
+    async def summarize(previous, messages, limit):
+        return previous
+
+    naga = NagaConversation.__new__(NagaConversation)  # 不连接MCP与模型，只测会话调度
+    naga.sessions = SessionManager(
+        persist=False,
+        context_factory=lambda session_id: ContextWindow(session_id, summarize=summarize, history_dir=str(tmp_path)),
+    )
+    naga.seen = []
+
+    async def fake_process(session, u, is_voice_input=False):
+        with session.lock:
+            history = [m["content"] for m in session.context.window()]
+        naga.seen.append((u, history))
+        for i in range(3):
+            await asyncio.sleep(0.02)  # 模拟流式输出，期间另一轮请求到达
+            yield ("娜迦", f"{u}-{i}")
+        with session.lock:
+            NagaConversation.record_turn(session.context, u, f"answer-{u}")
+
+    naga._process = fake_process
+    return naga
+
+
+async def _consume(naga, u, session_id="s"):
+    return [item async for item in naga.process(u, session_id=session_id)]
+
+
+def _history(naga, session_id="s"):
+    return [m["content"] for m in naga.sessions.get(session_id).context.window()]
+
+
+def test_concurrent_turns_same_loop_are_serialized(naga):
+    async def main():
+        await asyncio.gather(_consume(naga, "u1"), _consume(naga, "u2"))
+
+    asyncio.run(main())
+    assert _history(naga) == ["u1", "answer-u1", "u2", "answer-u2"]
+    assert naga.seen == [("u1", []), ("u2", ["u1", "answer-u1"])]
+
+
+def test_concurrent_turns_across_loops_are_serialized(naga):
+    # UI线程每条消息新建事件循环，API服务器在另一个循环上处理同一会话
+    threads = [threading.Thread(target=asyncio.run, args=(_consume(naga, u),)) for u in ("u1", "u2")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    first, second = naga.seen[0][0], naga.seen[1][0]
+    assert _history(naga) == [first, f"answer-{first}", second, f"answer-{second}"]
+    assert naga.seen[1][1] == [first, f"answer-{first}"]
+
+
+def test_abandoned_stream_on_closed_loop_releases_session(naga):
+    loop = asyncio.new_event_loop()
+    stream = naga.process("u1", session_id="s")
+    loop.run_until_complete(stream.__anext__())  # 取到第一块后放弃，循环随即关闭
+    loop.close()
+    assert naga.sessions.get("s").busy is False
+    asyncio.run(asyncio.wait_for(_consume(naga, "u2"), 5))
+    assert _history(naga)[-2:] == ["u2", "answer-u2"]
@@ -0,0 +1,58 @@
+"""树状思考：默认配置下提前结束生成的路线多于剪枝目标，遗传剪枝照常执行"""
+
+import asyncio
+
+import pytest
+
+import thinking.tree_thinking as tree_thinking
+from thinking.config import TREE_THINKING_CONFIG
+
+TOPICS = ["成本", "性能", "安全", "运维", "团队", "扩展", "风险", "合规", "体验", "生态"]
+
+
+class StreamingClient:
+    """每条路线产出内容互不重复、能通过质量检查的流式客户端"""
+
+    def __init__(self):
+        self.routes = 0
+
+    async def get_response_stream(self, prompt, temperature=0.7):
+        topic = TOPICS[self.routes % len(TOPICS)]
+        self.routes += 1
+        content = (f"从{topic}角度看，因为{topic}约束{self.routes}决定了方案边界，所以需要先量化{topic}指标；"
+                   f"然而{topic}{self.routes}之间存在取舍，但是可以分阶段推进，因此建议按{topic}优先级{self.routes * 7}排序。")
+        for i in range(0, len(content), 20):
+            await asyncio.sleep(0)
+            yield content[i:i + 20]
+
+    async def get_response(self, prompt, temperature=0.7):
+        return '{"score": 0.6, "reasoning": "合理"}'
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(tree_thinking, "_global_subsystems", dict.fromkeys(tree_thinking._global_subsystems))
+    monkeypatch.setitem(TREE_THINKING_CONFIG, "min_api_interval", 0)
+    engine = tree_thinking.TreeThinkingEngine(StreamingClient())
+    engine.session_store = None
+    return engine
+
+
+def test_early_exit_leaves_routes_for_pruning(engine, monkeypatch):
+    pruned = []
+    evolve = engine.genetic_pruning.evolve_thinking_tree
+
+    async def spy(nodes, target_count=3):
+        pruned.append((len(nodes), target_count))
+        return await evolve(nodes, target_count=target_count)
+
+    monkeypatch.setattr(engine.genetic_pruning, "evolve_thinking_tree", spy)
+    assessment = {"difficulty": 4, "routes": 7, "score": 4.0, "reasoning": "复杂"}
+    result = asyncio.run(engine.think_deeply("请比较多种架构方案的优缺点并给出建议", difficulty_assessment=assessment))
+
+    target = TREE_THINKING_CONFIG["pruning_target"]
+    assert pruned, "遗传剪枝没有执行"
+    routes, target_count = pruned[0]
+    assert target_count == target
+    assert routes > target  # 同一时刻完成的路线可能略多于 target + early_exit_spare_routes
+    assert result["thinking_process"]["routes_selected"] <= target
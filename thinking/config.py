@@ -11,13 +11,38 @@ TREE_THINKING_CONFIG = {
     "thinking_timeout": 60,  # 秒
     "api_timeout": 30,       # 秒
     
-    # 线程池配置
+    # 推测性启动：本地指标估计的难度分达到阈值时，思考路线与主回答并行生成，最终判断为否则取消
+    "speculative_start": True,
+    "speculative_threshold": 3.2,
+    
+    # 提前结束：路线流式生成，边生成边用本地启发式检查，低质量或与已有路线重复的中途取消，凑够合格路线即开始综合
+    "early_exit": True,
+    "early_exit_spare_routes": 2,        # 凑够 pruning_target + 该值条合格路线即取消其余路线（多出的供遗传剪枝挑选）
+    "early_exit_min_quality": 0.4,       # 内容质量下限（0-1，遗传剪枝的内容质量评估）
+    "early_exit_check_chars": 120,       # 生成多少字后开始检查
+    "early_exit_check_interval": 80,     # 之后每生成多少字检查一次是否与其他路线重复
+    "early_exit_duplicate_threshold": 0.8,  # 字符n-gram相似度超过该值视为重复
+    
+    # 难度评估缓存：同一问题（含换个说法的近似问题）的难度评估在各调用路径间共享
+    "difficulty_cache_size": 256,            # 最多缓存多少个问题，超出按最近最少使用淘汰
+    "difficulty_cache_ttl": 1800,            # 缓存有效期（秒）
+    "difficulty_cache_near_threshold": 0.8,  # 字符n-gram相似度达到该值视为同一问题（增删一两个虚词约为0.8-0.95）
+    
+    # 思考会话存储：各阶段结果写入 logs/thinking/<会话>.jsonl，中断后可继续，同一问题再次思考时复用路线
+    "session_store": True,
+    "session_store_max": 200,     # 最多保留多少个会话文件，超出删除最旧的
+    "session_store_ttl": 86400,   # 会话可复用的时长（秒）
+    "history_limit": 50,          # 内存中保留的思考历史条数
+    
+    # 调度配置（线程池只在提交同步函数时创建）
     "thinking_pool_size": 8,
     "api_pool_size": 4,
     "max_concurrent_api": 3,
-    "min_api_interval": 0.5,
+    "min_api_interval": 0.5,  # 令牌桶平均间隔（秒），0为不限速
+    "api_rate_burst": 3,      # 令牌桶容量：空闲后允许连续发出的调用数
     
     # 遗传算法配置
+    "pruning_target": 3,      # 路线多于该值时遗传剪枝，保留该数量的最优路线
     "selection_rate": 0.6,
     "mutation_rate": 0.1,
     "crossover_rate": 0.8,
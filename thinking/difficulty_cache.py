@@ -0,0 +1,207 @@
+"""
+难度评估缓存
+同一问题（或换个说法的同一问题）的难度评估在 think_deeply、异步思考判断、快速模型判断之间共享，避免重复调用模型
+"""
+
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Optional, Tuple
+
+from .config import TREE_THINKING_CONFIG
+from .similarity import _IGNORED, jaccard, shingles
+
+MIN_NEAR_SHINGLES = 6  # 过短的问题（如寒暄）n-gram太少，相似度不可靠，只做精确匹配
+NEAR_MATCH_KINDS = frozenset({"assessment"})  # 只有纯问题的难度评估做近似匹配；judgment 的键含对话上下文，只做精确匹配
+
+# 改一个数字或加一个否定词几乎不影响n-gram相似度，却是另一个问题：近似命中要求两者的数字与否定词完全一致
+# （"非常""无线"之类也会被当作否定词，代价只是少一次近似命中）
+_SALIENT = re.compile(r"\d+(?:\.\d+)?|[不没无非未别莫勿否]|\b(?:not|no|never|without)\b|n't")
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题文本：全半角统一、小写、去掉空白与标点"""
+    return _IGNORED.sub('', unicodedata.normalize('NFKC', question or '').lower())
+
+
+def fingerprint(question: str) -> str:
+    return hashlib.sha1(normalize_question(question).encode('utf-8')).hexdigest()
+
+
+def salient_tokens(question: str) -> Tuple[str, ...]:
+    """问题中的数字与否定词（按出现顺序）"""
+    return tuple(_SALIENT.findall(unicodedata.normalize('NFKC', question or '').lower()))
+
+
+class _Entry:
+    __slots__ = ("kind", "value", "signature", "salient", "expires")
+
+    def __init__(self, kind: str, value: Any, signature: FrozenSet[int], salient: Tuple[str, ...], expires: float):
+        self.kind = kind
+        self.value = value
+        self.signature = signature
+        self.salient = salient
+        self.expires = expires
+
+
+class DifficultyCache:
+    """按问题指纹缓存难度评估结果
+
+    - 键为 (kind, 规范化问题的指纹)，kind 区分不同评估器的结果格式
+    - 精确未命中时（仅 NEAR_MATCH_KINDS）按字符n-gram签名找最相近的同类条目，
+      相似度达到 near_threshold 且数字与否定词完全一致时视为同一问题
+    - 条目超过 ttl 秒过期，超过 max_entries 时淘汰最久未使用的
+    - 同一事件循环中同一问题的评估正在进行时，后来的调用等待其结果而不是再调一次模型
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None,
+                 near_threshold: Optional[float] = None):
+        self.max_entries = max_entries or TREE_THINKING_CONFIG["difficulty_cache_size"]
+        self.ttl = ttl or TREE_THINKING_CONFIG["difficulty_cache_ttl"]
+        self.near_threshold = near_threshold or TREE_THINKING_CONFIG["difficulty_cache_near_threshold"]
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._lock = threading.Lock()  # UI线程与API服务器各自的事件循环都会访问
+        self.stats = {"hits": 0, "near_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, question: str, kind: str, record: bool = True) -> Optional[Dict]:
+        """查找缓存（精确或近似命中时返回结果副本，带 cache_hit 字段），未命中返回None；record=False 时不计入命中统计"""
+        key = (kind, fingerprint(question))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            hit = "exact"
+            if entry is None and kind in NEAR_MATCH_KINDS:
+                entry = self._nearest(kind, shingles(normalize_question(question)), salient_tokens(question), now)
+                hit = "near"
+            if entry is None:
+                if record:
+                    self.stats["misses"] += 1
+                return None
+            if record:
+                self.stats["hits" if hit == "exact" else "near_hits"] += 1
+        result = dict(entry.value)
+        result["cache_hit"] = hit
+        return result
+
+    def put(self, question: str, kind: str, value: Dict):
+        normalized = normalize_question(question)
+        key = (kind, hashlib.sha1(normalized.encode('utf-8')).hexdigest())
+        entry = _Entry(kind, dict(value), shingles(normalized), salient_tokens(question), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    async def get_or_compute(self, question: str, kind: str, compute: Callable[[], Awaitable[Dict]],
+                             cacheable: Callable[[Dict], bool] = lambda result: True) -> Dict:
+        """命中缓存直接返回；否则调用 compute()，cacheable(结果) 为真时写入缓存"""
+        cached = self.get(question, kind)
+        if cached is not None:
+            return cached
+        key = (kind, fingerprint(question))
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is not None and inflight[0] is loop:
+                self.stats["coalesced"] += 1
+                future = inflight[1]
+            else:
+                future = loop.create_future()
+                self._inflight[key] = (loop, future)
+                inflight = None
+        if inflight is not None:
+            try:
+                return dict(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # 自身被取消
+                return await self.get_or_compute(question, kind, compute, cacheable)  # 先发起的调用被取消（如等待超时），自己重新评估
+        try:
+            result = await compute()
+            if cacheable(result):
+                self.put(question, kind, result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时不报 "exception was never retrieved"
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key, (None, None))[1] is future:
+                    del self._inflight[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["near_hits"] + self.stats["misses"]
+            hits = self.stats["hits"] + self.stats["near_hits"]
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                **self.stats,
+                "hit_rate": f"{hits / lookups:.2%}" if lookups else "0.00%",
+            }
+
+    def _live(self, key: Tuple[str, str], now: float) -> Optional[_Entry]:
+        """取未过期的条目并标记为最近使用（调用方持有 _lock）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= now:
+            del self._entries[key]
+            self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, kind: str, signature: FrozenSet[int], salient: Tuple[str, ...],
+                 now: float) -> Optional[_Entry]:
+        """同类条目中与签名最相似、达到阈值且数字与否定词一致的一条（调用方持有 _lock）"""
+        if len(signature) < MIN_NEAR_SHINGLES:
+            return None
+        best_key, best_score = None, self.near_threshold
+        for key, entry in list(self._entries.items()):
+            if entry.kind != kind or len(entry.signature) < MIN_NEAR_SHINGLES or entry.salient != salient:
+                continue
+            if entry.expires <= now:
+                del self._entries[key]
+                self.stats["expired"] += 1
+                continue
+            score = jaccard(signature, entry.signature)
+            if score >= best_score:
+                best_key, best_score = key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key]
+
+
+_cache: Optional[DifficultyCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_difficulty_cache() -> DifficultyCache:
+    """获取全局难度评估缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DifficultyCache()
+    return _cache
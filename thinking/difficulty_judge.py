@@ -7,6 +7,7 @@ import re
 import logging
 from typing import Dict, List, Tuple
 from .config import TREE_THINKING_CONFIG, COMPLEX_KEYWORDS, BRANCH_TYPES
+from .difficulty_cache import get_difficulty_cache
 
 logger = logging.getLogger("DifficultyJudge")
 
@@ -30,7 +31,13 @@ class DifficultyJudge:
         print("[TreeThinkingEngine] 🎯 问题难度判断器初始化完成")
     
     async def assess_difficulty(self, question: str) -> Dict:
-        """评估问题难度"""
+        """评估问题难度（结果按问题缓存，换个说法的近似问题同样命中；评估失败或AI评估异常的结果不缓存）"""
+        return await get_difficulty_cache().get_or_compute(
+            question, "assessment", lambda: self._assess(question),
+            cacheable=lambda result: "error" not in result and not result["metrics"]["ai_assessment"].get("failed")
+        )
+    
+    async def _assess(self, question: str) -> Dict:
         try:
             # 基础指标计算
             text_metrics = self._analyze_text_metrics(question)
@@ -74,8 +81,36 @@ class DifficultyJudge:
                 "difficulty": 3,
                 "routes": 5,
                 "reasoning": f"难度评估失败，使用默认值: {str(e)}",
-                "metrics": {}
+                "metrics": {},
+                "error": str(e)
+            }
+    
+    def quick_assessment(self, question: str) -> Dict:
+        """只用本地指标估计难度（不调用模型，AI评估按中性3分计入），用于推测性提前启动深度思考"""
+        text_metrics = self._analyze_text_metrics(question)
+        keyword_metrics = self._analyze_keywords(question)
+        structure_metrics = self._analyze_structure(question)
+        ai_metrics = {"score": 3, "reasoning": ""}
+        
+        score = self._calculate_final_score(
+            question, text_metrics, keyword_metrics, structure_metrics, ai_metrics
+        )
+        difficulty = min(5, max(1, round(score)))
+        return {
+            "difficulty": difficulty,
+            "routes": self.config["difficulty_routes"][difficulty],
+            "score": score,
+            "speculative": True,  # 预估结果，不写入缓存与思考会话
+            "reasoning": self._generate_reasoning(
+                difficulty, text_metrics, keyword_metrics, structure_metrics, ai_metrics
+            ) + "（本地快速估计）",
+            "metrics": {
+                "text": text_metrics,
+                "keywords": keyword_metrics,
+                "structure": structure_metrics,
+                "ai_assessment": ai_metrics
             }
+        }
     
     def _analyze_text_metrics(self, question: str) -> float:
         """分析文本长度复杂度"""
@@ -202,11 +237,11 @@ class DifficultyJudge:
                     "reasoning": result.get("reasoning", "")
                 }
             else:
-                return {"score": 3, "reasoning": "AI评估格式错误"}
+                return {"score": 3, "reasoning": "AI评估格式错误", "failed": True}
                 
         except Exception as e:
             logger.warning(f"AI评估解析失败: {e}")
-            return {"score": 3, "reasoning": f"AI评估异常: {str(e)}"}
+            return {"score": 3, "reasoning": f"AI评估异常: {str(e)}", "failed": True}
     
     def _calculate_final_score(self, question: str, text_metrics: float, keyword_metrics: float, 
                              structure_metrics: float, ai_metrics: Dict) -> float:
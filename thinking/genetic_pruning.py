@@ -8,18 +8,7 @@ import logging
 from typing import List, Dict, Tuple, Optional
 from .thinking_node import ThinkingNode, ThinkingBranch, ThinkingGeneration
 from .config import TREE_THINKING_CONFIG
-
-# numpy导入（可选，用于统计计算）
-try:
-    import numpy as np
-    HAS_NUMPY = True
-except ImportError:
-    HAS_NUMPY = False
-    # fallback实现
-    class np:
-        @staticmethod
-        def mean(data):
-            return sum(data) / len(data) if data else 0
+from .similarity import SimilarityIndex, diversity_scores
 
 logger = logging.getLogger("GeneticPruning")
 
@@ -40,6 +29,9 @@ class GeneticPruning:
         self.generations: List[ThinkingGeneration] = []
         self.current_generation = 0
         
+        # 相似度缓存：节点只分词一次，同一代的相似度矩阵供多样性评估与交叉配对共用
+        self.similarity = SimilarityIndex()
+        
         print("[TreeThinkingEngine] 🧬 遗传算法剪枝系统初始化完成")
     
     async def evolve_thinking_tree(self, initial_nodes: List[ThinkingNode], 
@@ -53,6 +45,7 @@ class GeneticPruning:
                 return []
             
             logger.info(f"开始遗传进化 - 初始节点: {len(initial_nodes)}, 目标数量: {target_count}")
+            self.similarity.clear()
             
             # 计算初始适应度
             await self._calculate_fitness(initial_nodes)
@@ -117,7 +110,9 @@ class GeneticPruning:
     
     async def _calculate_fitness(self, nodes: List[ThinkingNode]):
         """计算节点适应度"""
-        for node in nodes:
+        # 多样性一次性按相似度矩阵算出
+        diversities = self._evaluate_diversity(nodes)
+        for node, diversity_fitness in zip(nodes, diversities):
             # 多维度适应度计算
             fitness_score = 0.0
             
@@ -126,7 +121,6 @@ class GeneticPruning:
             fitness_score += content_fitness * 0.4
             
             # 多样性贡献 (30%)
-            diversity_fitness = self._evaluate_diversity(node, nodes)
             fitness_score += diversity_fitness * 0.3
             
             # 创新程度 (20%)
@@ -199,34 +193,17 @@ class GeneticPruning:
         
         return elite_nodes
     
-    def _evaluate_diversity(self, node: ThinkingNode, all_nodes: List[ThinkingNode]) -> float:
-        """评估节点多样性贡献"""
-        if len(all_nodes) <= 1:
-            return 1.0
-        
-        # 计算与其他节点的差异度
-        differences = []
-        node_words = set(node.content.lower().split())
-        
-        for other_node in all_nodes:
-            if other_node.id == node.id:
-                continue
-            
-            other_words = set(other_node.content.lower().split())
-            
-            # Jaccard距离
-            intersection = node_words & other_words
-            union = node_words | other_words
-            
-            if union:
-                jaccard_sim = len(intersection) / len(union)
-                jaccard_dist = 1 - jaccard_sim
-                differences.append(jaccard_dist)
+    def _similarity_matrix(self, nodes: List[ThinkingNode]):
+        """节点两两相似度矩阵（按节点id缓存，同一批或其子集直接复用）"""
+        return self.similarity.matrix([n.id for n in nodes], [n.content for n in nodes])
+    
+    def _evaluate_diversity(self, nodes: List[ThinkingNode]) -> List[float]:
+        """评估每个节点的多样性贡献：与其他节点的平均Jaccard距离"""
+        if len(nodes) <= 1:
+            return [1.0] * len(nodes)
         
-        if differences:
-            return float(np.mean(differences))
-        else:
-            return 1.0
+        matrix = self._similarity_matrix(nodes)
+        return diversity_scores(matrix, [self.similarity.has_content(n.id) for n in nodes])
     
     def _evaluate_innovation(self, content: str) -> float:
         """评估创新程度"""
@@ -264,16 +241,28 @@ class GeneticPruning:
             node.metadata["siblings"] = [j for j in range(len(nodes)) if j != i]
         
         # 成对交叉，生成新的思考路线
-        for i in range(0, len(nodes) - 1, 2):
+        for i, j in self._crossover_pairs(nodes):
             if random.random() < self.crossover_rate:
                 parent1 = nodes[i]
-                parent2 = nodes[i + 1]
+                parent2 = nodes[j]
                 
                 children = await self._create_crossover_children_v2(parent1, parent2)
                 crossover_nodes.extend(children)
         
         return crossover_nodes
     
+    def _crossover_pairs(self, nodes: List[ThinkingNode]) -> List[Tuple[int, int]]:
+        """按选择后的顺序（适应度从高到低），为每个节点挑选剩余节点中与它最不相似的作为交叉对象（融合差异大的思路）"""
+        matrix = self._similarity_matrix(nodes)
+        remaining = list(range(len(nodes)))
+        pairs = []
+        while len(remaining) >= 2:
+            i = remaining.pop(0)
+            j = min(remaining, key=lambda k: matrix[i][k])
+            remaining.remove(j)
+            pairs.append((i, j))
+        return pairs
+    
     async def _create_crossover_children_v2(self, parent1: ThinkingNode, 
                                           parent2: ThinkingNode) -> List[ThinkingNode]:
         """基于思路融合的交叉子代生成"""
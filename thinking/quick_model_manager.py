@@ -9,7 +9,9 @@ import json
 import time
 import re
 from typing import Dict, Any, Optional, Union, List
-from openai import AsyncOpenAI
+from llm_gateway import get_llm_gateway
+from .similarity import pairwise_similarity, shingles, text_similarity
+from .difficulty_cache import get_difficulty_cache
 from config import (
     QUICK_MODEL_CONFIG, 
     OUTPUT_FILTER_CONFIG,
@@ -43,9 +45,9 @@ class QuickModelManager:
         self.quick_client = None
         if self.enabled and self.config["api_key"] and self.config["base_url"]:
             try:
-                self.quick_client = AsyncOpenAI(
-                    api_key=self.config["api_key"],
-                    base_url=self.config["base_url"].rstrip('/') + '/'
+                self.quick_client = get_llm_gateway().endpoint(
+                    base_url=self.config["base_url"],
+                    api_key=self.config["api_key"]
                 )
                 # 只在首次初始化时输出日志
                 global _QUICK_MODEL_MANAGER_GLOBAL_INITIALIZED
@@ -57,9 +59,9 @@ class QuickModelManager:
                 self.enabled = False
         
         # 备用大模型客户端
-        self.fallback_client = AsyncOpenAI(
-            api_key=API_KEY,
-            base_url=BASE_URL.rstrip('/') + '/'
+        self.fallback_client = get_llm_gateway().endpoint(
+            base_url=BASE_URL,
+            api_key=API_KEY
         )
         
         # 统计信息
@@ -457,7 +459,7 @@ class QuickModelManager:
         """调用快速模型"""
         try:
             response = await asyncio.wait_for(
-                self.quick_client.chat.completions.create(
+                self.quick_client.create(
                     model=self.config["model_name"],
                     messages=[
                         {"role": "system", "content": system_prompt},
@@ -474,48 +476,22 @@ class QuickModelManager:
         except asyncio.TimeoutError:
             logger.warning("快速模型调用超时")
             return None
-        except RuntimeError as e:
-            if "handler is closed" in str(e):
-                logger.debug(f"忽略连接关闭异常: {e}")
-                return None
-            else:
-                logger.warning(f"快速模型调用失败: {e}")
-                return None
         except Exception as e:
             logger.warning(f"快速模型调用失败: {e}")
             return None
     
     async def _call_fallback_model(self, prompt: str, system_prompt: str) -> str:
         """调用备用大模型"""
-        try:
-            response = await self.fallback_client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=1024
-            )
-            
-            return response.choices[0].message.content
-        except RuntimeError as e:
-            if "handler is closed" in str(e):
-                logger.debug(f"忽略连接关闭异常，重新创建客户端: {e}")
-                # 重新创建客户端并重试
-                self.fallback_client = AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL.rstrip('/') + '/')
-                response = await self.fallback_client.chat.completions.create(
-                    model=MODEL,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    max_tokens=1024
-                )
-                return response.choices[0].message.content
-            else:
-                raise
+        response = await self.fallback_client.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.1,
+            max_tokens=1024
+        )
+        return response.choices[0].message.content
     
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
@@ -569,9 +545,9 @@ class QuickModelManager:
             
             # 重新初始化客户端
             if self.config["enabled"] and self.config["api_key"] and self.config["base_url"]:
-                self.quick_client = AsyncOpenAI(
-                    api_key=self.config["api_key"],
-                    base_url=self.config["base_url"].rstrip('/') + '/'
+                self.quick_client = get_llm_gateway().endpoint(
+                    base_url=self.config["base_url"],
+                    api_key=self.config["api_key"]
                 )
                 self.enabled = True
                 logger.info("快速模型配置更新成功")
@@ -599,6 +575,25 @@ class QuickModelManager:
         if not DIFFICULTY_JUDGMENT_CONFIG.get("enabled", True):
             return {"difficulty": "中等", "model_used": "disabled"}
         
+        cache = get_difficulty_cache()
+        
+        async def judge():
+            # 树状思考已评估过同一问题时直接换算，不再调用模型
+            assessment = None if context else cache.get(question, "assessment", record=False)
+            if assessment:
+                return {
+                    "difficulty": self._difficulty_from_assessment(assessment["difficulty"]),
+                    "model_used": "assessment_cache",
+                    "response_time": 0.0
+                }
+            return await self._judge_difficulty(question, context)
+        
+        return await cache.get_or_compute(
+            f"{question}\n{context}" if context else question, "judgment", judge,
+            cacheable=lambda result: result["model_used"] != "error"
+        )
+    
+    async def _judge_difficulty(self, question: str, context: str) -> Dict[str, Any]:
         start_time = time.time()
         
         # 构建判断提示词
@@ -675,6 +670,8 @@ class QuickModelManager:
         user_preferences = user_preferences[:max_prefs]
         
         scored_results = []
+        # 全部结果的两两相似度一次算出，相似性惩罚直接查表
+        similarity = pairwise_similarity([shingles(r.get('content', '')) for r in results])
         
         for i, result in enumerate(results):
             try:
@@ -696,7 +693,7 @@ class QuickModelManager:
                 score = score_result.get("score", 3)
                 
                 # 检查相似性惩罚
-                similar_penalty = self._check_similarity_penalty(result, scored_results)
+                similar_penalty = self._check_similarity_penalty(similarity[i][:i])
                 final_score = max(1, score - similar_penalty)
                 
                 scored_result = result.copy()
@@ -850,6 +847,11 @@ class QuickModelManager:
         # 默认返回中等
         return "中等"
     
+    def _difficulty_from_assessment(self, difficulty: int) -> str:
+        """把难度判断器的1-5分换算为难度级别"""
+        level = {1: "简单", 2: "简单", 3: "中等", 4: "困难", 5: "极难"}.get(difficulty, "中等")
+        return self._validate_difficulty(level)
+    
     def _extract_score(self, output: str) -> int:
         """从输出中提取评分"""
         import re
@@ -860,35 +862,19 @@ class QuickModelManager:
             return max(min_score, min(max_score, score))
         return 3  # 默认分数
     
-    def _check_similarity_penalty(self, current_result: Dict, existing_results: List[Dict]) -> int:
-        """检查相似性惩罚"""
+    def _check_similarity_penalty(self, similarities) -> int:
+        """检查相似性惩罚：similarities 为当前结果与此前各结果的相似度"""
         threshold = SCORING_SYSTEM_CONFIG.get("similarity_threshold", 0.85)
         penalty = SCORING_SYSTEM_CONFIG.get("penalty_for_similar", 1)
         
-        current_content = current_result.get('content', '')
-        
-        for existing in existing_results:
-            if self._calculate_similarity(current_content, existing.get('content', '')) > threshold:
-                return penalty
+        if any(sim > threshold for sim in similarities):
+            return penalty
         
         return 0
     
     def _calculate_similarity(self, text1: str, text2: str) -> float:
-        """简单的文本相似度计算"""
-        if not text1 or not text2:
-            return 0.0
-        
-        # 简单的词汇重叠相似度
-        words1 = set(text1.split())
-        words2 = set(text2.split())
-        
-        if not words1 or not words2:
-            return 0.0
-        
-        intersection = len(words1.intersection(words2))
-        union = len(words1.union(words2))
-        
-        return intersection / union if union > 0 else 0.0
+        """文本相似度（字符n-gram的Jaccard相似度）"""
+        return text_similarity(text1, text2)
     
     def _filter_and_sort_results(self, scored_results: List[Dict]) -> List[Dict]:
         """过滤和排序结果"""
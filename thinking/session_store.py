@@ -0,0 +1,316 @@
+"""
+思考会话存储
+每个深度思考会话写入一个追加式 JSONL 文件（会话头、难度评估、每条思考路线、各阶段结果、最终答案各占一行），
+思考路线生成即落盘；中断的会话可从最后完成的阶段继续，同一问题再次深度思考时复用已生成的路线
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Set
+
+from config import config
+from .config import TREE_THINKING_CONFIG
+from .difficulty_cache import fingerprint
+from .thinking_node import ThinkingNode
+
+logger = logging.getLogger("ThinkingSessionStore")
+
+# 会话阶段，按完成顺序排列
+STAGES = ("routes", "scored", "pruned")
+
+PRUNE_SLACK = 0.1  # 清理时额外删去 max_sessions 的这一比例，之后新建这么多会话前不再扫描目录
+
+_STOP = object()
+
+
+class CheckpointWriter:
+    """检查点后台写入线程：调用方（事件循环上的思考流程）只做一次无阻塞入队，单线程按入队顺序追加到各会话文件"""
+    
+    def __init__(self, name: str = "thinking-checkpoint-writer"):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def write(self, path: str, line: str):
+        self._queue.put((path, line))
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待此前入队的记录全部写入"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+    
+    def close(self, timeout: Optional[float] = 5.0):
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            path, line = item
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                logger.warning(f"思考会话检查点写入失败（{os.path.basename(path)}）: {e}")
+
+
+def _node_from_dict(data: Dict[str, Any]) -> ThinkingNode:
+    return ThinkingNode(**{k: v for k, v in data.items() if k in ThinkingNode.__dataclass_fields__})
+
+
+def _is_final(assessment: Optional[Dict]) -> bool:
+    """正式的难度评估（非空、评估未出错，且不是推测性启动时的本地预估）"""
+    return bool(assessment) and not assessment.get("speculative") and "error" not in assessment
+
+
+class ThinkingSession:
+    """一次深度思考会话的检查点
+    
+    routes 按路线编号保存已生成的路线；stages 保存已完成阶段的结果（routes: 采用的路线编号，
+    scored: 偏好打分，pruned: 剪枝后的节点）；answer 非空表示会话已完成
+    """
+    
+    def __init__(self, session_id: str, question: str, path: str, writer: CheckpointWriter):
+        self.session_id = session_id
+        self.question = question
+        self.fingerprint = fingerprint(question)
+        self.path = path
+        self._writer = writer
+        self.created = time.time()
+        self.assessment: Optional[Dict] = None
+        self.routes: Dict[int, ThinkingNode] = {}
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.answer: Optional[str] = None
+    
+    @property
+    def completed(self) -> bool:
+        return self.answer is not None
+    
+    @property
+    def last_stage(self) -> Optional[str]:
+        done = [stage for stage in STAGES if stage in self.stages]
+        return done[-1] if done else None
+    
+    def route_nodes(self, indexes: Optional[List[int]] = None) -> List[ThinkingNode]:
+        """按编号顺序返回路线（indexes 为空时返回全部已生成路线）"""
+        keys = sorted(self.routes) if indexes is None else [i for i in indexes if i in self.routes]
+        return [self.routes[i] for i in keys]
+    
+    def set_assessment(self, assessment: Dict):
+        self.assessment = assessment
+        self._append({"type": "assessment", "data": assessment})
+    
+    def add_route(self, node: ThinkingNode):
+        """路线生成后立即落盘"""
+        index = node.metadata.get("route_index", len(self.routes))
+        self.routes[index] = node
+        self._append({"type": "route", "node": asdict(node)})
+    
+    def complete_stage(self, stage: str, **data):
+        self.stages[stage] = data
+        self._append({"type": "stage", "stage": stage, **data})
+    
+    def complete_pruning(self, nodes: List[ThinkingNode]):
+        self.complete_stage("pruned", nodes=[asdict(node) for node in nodes])
+    
+    def pruned_nodes(self) -> List[ThinkingNode]:
+        return [_node_from_dict(data) for data in self.stages["pruned"]["nodes"]]
+    
+    def reset_after(self, stage: str):
+        """丢弃 stage 之后的阶段结果（如偏好变化后需要重新打分）"""
+        if any(later in self.stages for later in STAGES[STAGES.index(stage) + 1:]):
+            self._reset(stage)
+            self._append({"type": "reset", "after": stage})
+    
+    def _reset(self, stage: str):
+        for later in STAGES[STAGES.index(stage) + 1:]:
+            self.stages.pop(later, None)
+    
+    def complete(self, answer: str, **data):
+        self.answer = answer
+        self._append({"type": "answer", "answer": answer, **data})
+    
+    def _append(self, record):
+        line = record if isinstance(record, str) else json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        self._writer.write(self.path, line)
+    
+    def _replay(self, record: Dict[str, Any]):
+        kind = record.get("type")
+        if kind == "session":
+            self.created = record.get("created", self.created)
+        elif kind == "assessment" and _is_final(record.get("data")):
+            self.assessment = record.get("data")
+        elif kind == "route":
+            node = _node_from_dict(record["node"])
+            self.routes[node.metadata.get("route_index", len(self.routes))] = node
+        elif kind == "stage":
+            self.stages[record["stage"]] = {k: v for k, v in record.items() if k not in ("type", "stage")}
+        elif kind == "reset":
+            self._reset(record["after"])
+        elif kind == "answer":
+            self.answer = record.get("answer")
+
+
+class ThinkingSessionStore:
+    """思考会话检查点存储（logs/thinking/<session_id>.jsonl）
+    
+    - open() 为问题取得会话：同一问题有未完成的会话时继续它；有已完成的会话时新建会话并沿用其路线；否则新建
+    - 只记录正式的难度评估，推测性启动时的本地预估（speculative）不落盘，避免之后被当作正式评估沿用
+    - 超过 ttl 秒的会话不再复用；文件数超过 max_sessions 时删除最旧的（多删 PRUNE_SLACK，按计数触发，不是每次新建都扫描目录）
+    - 同一会话正在进行时不会被另一次调用继续，避免两处同时写入
+    - 检查点由 CheckpointWriter 线程写入；open() 会读文件，异步调用方应放到线程池执行
+    """
+    
+    def __init__(self, store_dir: Optional[str] = None, max_sessions: Optional[int] = None,
+                 ttl: Optional[float] = None):
+        self.store_dir = store_dir or os.path.join(str(config.system.log_dir), "thinking")
+        self.max_sessions = max_sessions or TREE_THINKING_CONFIG["session_store_max"]
+        self.ttl = ttl or TREE_THINKING_CONFIG["session_store_ttl"]
+        self._index: Optional[Dict[str, str]] = None  # 问题指纹 -> 最近的会话id
+        self._active: Set[str] = set()
+        self._count = 0  # 会话文件数，建立索引时统计，新建与清理时增减
+        self._lock = threading.Lock()
+        self._writer = CheckpointWriter()
+        self.stats = {"created": 0, "resumed": 0, "reused_routes": 0}
+    
+    def open(self, question: str, assessment: Optional[Dict] = None) -> ThinkingSession:
+        key = fingerprint(question)
+        with self._lock:
+            self._writer.flush()  # 读取会话文件前写完排队中的检查点
+            previous = self._latest(key)
+            if previous is not None and not previous.completed and previous.session_id not in self._active:
+                self._active.add(previous.session_id)
+                self.stats["resumed"] += 1
+                logger.info(f"继续思考会话 {previous.session_id}（已完成阶段: {previous.last_stage or '无'}，已有路线 {len(previous.routes)} 条）")
+                return previous
+            session = self._create(question)
+            self._active.add(session.session_id)
+        if previous is not None and "routes" in previous.stages:
+            # 同一问题已完整思考过：沿用其难度评估与路线，只重新打分、剪枝、综合
+            if _is_final(previous.assessment):
+                session.set_assessment(previous.assessment)
+            for node in previous.route_nodes(previous.stages["routes"].get("indexes")):
+                session.add_route(node)
+            session.complete_stage("routes", **previous.stages["routes"])
+            self.stats["reused_routes"] += 1
+            logger.info(f"思考会话 {session.session_id} 沿用 {previous.session_id} 的 {len(session.routes)} 条路线")
+        elif _is_final(assessment):
+            session.set_assessment(assessment)
+        return session
+    
+    def release(self, session: ThinkingSession):
+        """本次调用结束（无论成功与否），会话可以被之后的调用继续"""
+        with self._lock:
+            self._active.discard(session.session_id)
+    
+    def load(self, session_id: str) -> Optional[ThinkingSession]:
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            return None
+        session = None
+        line = ""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 写入中途退出留下的半行
+                    if session is None:
+                        if record.get("type") != "session":
+                            return None
+                        session = ThinkingSession(session_id, record.get("question", ""), path, self._writer)
+                    session._replay(record)
+            if session is not None and line and not line.endswith("\n"):
+                session._append("\n")  # 补齐半行，之后追加的记录从新行开始
+        except (OSError, KeyError, TypeError) as e:
+            logger.warning(f"思考会话 {session_id} 读取失败: {e}")
+            return None
+        return session
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"sessions": len(self._session_files()), "active": len(self._active), **self.stats}
+    
+    def _create(self, question: str) -> ThinkingSession:
+        """新建会话文件并登记到索引（调用方持有 _lock）"""
+        session_id = f"thinking_{int(time.time())}_{uuid.uuid4().hex[:6]}"
+        os.makedirs(self.store_dir, exist_ok=True)
+        session = ThinkingSession(session_id, question, self._path(session_id), self._writer)
+        session._append({"type": "session", "session_id": session_id, "question": question,
+                         "fingerprint": session.fingerprint, "created": session.created})
+        self._load_index()[session.fingerprint] = session_id
+        self.stats["created"] += 1
+        self._count += 1
+        if self._count > self.max_sessions:
+            self._prune()
+        return session
+    
+    def _latest(self, key: str) -> Optional[ThinkingSession]:
+        """同一问题最近一次、未过期的会话（调用方持有 _lock）"""
+        session_id = self._load_index().get(key)
+        if session_id is None:
+            return None
+        session = self.load(session_id)
+        if session is None or time.time() - session.created > self.ttl:
+            return None
+        return session
+    
+    def _load_index(self) -> Dict[str, str]:
+        """首次使用时扫描会话目录（只读每个文件的首行）建立问题索引（调用方持有 _lock）"""
+        if self._index is None:
+            self._index = {}
+            names = self._session_files()
+            self._count = len(names)
+            for name in sorted(names, key=lambda n: os.path.getmtime(os.path.join(self.store_dir, n))):
+                try:
+                    with open(os.path.join(self.store_dir, name), 'r', encoding='utf-8') as f:
+                        header = json.loads(f.readline())
+                    self._index[header["fingerprint"]] = header["session_id"]
+                except (OSError, ValueError, KeyError):
+                    continue
+        return self._index
+    
+    def _prune(self):
+        """删除最旧的会话文件，保留 max_sessions 减去 PRUNE_SLACK 部分（调用方持有 _lock）"""
+        self._writer.flush()  # 删除前写完排队中的检查点，避免删除后又被追加出残缺文件
+        names = self._session_files()
+        keep = max(self.max_sessions - int(self.max_sessions * PRUNE_SLACK), 1)
+        names.sort(key=lambda n: os.path.getmtime(os.path.join(self.store_dir, n)))
+        for name in names[:max(len(names) - keep, 0)]:
+            session_id = name[:-len(".jsonl")]
+            if session_id in self._active:
+                continue
+            try:
+                os.remove(os.path.join(self.store_dir, name))
+            except OSError:
+                continue
+            names.remove(name)
+            for key, value in list(self._index.items()):
+                if value == session_id:
+                    del self._index[key]
+        self._count = len(names)
+    
+    def _session_files(self) -> List[str]:
+        try:
+            return [n for n in os.listdir(self.store_dir) if n.startswith("thinking_") and n.endswith(".jsonl")]
+        except OSError:
+            return []
+    
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.store_dir, f"{session_id}.jsonl")
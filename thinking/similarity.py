@@ -0,0 +1,123 @@
+"""
+文本相似度引擎
+按字符n-gram分词（中文没有空格，按空格切词几乎切不开），哈希到固定维度后用矩阵运算一次算出全部两两Jaccard相似度
+"""
+
+import re
+import zlib
+from typing import Dict, FrozenSet, Hashable, List, Sequence
+
+# numpy导入（可选，没有时逐对计算）
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+SHINGLE_SIZE = 2        # 字符n-gram长度，中文双字词最常见
+HASH_DIMENSIONS = 4096  # 哈希桶数，节点内容通常几百字，碰撞可以忽略
+
+_IGNORED = re.compile(r'[\s\W_]+', re.UNICODE)  # 空白与标点不参与比较
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> FrozenSet[int]:
+    """文本的哈希n-gram集合（小写、去掉空白与标点后取连续size个字符）"""
+    if not text:
+        return frozenset()
+    text = _IGNORED.sub('', text.lower())
+    if len(text) <= size:
+        return frozenset([_bucket(text)]) if text else frozenset()
+    return frozenset(_bucket(text[i:i + size]) for i in range(len(text) - size + 1))
+
+
+def _bucket(gram: str) -> int:
+    return zlib.crc32(gram.encode('utf-8')) % HASH_DIMENSIONS  # 跨进程稳定，不受hash随机化影响
+
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def text_similarity(text1: str, text2: str) -> float:
+    """两段文本的相似度（0-1），任一为空时为0"""
+    return jaccard(shingles(text1), shingles(text2))
+
+
+def pairwise_similarity(sets: Sequence[FrozenSet[int]]):
+    """全部两两Jaccard相似度矩阵；有numpy时返回ndarray，否则返回二维列表。空集合与任何集合的相似度为0"""
+    n = len(sets)
+    if HAS_NUMPY:
+        if n == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+        signatures = np.zeros((n, HASH_DIMENSIONS), dtype=np.float32)
+        for i, s in enumerate(sets):
+            if s:
+                signatures[i, list(s)] = 1.0
+        sizes = signatures.sum(axis=1)
+        intersection = signatures @ signatures.T
+        union = sizes[:, None] + sizes[None, :] - intersection
+        return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+    return [[jaccard(a, b) for b in sets] for a in sets]
+
+
+class SimilarityIndex:
+    """按键（如节点id）缓存分词结果与最近一次的相似度矩阵
+
+    同一节点只分词一次；同一批键（或其子集，如选择后的父代）重复查询时直接复用/切片上次的矩阵。
+    """
+
+    def __init__(self):
+        self._shingles: Dict[Hashable, FrozenSet[int]] = {}
+        self._keys: List[Hashable] = []
+        self._positions: Dict[Hashable, int] = {}
+        self._matrix = None
+
+    def shingles_for(self, key: Hashable, text: str) -> FrozenSet[int]:
+        cached = self._shingles.get(key)
+        if cached is None:
+            cached = self._shingles[key] = shingles(text)
+        return cached
+
+    def matrix(self, keys: Sequence[Hashable], texts: Sequence[str]):
+        """keys 对应文本的相似度矩阵，行列顺序与 keys 一致"""
+        if self._matrix is not None and all(k in self._positions for k in keys):
+            if list(keys) == self._keys:
+                return self._matrix
+            idx = [self._positions[k] for k in keys]
+            if HAS_NUMPY:
+                return self._matrix[np.ix_(idx, idx)]
+            return [[self._matrix[i][j] for j in idx] for i in idx]
+        sets = [self.shingles_for(k, t) for k, t in zip(keys, texts)]
+        self._matrix = pairwise_similarity(sets)
+        self._keys = list(keys)
+        self._positions = {k: i for i, k in enumerate(self._keys)}
+        return self._matrix
+
+    def has_content(self, key: Hashable) -> bool:
+        return bool(self._shingles.get(key))
+
+    def clear(self):
+        self._shingles.clear()
+        self._keys = []
+        self._positions = {}
+        self._matrix = None
+
+
+def diversity_scores(matrix, nonempty: Sequence[bool]) -> List[float]:
+    """每行与其余各行的平均Jaccard距离（1-相似度）；两者都为空的对不计入，没有可比对象时为1.0"""
+    n = len(nonempty)
+    if HAS_NUMPY:
+        if n == 0:
+            return []
+        has = np.asarray(nonempty, dtype=bool)
+        valid = has[:, None] | has[None, :]
+        np.fill_diagonal(valid, False)
+        counts = valid.sum(axis=1)
+        totals = np.where(valid, 1.0 - matrix, 0.0).sum(axis=1)
+        return np.divide(totals, counts, out=np.ones(n), where=counts > 0).tolist()
+    scores = []
+    for i in range(n):
+        distances = [1.0 - matrix[i][j] for j in range(n) if j != i and (nonempty[i] or nonempty[j])]
+        scores.append(sum(distances) / len(distances) if distances else 1.0)
+    return scores
@@ -1,39 +1,102 @@
 """
-双线程池管理系统
-分离思考处理和API调用，避免限流和提升并发性能
+思考任务与API调用调度
+协程任务直接在调用方的事件循环中执行，API调用按优先级排队、限制并发并按令牌桶限速；
+只有提交同步函数时才按需创建线程池
 """
 
 import asyncio
+import contextlib
+import heapq
+import itertools
+import threading
 import time
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Callable, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
 from .config import TREE_THINKING_CONFIG
 
 logger = logging.getLogger("ThreadPoolManager")
 
+# 优先级通道：数值越小越先获得API并发名额
+PRIORITY_FOREGROUND = 0  # 用户正在等待的调用（如综合最终答案）
+PRIORITY_BACKGROUND = 1  # 后台调用（如生成思考路线）
+LANE_NAMES = {PRIORITY_FOREGROUND: "foreground", PRIORITY_BACKGROUND: "background"}
+
+
+def _lane_name(priority: int) -> str:
+    return LANE_NAMES.get(priority, f"priority_{priority}")
+
+
+def _new_lane_stats() -> Dict[str, float]:
+    return {"waits": 0, "wait_total": 0.0, "wait_max": 0.0, "runs": 0, "run_total": 0.0}
+
+
+class TokenBucket:
+    """令牌桶限速：每秒补充 rate 个令牌，最多积攒 burst 个；rate<=0 时不限速"""
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def reserve(self) -> float:
+        """预订一个令牌，返回需要等待的秒数（令牌可以透支，按预订顺序依次等待）"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+    
+    def refund(self):
+        """退还预订后未使用的令牌（等待期间被取消）"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+
+class _Waiter:
+    """排队等待API并发名额的调用"""
+    __slots__ = ("priority", "loop", "future", "removed")
+    
+    def __init__(self, priority: int, loop: asyncio.AbstractEventLoop):
+        self.priority = priority
+        self.loop = loop
+        self.future = loop.create_future()
+        self.removed = False
+
+
 class ThreadPoolManager:
-    """双线程池管理器"""
+    """思考/API任务调度器
+    
+    - API调用最多 max_concurrent_api 个同时进行，名额空出时优先交给前台通道，同一通道先到先得
+    - 每次调用前按令牌桶限速（平均间隔 min_api_interval 秒，允许 api_rate_burst 次突发）
+    - 排队或限速等待中的调用被取消时立即出队并退还令牌，不占用名额
+    - 引擎在UI线程与API服务器的事件循环间共享，调度状态用线程锁保护，名额通过各自的事件循环唤醒
+    """
     
     def __init__(self):
         config = TREE_THINKING_CONFIG
+        self.thinking_pool_size = config["thinking_pool_size"]
+        self.api_pool_size = config["api_pool_size"]
+        self._pools: Dict[str, ThreadPoolExecutor] = {}  # 首次提交同步函数时创建
         
-        # 思考线程池：用于并行处理不同思考分支
-        self.thinking_pool = ThreadPoolExecutor(
-            max_workers=config["thinking_pool_size"], 
-            thread_name_prefix="thinking"
-        )
-        
-        # API调用线程池：避免API限流
-        self.api_pool = ThreadPoolExecutor(
-            max_workers=config["api_pool_size"],
-            thread_name_prefix="api"
-        )
-        
-        # API限流控制
-        self.api_semaphore = asyncio.Semaphore(config["max_concurrent_api"])
-        self.last_api_call = 0
+        # API并发与限速
+        self.max_concurrent_api = config["max_concurrent_api"]
         self.min_api_interval = config["min_api_interval"]
+        self.rate_limiter = TokenBucket(
+            1.0 / self.min_api_interval if self.min_api_interval > 0 else 0,
+            config.get("api_rate_burst", self.max_concurrent_api)
+        )
+        self._active = 0
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
         
         # 统计信息
         self.stats = {
@@ -41,65 +104,155 @@ class ThreadPoolManager:
             "api_tasks": 0,
             "thinking_completed": 0,
             "api_completed": 0,
-            "api_errors": 0
+            "api_errors": 0,
+            "api_cancelled": 0
         }
+        self._lane_stats = {priority: _new_lane_stats() for priority in LANE_NAMES}
+        self._rate_wait_total = 0.0
         
-        print(f"[TreeThinkingEngine] 🔄 线程池初始化完成 - 思考池:{config['thinking_pool_size']} API池:{config['api_pool_size']}")
+        print(f"[TreeThinkingEngine] 🔄 任务调度器初始化完成 - API并发:{self.max_concurrent_api} 最小间隔:{self.min_api_interval}秒")
     
     async def submit_thinking_task(self, func: Callable, *args, **kwargs) -> Any:
-        """提交思考任务到思考线程池"""
+        """执行思考任务（协程直接执行，同步函数放到思考线程池）"""
         self.stats["thinking_tasks"] += 1
         
         try:
-            # 检查是否为异步函数
-            if asyncio.iscoroutinefunction(func):
-                # 异步函数直接执行
-                result = await func(*args, **kwargs)
-            else:
-                # 同步函数使用线程池
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(self.thinking_pool, func, *args, **kwargs)
-            
+            result = await self._invoke("thinking", func, *args, **kwargs)
             self.stats["thinking_completed"] += 1
             return result
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"思考任务执行失败: {e}")
             raise
     
-    async def submit_api_task(self, func: Callable, *args, **kwargs) -> Any:
-        """提交API任务到API线程池，带限流控制"""
+    async def submit_api_task(self, func: Callable, *args, priority: int = PRIORITY_BACKGROUND, **kwargs) -> Any:
+        """执行API任务：按优先级排队获得并发名额、限速后执行"""
         self.stats["api_tasks"] += 1
         
-        async with self.api_semaphore:
+        async with self.api_slot(priority):
             try:
-                # 限流控制
-                await self._rate_limit()
-                
-                # 检查是否为异步函数
-                if asyncio.iscoroutinefunction(func):
-                    # 异步函数直接执行
-                    result = await func(*args, **kwargs)
-                else:
-                    # 同步函数使用线程池
-                    loop = asyncio.get_event_loop()
-                    result = await loop.run_in_executor(self.api_pool, func, *args, **kwargs)
-                
+                result = await self._invoke("api", func, *args, **kwargs)
                 self.stats["api_completed"] += 1
                 return result
-                
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 self.stats["api_errors"] += 1
                 logger.error(f"API任务执行失败: {e}")
                 raise
     
-    async def _rate_limit(self):
-        """API限流控制"""
-        now = time.time()
-        if now - self.last_api_call < self.min_api_interval:
-            wait_time = self.min_api_interval - (now - self.last_api_call)
-            await asyncio.sleep(wait_time)
-        
-        self.last_api_call = time.time()
+    @contextlib.asynccontextmanager
+    async def api_slot(self, priority: int = PRIORITY_BACKGROUND):
+        """占用一个API并发名额（含限速），用于无法包装成单次调用的场景，如流式生成"""
+        waited = await self._acquire(priority)
+        try:
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                try:
+                    await asyncio.sleep(delay)
+                except asyncio.CancelledError:
+                    self.rate_limiter.refund()
+                    raise
+                self._rate_wait_total += delay
+        except asyncio.CancelledError:
+            self._release()
+            self._count_cancelled()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self._count_cancelled()
+            raise
+        finally:
+            self._release()
+            self._record(priority, waited, time.monotonic() - started)
+    
+    async def _invoke(self, pool: str, func: Callable, *args, **kwargs) -> Any:
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(pool), lambda: func(*args, **kwargs))
+    
+    def _executor(self, pool: str) -> ThreadPoolExecutor:
+        with self._lock:
+            executor = self._pools.get(pool)
+            if executor is None:
+                size = self.thinking_pool_size if pool == "thinking" else self.api_pool_size
+                executor = self._pools[pool] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=pool)
+                logger.info(f"{pool}线程池已创建（{size}线程）")
+            return executor
+    
+    async def _acquire(self, priority: int) -> float:
+        """等待并占用一个并发名额，返回排队时长"""
+        start = time.monotonic()
+        with self._lock:
+            while self._queue and self._queue[0][2].removed:
+                heapq.heappop(self._queue)
+            if self._active < self.max_concurrent_api and not self._queue:
+                self._active += 1
+                return 0.0
+            waiter = _Waiter(priority, asyncio.get_running_loop())
+            heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            self._count_cancelled()
+            with self._lock:
+                if not waiter.future.done() or waiter.future.cancelled():
+                    # 仍在队列中：标记移除；已出队但尚未唤醒：由 _grant 发现取消后转交名额
+                    waiter.removed = True
+                    return_slot = False
+                else:
+                    return_slot = True  # 名额已到手但任务随即被取消
+            if return_slot:
+                self._release()
+            raise
+        return time.monotonic() - start
+    
+    def _release(self):
+        """归还名额：队列中有等待者时直接转交给优先级最高的一个"""
+        with self._lock:
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.removed:
+                    continue
+                try:
+                    waiter.loop.call_soon_threadsafe(self._grant, waiter)
+                    return
+                except RuntimeError:
+                    continue  # 等待者的事件循环已关闭
+            self._active -= 1
+    
+    def _grant(self, waiter: _Waiter):
+        """在等待者的事件循环中唤醒它；等待者已取消时把名额继续转交"""
+        if waiter.future.cancelled():
+            self._release()
+        else:
+            waiter.future.set_result(None)
+    
+    def _count_cancelled(self):
+        with self._lock:
+            self.stats["api_cancelled"] += 1
+    
+    def _record(self, priority: int, waited: float, ran: float):
+        with self._lock:
+            lane = self._lane_stats.setdefault(priority, _new_lane_stats())
+            lane["waits"] += 1
+            lane["wait_total"] += waited
+            lane["wait_max"] = max(lane["wait_max"], waited)
+            lane["runs"] += 1
+            lane["run_total"] += ran
+    
+    def cancel_pending(self) -> int:
+        """取消所有排队中的API调用，返回取消的数量"""
+        with self._lock:
+            waiters = [waiter for _, _, waiter in self._queue if not waiter.removed]
+        for waiter in waiters:
+            with contextlib.suppress(RuntimeError):
+                waiter.loop.call_soon_threadsafe(waiter.future.cancel)
+        return len(waiters)
     
     async def submit_batch_thinking_tasks(self, tasks: List[tuple]) -> List[Any]:
         """批量提交思考任务"""
@@ -122,16 +275,16 @@ class ThreadPoolManager:
         # 过滤异常结果
         valid_results = []
         for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"思考任务 {i} 失败: {result}")
+            if isinstance(result, BaseException):
+                logger.error(f"思考任务 {i} 失败: {result!r}")
             else:
                 valid_results.append(result)
         
         logger.info(f"批量思考任务完成: {len(valid_results)}/{len(tasks)} 成功")
         return valid_results
     
-    async def submit_batch_api_tasks(self, tasks: List[tuple]) -> List[Any]:
-        """批量提交API任务（带限流）"""
+    async def submit_batch_api_tasks(self, tasks: List[tuple], priority: int = PRIORITY_BACKGROUND) -> List[Any]:
+        """批量提交API任务（排队限速）"""
         if not tasks:
             return []
         
@@ -141,18 +294,18 @@ class ThreadPoolManager:
         async_tasks = []
         for func, args, kwargs in tasks:
             task = asyncio.create_task(
-                self.submit_api_task(func, *args, **kwargs)
+                self.submit_api_task(func, *args, priority=priority, **kwargs)
             )
             async_tasks.append(task)
         
-        # 等待所有任务完成
+        # 等待所有任务完成（自身被取消时 gather 会一并取消尚未完成的任务）
         results = await asyncio.gather(*async_tasks, return_exceptions=True)
         
         # 过滤异常结果
         valid_results = []
         for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"API任务 {i} 失败: {result}")
+            if isinstance(result, BaseException):
+                logger.error(f"API任务 {i} 失败: {result!r}")
             else:
                 valid_results.append(result)
         
@@ -160,51 +313,51 @@ class ThreadPoolManager:
         return valid_results
     
     def get_pool_status(self) -> dict:
-        """获取线程池状态"""
-        try:
-            thinking_pool_status = {
-                "max_workers": self.thinking_pool._max_workers,
-                "active_threads": len(self.thinking_pool._threads) if hasattr(self.thinking_pool, '_threads') and self.thinking_pool._threads else 0,
-                "pending_tasks": self.thinking_pool._work_queue.qsize() if hasattr(self.thinking_pool, '_work_queue') else 0
-            }
-            
-            api_pool_status = {
-                "max_workers": self.api_pool._max_workers,
-                "active_threads": len(self.api_pool._threads) if hasattr(self.api_pool, '_threads') and self.api_pool._threads else 0,
-                "pending_tasks": self.api_pool._work_queue.qsize() if hasattr(self.api_pool, '_work_queue') else 0
+        """获取调度器状态：排队深度、各通道排队/执行耗时、按需创建的线程池"""
+        with self._lock:
+            depth: Dict[int, int] = {}
+            for priority, _, waiter in self._queue:
+                if not waiter.removed:
+                    depth[priority] = depth.get(priority, 0) + 1
+            lanes = {}
+            for priority, lane in self._lane_stats.items():
+                lanes[_lane_name(priority)] = {
+                    "queued": depth.get(priority, 0),
+                    "completed": lane["runs"],
+                    "avg_wait_ms": round(lane["wait_total"] / lane["waits"] * 1000, 1) if lane["waits"] else 0.0,
+                    "max_wait_ms": round(lane["wait_max"] * 1000, 1),
+                    "avg_run_ms": round(lane["run_total"] / lane["runs"] * 1000, 1) if lane["runs"] else 0.0
+                }
+            scheduler = {
+                "max_concurrent": self.max_concurrent_api,
+                "active": self._active,
+                "queue_depth": sum(depth.values()),
+                "lanes": lanes,
+                "rate_limit_wait_s": round(self._rate_wait_total, 3)
             }
-            
-            semaphore_status = {
-                "available": getattr(self.api_semaphore, '_value', 0),
-                "waiting": len(getattr(self.api_semaphore, '_waiters', [])) if hasattr(self.api_semaphore, '_waiters') and self.api_semaphore._waiters is not None else 0
-            }
-            
-            return {
-                "thinking_pool": thinking_pool_status,
-                "api_pool": api_pool_status,
-                "api_semaphore": semaphore_status,
-                "stats": self.stats.copy()
-            }
-        except Exception as e:
-            logger.warning(f"获取线程池状态失败: {e}")
-            return {
-                "thinking_pool": {"status": "error"},
-                "api_pool": {"status": "error"},
-                "api_semaphore": {"status": "error"},
-                "stats": self.stats.copy(),
-                "error": str(e)
+            workers = {
+                name: {"max_workers": pool._max_workers, "threads": len(pool._threads)}
+                for name, pool in self._pools.items()
             }
+        return {
+            "api_scheduler": scheduler,
+            "worker_pools": workers,
+            "stats": self.stats.copy()
+        }
     
     def cleanup(self):
-        """清理线程池资源"""
-        logger.info("正在清理线程池资源...")
+        """清理资源：取消排队中的调用，关闭已创建的线程池"""
+        logger.info("正在清理任务调度器资源...")
         
-        # 优雅关闭
-        self.thinking_pool.shutdown(wait=True)
-        self.api_pool.shutdown(wait=True)
+        self.cancel_pending()
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.shutdown(wait=True)
         
         # 输出最终统计
-        logger.info(f"线程池清理完成 - 统计信息: {self.stats}")
+        logger.info(f"任务调度器清理完成 - 统计信息: {self.stats}")
     
     def __enter__(self):
         return self
@@ -215,8 +368,9 @@ class ThreadPoolManager:
 class TaskBatch:
     """任务批次管理器"""
     
-    def __init__(self, pool_manager: ThreadPoolManager):
+    def __init__(self, pool_manager: ThreadPoolManager, priority: int = PRIORITY_BACKGROUND):
         self.pool_manager = pool_manager
+        self.priority = priority
         self.thinking_tasks = []
         self.api_tasks = []
     
@@ -233,7 +387,7 @@ class TaskBatch:
         # 并行执行思考任务和API任务
         thinking_results, api_results = await asyncio.gather(
             self.pool_manager.submit_batch_thinking_tasks(self.thinking_tasks),
-            self.pool_manager.submit_batch_api_tasks(self.api_tasks),
+            self.pool_manager.submit_batch_api_tasks(self.api_tasks, self.priority),
             return_exceptions=True
         )
         
@@ -250,4 +404,4 @@ class TaskBatch:
             "thinking": len(self.thinking_tasks),
             "api": len(self.api_tasks),
             "total": len(self.thinking_tasks) + len(self.api_tasks)
-        } 
\ No newline at end of file
+        }
@@ -6,13 +6,16 @@
 import asyncio
 import logging
 import time
-from typing import Dict, List, Optional, Any
+from typing import Awaitable, Dict, List, Optional, Any
 from .thinking_node import ThinkingNode, ThinkingBranch
 from .difficulty_judge import DifficultyJudge
 from .preference_filter import PreferenceFilter, UserPreference
 from .genetic_pruning import GeneticPruning
-from .thread_pools import ThreadPoolManager, TaskBatch
+from .thread_pools import ThreadPoolManager, TaskBatch, PRIORITY_FOREGROUND, PRIORITY_BACKGROUND
 from .config import TREE_THINKING_CONFIG
+from .similarity import text_similarity
+from .difficulty_cache import get_difficulty_cache
+from .session_store import ThinkingSession, ThinkingSessionStore
 
 logger = logging.getLogger("TreeThinkingEngine")
 
@@ -21,7 +24,8 @@ _global_subsystems = {
     "difficulty_judge": None,
     "preference_filter": None,
     "genetic_pruning": None,
-    "thread_pool": None
+    "thread_pool": None,
+    "session_store": None
 }
 
 class TreeThinkingEngine:
@@ -41,6 +45,8 @@ class TreeThinkingEngine:
             _global_subsystems["preference_filter"] = PreferenceFilter(api_client)
             _global_subsystems["genetic_pruning"] = GeneticPruning(api_client)
             _global_subsystems["thread_pool"] = ThreadPoolManager()
+            if TREE_THINKING_CONFIG.get("session_store", True):
+                _global_subsystems["session_store"] = ThinkingSessionStore()
             print("[TreeThinkingEngine] 🌳 树状思考引擎子系统初始化完成")
             print("[TreeThinkingEngine] 🚀 树状思考引擎初始化完成")
         else:
@@ -52,61 +58,112 @@ class TreeThinkingEngine:
         self.preference_filter = _global_subsystems["preference_filter"]
         self.genetic_pruning = _global_subsystems["genetic_pruning"]
         self.thread_pool = _global_subsystems["thread_pool"]
+        self.session_store = _global_subsystems["session_store"]
         
         # 运行状态
         self.is_enabled = self.config["enabled"]
         self.current_session = None
         self.thinking_history = []
     
-    async def think_deeply(self, question: str, user_preferences: Optional[List[UserPreference]] = None) -> Dict[str, Any]:
+    async def think_deeply(self, question: str, user_preferences: Optional[List[UserPreference]] = None,
+                           difficulty_assessment: Optional[Dict] = None,
+                           proceed: Optional[Awaitable[bool]] = None) -> Optional[Dict[str, Any]]:
         """
         深度思考主入口
+        
+        推测性启动时传入预估的 difficulty_assessment 与最终判断 proceed：
+        思考路线先行生成，之后等待 proceed，结果为否则放弃后续打分/剪枝/综合并返回 None
+        
+        启用会话存储时每个阶段的结果都会落盘：同一问题上次未完成时从最后完成的阶段继续，
+        已完成过时沿用其思考路线，只重新打分、剪枝、综合
         """
         if not self.is_enabled:
             logger.info("树状思考系统未启用，使用基础回答")
             return await self._basic_response(question)
         
+        session: Optional[ThinkingSession] = None
         try:
             start_time = time.time()
-            session_id = f"thinking_{int(start_time)}"
+            if self.session_store:
+                # 打开会话要读写会话文件，放到线程池执行，不阻塞事件循环
+                session = await asyncio.get_running_loop().run_in_executor(
+                    None, self.session_store.open, question, difficulty_assessment)
+                session_id = session.session_id
+            else:
+                session_id = f"thinking_{int(start_time)}"
             self.current_session = session_id
             
             logger.info(f"开始深度思考会话: {session_id}")
             logger.info(f"问题: {question[:100]}...")
             
-            # 1. 问题难度评估
-            difficulty_assessment = await self.difficulty_judge.assess_difficulty(question)
+            # 1. 问题难度评估（继续会话时沿用已记录的评估，推测性启动时先用预估结果生成路线）
+            if session and session.assessment:
+                difficulty_assessment = session.assessment
+            elif difficulty_assessment is None:
+                difficulty_assessment = await self.difficulty_judge.assess_difficulty(question)
+                if session:
+                    session.set_assessment(difficulty_assessment)
             logger.info(f"难度评估: {difficulty_assessment['reasoning']}")
             
-            # 2. 更新用户偏好
+            # 2. 更新用户偏好（偏好变化后已记录的打分与剪枝结果作废）
             if user_preferences:
                 self.preference_filter.update_preferences(user_preferences)
+                if session:
+                    session.reset_after("routes")
             
             # 3. 生成多路思考
-            thinking_routes = await self._generate_thinking_routes(
-                question, difficulty_assessment
-            )
+            if session and "routes" in session.stages:
+                thinking_routes = session.route_nodes(session.stages["routes"]["indexes"])
+                logger.info(f"沿用已生成的 {len(thinking_routes)} 条思考路线")
+            else:
+                thinking_routes = await self._generate_thinking_routes(
+                    question, difficulty_assessment, session
+                )
+                if session and thinking_routes:
+                    session.complete_stage("routes", indexes=[n.metadata.get("route_index") for n in thinking_routes])
+            
+            if proceed is not None and not await proceed:
+                logger.info("最终判断无需深度思考，放弃推测生成的思考路线")
+                return None
+            if difficulty_assessment.get("speculative"):
+                # 最终判断已做过正式评估（命中评估缓存），用它替换预估结果并记入会话
+                difficulty_assessment = await self.difficulty_judge.assess_difficulty(question)
+                if session:
+                    session.set_assessment(difficulty_assessment)
             
             # 4. 偏好打分
-            if thinking_routes:
+            if session and "scored" in session.stages:
+                route_scores = session.stages["scored"]["route_scores"]
+            elif thinking_routes:
                 route_scores = await self.preference_filter.score_thinking_nodes(thinking_routes)
                 logger.info(f"完成 {len(thinking_routes)} 条思考路线的偏好打分")
+                if session:
+                    session.complete_stage("scored", route_scores=route_scores)
             else:
                 route_scores = {}
             
             # 5. 遗传算法剪枝
-            if len(thinking_routes) > 3:
-                optimal_routes = await self.genetic_pruning.evolve_thinking_tree(
-                    thinking_routes, target_count=3
-                )
-                logger.info(f"遗传剪枝后保留 {len(optimal_routes)} 条最优路线")
+            if session and "pruned" in session.stages:
+                optimal_routes = session.pruned_nodes()
+                logger.info(f"沿用已记录的剪枝结果（{len(optimal_routes)} 条路线）")
             else:
-                optimal_routes = thinking_routes
+                pruning_target = self.config.get("pruning_target", 3)
+                if len(thinking_routes) > pruning_target:
+                    optimal_routes = await self.genetic_pruning.evolve_thinking_tree(
+                        thinking_routes, target_count=pruning_target
+                    )
+                    logger.info(f"遗传剪枝后保留 {len(optimal_routes)} 条最优路线")
+                else:
+                    optimal_routes = thinking_routes
+                if session and optimal_routes:
+                    session.complete_pruning(optimal_routes)
             
             # 6. 综合最终答案
             final_answer = await self._synthesize_final_answer(
                 question, optimal_routes, difficulty_assessment
             )
+            if session:
+                session.complete(final_answer, processing_time=time.time() - start_time)
             
             # 7. 记录思考过程
             thinking_session = {
@@ -122,6 +179,7 @@ class TreeThinkingEngine:
             }
             
             self.thinking_history.append(thinking_session)
+            del self.thinking_history[:-self.config.get("history_limit", 50)]  # 完整过程已在会话文件中，内存只留最近的
             
             logger.info(f"深度思考完成，耗时 {thinking_session['processing_time']:.2f}秒")
             
@@ -153,20 +211,33 @@ class TreeThinkingEngine:
         
         finally:
             self.current_session = None
+            if session:
+                self.session_store.release(session)
     
-    async def _generate_thinking_routes(self, question: str, difficulty_assessment: Dict) -> List[ThinkingNode]:
-        """生成多路思考"""
+    async def _generate_thinking_routes(self, question: str, difficulty_assessment: Dict,
+                                        session: Optional[ThinkingSession] = None) -> List[ThinkingNode]:
+        """生成多路思考（会话中已落盘的路线不再生成，新路线生成后立即落盘）"""
         routes_count = difficulty_assessment["routes"]
         temperatures = self.difficulty_judge.get_temperature_distribution(routes_count)
         branch_types = self.difficulty_judge.get_branch_types(routes_count)
+        existing = session.route_nodes() if session else []
+        indexes = [i for i in range(routes_count) if not session or i not in session.routes]
+        
+        logger.info(f"生成 {len(indexes)} 条思考路线（已有 {len(existing)} 条），温度范围: {min(temperatures)}-{max(temperatures)}")
         
-        logger.info(f"生成 {routes_count} 条思考路线，温度范围: {min(temperatures)}-{max(temperatures)}")
+        # 支持流式调用时边生成边筛选，凑够合格路线即提前结束
+        if self.config.get("early_exit", True) and hasattr(self.api_client, "get_response_stream"):
+            return await self._generate_routes_early_exit(question, routes_count, temperatures, branch_types,
+                                                          indexes, existing, session)
+        
+        if not indexes:
+            return existing
         
         # 创建任务批次
         task_batch = TaskBatch(self.thread_pool)
         
         # 为每个思考路线创建任务
-        for i in range(routes_count):
+        for i in indexes:
             temperature = temperatures[i]
             branch_type = branch_types[i]
             
@@ -176,7 +247,7 @@ class TreeThinkingEngine:
             # 添加API任务
             task_batch.add_api_task(
                 self._generate_single_route,
-                thinking_prompt, temperature, branch_type, i
+                thinking_prompt, temperature, branch_type, i, session
             )
         
         # 并行执行所有思考任务
@@ -188,7 +259,7 @@ class TreeThinkingEngine:
             logger.info(f"原始结果数量: thinking={len(thinking_results or [])}, api={len(api_results or [])}, 总计={len(all_results)}")
             
             # 过滤有效结果
-            valid_routes = []
+            valid_routes = list(existing)
             for i, result in enumerate(all_results):
                 logger.info(f"结果 {i}: 类型={type(result)}, 是否为ThinkingNode={isinstance(result, ThinkingNode)}")
                 if isinstance(result, ThinkingNode):
@@ -201,6 +272,7 @@ class TreeThinkingEngine:
                     logger.warning(f"  结果不是ThinkingNode类型: {result}")
             
             # 建立兄弟关系
+            valid_routes.sort(key=lambda n: n.metadata.get("route_index", 0))
             if valid_routes:
                 self._establish_sibling_relationships(valid_routes)
             
@@ -213,6 +285,115 @@ class TreeThinkingEngine:
             traceback.print_exc()
             return []
     
+    async def _generate_routes_early_exit(self, question: str, routes_count: int,
+                                          temperatures: List[float], branch_types: List[str],
+                                          indexes: List[int], existing: List[ThinkingNode],
+                                          session: Optional[ThinkingSession] = None) -> List[ThinkingNode]:
+        """流式生成 indexes 中的路线：低质量或与其他路线重复的中途取消，
+        连同已有路线凑够 pruning_target + early_exit_spare_routes 条合格路线后取消其余路线（留出遗传剪枝的挑选余地）"""
+        target = min(self.config.get("pruning_target", 3) + self.config.get("early_exit_spare_routes", 2), routes_count)
+        accepted: List[ThinkingNode] = list(existing)
+        if len(accepted) >= target or not indexes:
+            return accepted
+        partial: Dict[int, str] = {}  # 生成中的路线内容
+        enough = asyncio.Event()
+        
+        async def run_route(i: int):
+            prompt = self._create_thinking_prompt(question, branch_types[i], i + 1, routes_count)
+            node = await self._stream_single_route(prompt, temperatures[i], branch_types[i], i, partial, accepted)
+            if node is not None:
+                accepted.append(node)
+                if session:
+                    session.add_route(node)
+                if len(accepted) >= target:
+                    enough.set()
+        
+        tasks = [asyncio.create_task(run_route(i)) for i in indexes]
+        all_done = asyncio.gather(*tasks, return_exceptions=True)
+        enough_wait = asyncio.create_task(enough.wait())
+        try:
+            await asyncio.wait([all_done, enough_wait], timeout=self.config.get("thinking_timeout", 60),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            enough_wait.cancel()
+            for task in tasks:
+                task.cancel()  # 已够数或超时：其余路线立即断开，不再消耗token
+            await asyncio.gather(all_done, return_exceptions=True)
+        
+        valid_routes = sorted(accepted, key=lambda n: n.metadata.get("route_index", 0))
+        if valid_routes:
+            self._establish_sibling_relationships(valid_routes)
+        logger.info(f"成功生成 {len(valid_routes)}/{routes_count} 条思考路线（提前结束模式）")
+        return valid_routes
+    
+    async def _stream_single_route(self, prompt: str, temperature: float, branch_type: str, route_index: int,
+                                   partial: Dict[int, str], accepted: List[ThinkingNode]) -> Optional[ThinkingNode]:
+        """流式生成单条思考路线；被判定为低质量或重复时返回None（已生成部分即刻丢弃）"""
+        check_chars = self.config.get("early_exit_check_chars", 120)
+        check_interval = self.config.get("early_exit_check_interval", 80)
+        chunks: List[str] = []
+        length = 0
+        next_check = check_chars
+        try:
+            async with self.thread_pool.api_slot(PRIORITY_BACKGROUND):
+                async for delta in self.api_client.get_response_stream(prompt, temperature=temperature):
+                    chunks.append(delta)
+                    length += len(delta)
+                    if length < next_check:
+                        continue
+                    content = "".join(chunks)
+                    partial[route_index] = content
+                    reason = self._route_rejection(route_index, content, partial, accepted,
+                                                   check_quality=next_check == check_chars)
+                    if reason:
+                        logger.info(f"路线 {route_index} 在 {length} 字处取消: {reason}")
+                        return None
+                    next_check = length + check_interval
+        except Exception as e:
+            logger.warning(f"生成思考路线 {route_index} 失败: {e}")
+            return None
+        finally:
+            partial.pop(route_index, None)
+        
+        content = "".join(chunks).strip()
+        if not content:
+            return None
+        reason = self._route_rejection(route_index, content, {}, accepted, check_quality=True)
+        if reason:
+            logger.info(f"路线 {route_index} 生成完成但未采用: {reason}")
+            return None
+        
+        node = ThinkingNode(
+            content=content,
+            temperature=temperature,
+            branch_type=branch_type,
+            metadata={
+                "route_index": route_index,
+                "prompt_length": len(prompt),
+                "generated_at": time.time()
+            }
+        )
+        node.update_content(content)
+        return node
+    
+    def _route_rejection(self, route_index: int, content: str, partial: Dict[int, str],
+                         accepted: List[ThinkingNode], check_quality: bool) -> Optional[str]:
+        """用本地启发式检查路线内容，返回拒绝原因；合格时返回None"""
+        if check_quality:
+            quality = self.genetic_pruning._evaluate_content_quality(content)
+            if quality < self.config.get("early_exit_min_quality", 0.4):
+                return f"内容质量 {quality:.2f} 过低"
+        threshold = self.config.get("early_exit_duplicate_threshold", 0.8)
+        for node in accepted:
+            if text_similarity(content, node.content[:len(content)]) > threshold:
+                return f"与已完成路线 {node.metadata.get('route_index')} 重复"
+        for other, other_content in list(partial.items()):
+            # 只与进度更快（同进度时编号更小）的路线比较，相互重复时只保留一条
+            ahead = len(other_content) > len(content) or (len(other_content) == len(content) and other < route_index)
+            if other != route_index and ahead and text_similarity(content, other_content[:len(content)]) > threshold:
+                return f"与路线 {other} 重复"
+        return None
+    
     def _create_thinking_prompt(self, question: str, branch_type: str, route_num: int, total_routes: int) -> str:
         """创建思考提示词"""
         from .config import BRANCH_TYPES
@@ -250,7 +431,8 @@ class TreeThinkingEngine:
         return prompt
     
     async def _generate_single_route(self, prompt: str, temperature: float, 
-                                   branch_type: str, route_index: int) -> ThinkingNode:
+                                   branch_type: str, route_index: int,
+                                   session: Optional[ThinkingSession] = None) -> ThinkingNode:
         """生成单条思考路线"""
         try:
             logger.info(f"开始生成思考路线 {route_index}, 温度: {temperature}, 类型: {branch_type}")
@@ -274,6 +456,8 @@ class TreeThinkingEngine:
             )
             
             node.update_content(content.strip())
+            if session and node.content and not node.content.startswith("API调用出错"):
+                session.add_route(node)  # get_response 出错时返回错误信息而不抛异常，这类路线不落盘以便下次重新生成
             
             logger.info(f"路线 {route_index} 思考节点创建成功")
             return node
@@ -319,10 +503,12 @@ class TreeThinkingEngine:
 最终答案：
 """
             
-            # 使用中等温度生成综合答案
-            final_answer = await self.api_client.get_response(
+            # 使用中等温度生成综合答案（用户正在等待，优先于其他会话的后台路线生成）
+            final_answer = await self.thread_pool.submit_api_task(
+                self.api_client.get_response,
                 synthesis_prompt, 
-                temperature=0.7
+                temperature=0.7,
+                priority=PRIORITY_FOREGROUND
             )
             
             return final_answer.strip()
@@ -368,6 +554,8 @@ class TreeThinkingEngine:
             "current_session": self.current_session,
             "total_sessions": len(self.thinking_history),
             "thread_pool_status": self.thread_pool.get_pool_status(),
+            "difficulty_cache": get_difficulty_cache().get_stats(),
+            "session_store": self.session_store.get_stats() if self.session_store else None,
             "config": self.config,
             "components": {
                 "difficulty_judge": "已初始化",
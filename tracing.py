@@ -0,0 +1,220 @@
+# tracing.py # 轻量链路追踪：关闭时 span() 直接返回共享的空对象；开启时记录耗时与属性，导出为本地 JSONL 或 OTLP JSON 文件
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Any, Dict, Optional
+
+from config import config
+from log_sink import ConversationLogSink
+
+logger = logging.getLogger("Tracing")
+
+EXPORTERS = ("jsonl", "otel")
+MAX_ATTR_CHARS = 2000  # 单个字符串属性的最大导出长度，防止整段回复把追踪文件撑大
+SERVICE_NAME = "naga-agent"
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("naga_trace_span", default=None)
+
+
+class _NoopSpan:
+    """追踪关闭时所有 span() 共用的空对象；bool 为假，可用 `if s:` 跳过昂贵属性的计算"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __bool__(self):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+    def activate(self):
+        return self
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """一次计时区间
+
+    with span(...) 使用时成为当前 span，期间创建的 span（包括其中创建的 asyncio 任务里的）都挂在它下面；
+    也可以不进入 with，直接在结束时调用 end()（适合跨越多次 yield 的流式区间）。
+    """
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attrs", "start_ns", "error", "_t0", "_token", "_ended")
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self.error: Optional[str] = None
+        self._t0 = time.perf_counter_ns()
+        self._token = None
+        self._ended = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                pass  # 在其他上下文中退出（如异步生成器被别的任务关闭），父子关系已记录，忽略即可
+            self._token = None
+        self.end(exc)
+        return False
+
+    @contextlib.contextmanager
+    def activate(self):
+        """临时设为当前 span（不结束它），用于未进入 with 的 span 下创建子任务"""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def end(self, error: Optional[BaseException] = None):
+        if self._ended:
+            return
+        self._ended = True
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        _export(self, time.perf_counter_ns() - self._t0)
+
+
+_enabled = False
+_exporter = "jsonl"
+_trace_dir: Optional[str] = None
+_sink: Optional[ConversationLogSink] = None
+
+
+def configure(enabled: Optional[bool] = None, exporter: Optional[str] = None, trace_dir: Optional[str] = None):
+    """调整追踪开关与导出格式（默认取 config.system.trace_enabled / trace_exporter）"""
+    global _enabled, _exporter, _trace_dir
+    if exporter is not None:
+        if exporter not in EXPORTERS:
+            raise ValueError(f"追踪导出格式必须是以下之一: {EXPORTERS}")
+        if exporter != _exporter:
+            _exporter = exporter
+            _close_sink()
+    if trace_dir is not None and trace_dir != _trace_dir:
+        _trace_dir = trace_dir
+        _close_sink()
+    if enabled is not None:
+        _enabled = enabled
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def span(name: str, parent: Optional[Span] = None, **attrs) -> Any:
+    """开始一个 span（默认挂在当前 span 下，也可显式指定 parent）；追踪关闭时返回 NOOP_SPAN，不分配任何对象"""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, parent or _current.get(), attrs)
+
+
+def flush(timeout: Optional[float] = None) -> bool:
+    """等待已结束的 span 全部写入文件"""
+    return _sink.flush(timeout) if _sink else True
+
+
+def _close_sink():
+    global _sink
+    if _sink is not None:
+        _sink.close()
+        _sink = None
+
+
+def _get_sink() -> ConversationLogSink:
+    global _sink
+    if _sink is None:
+        trace_dir = _trace_dir or os.path.join(str(config.system.log_dir), "trace")
+        suffix = ".otlp.jsonl" if _exporter == "otel" else ".jsonl"
+        _sink = ConversationLogSink(log_dir=trace_dir, suffix=suffix, name="trace-sink")
+    return _sink
+
+
+def _attr_value(value: Any) -> Any:
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    text = value if isinstance(value, str) else str(value)
+    return text if len(text) <= MAX_ATTR_CHARS else text[:MAX_ATTR_CHARS] + f"...(共{len(text)}字符)"
+
+
+def _jsonl_record(s: Span, duration_ns: int) -> Dict[str, Any]:
+    return {
+        "name": s.name,
+        "trace_id": s.trace_id,
+        "span_id": s.span_id,
+        "parent_id": s.parent_id,
+        "start_ns": s.start_ns,
+        "duration_ms": round(duration_ns / 1e6, 3),
+        "attrs": {k: _attr_value(v) for k, v in s.attrs.items()},
+        "error": s.error,
+    }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    value = _attr_value(value)
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": "" if value is None else value}
+
+
+def _otlp_record(s: Span, duration_ns: int) -> Dict[str, Any]:
+    """OTLP/JSON 格式（与 OpenTelemetry Collector 的 file exporter 一致，每行一个 resourceSpans）"""
+    otlp_span = {
+        "traceId": s.trace_id,
+        "spanId": s.span_id,
+        "name": s.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.start_ns + duration_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attrs.items()],
+        "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+    }
+    if s.parent_id:
+        otlp_span["parentSpanId"] = s.parent_id
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "naga.tracing"}, "spans": [otlp_span]}],
+    }]}
+
+
+def _export(s: Span, duration_ns: int):
+    try:
+        record = _otlp_record(s, duration_ns) if _exporter == "otel" else _jsonl_record(s, duration_ns)
+        day = time.strftime('%Y-%m-%d', time.localtime(s.start_ns / 1e9))
+        _get_sink().write(day, json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    except Exception as e:
+        logger.debug(f"span导出失败: {e}")
+
+
+configure(enabled=config.system.trace_enabled, exporter=config.system.trace_exporter)
+atexit.register(_close_sink)  # 退出前写完队列中的 span（导出格式或目录变化时 sink 会重建，因此不绑定具体实例）
@@ -8,6 +8,41 @@ import time
 from PyQt5.QtCore import QThread, pyqtSignal
 from ui.response_utils import extract_message
 
+UI_FLUSH_INTERVAL = 0.03  # 流式增量合并后推送给界面的最小间隔（秒），约每秒30次刷新
+
+
+class ChunkCoalescer:
+    """合并逐token的流式增量再推送：距上次推送不足 interval 时先缓存，到点由定时器补发，模型停顿时文本也不会滞留
+
+    信号跨线程排队交给界面线程处理，工作线程无需休眠让出；合并只是避免每个token一次信号与界面刷新
+    """
+    
+    def __init__(self, emit, interval: float = UI_FLUSH_INTERVAL):
+        self.emit = emit
+        self.interval = interval
+        self._parts = []
+        self._last = 0.0
+        self._timer = None
+    
+    def add(self, text: str):
+        self._parts.append(text)
+        wait = self.interval - (time.monotonic() - self._last)
+        if wait <= 0:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(wait, self.flush)
+    
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._parts:
+            text = ''.join(self._parts)
+            self._parts = []
+            self._last = time.monotonic()
+            self.emit(text)
+
+
 class EnhancedWorker(QThread):
     """增强版工作线程"""
     
@@ -88,6 +123,13 @@ class EnhancedWorker(QThread):
             self.status_changed.emit("正在生成回复...")
             self.progress_updated.emit(40, "AI正在思考")
             
+            def emit_partial(text):
+                # 发送部分结果用于实时显示，并更新进度
+                self.partial_result.emit(text)
+                progress = min(90, 40 + chunk_count * 2)
+                self.progress_updated.emit(progress, f"正在生成回复... ({chunk_count})")
+            
+            coalescer = ChunkCoalescer(emit_partial)
             async for chunk in self.naga.process(self.user_input):
                 if self.is_cancelled:
                     break
@@ -100,19 +142,12 @@ class EnhancedWorker(QThread):
                     if speaker == "Ren":
                         content_str = str(content)
                         result_chunks.append(content_str)
-                        # 发送部分结果用于实时显示
-                        self.partial_result.emit(content_str)
+                        coalescer.add(content_str)
                 else:
                     content_str = str(chunk)
                     result_chunks.append(content_str)
-                    self.partial_result.emit(content_str)
-                
-                # 更新进度
-                progress = min(90, 40 + chunk_count * 2)
-                self.progress_updated.emit(progress, f"正在生成回复... ({chunk_count})")
-                
-                # 短暂休眠，让UI有时间更新
-                await asyncio.sleep(0.01)
+                    coalescer.add(content_str)
+            coalescer.flush()
             
             if not self.is_cancelled:
                 self.progress_updated.emit(95, "完成生成")
@@ -159,7 +194,7 @@ class StreamingWorker(EnhancedWorker):
             
             # 开始流式处理
             result_chunks = []
-            word_count = 0
+            coalescer = ChunkCoalescer(self._emit_stream_text)
             
             async for chunk in self.naga.process(self.user_input):
                 if self.is_cancelled:
@@ -171,55 +206,13 @@ class StreamingWorker(EnhancedWorker):
                     if speaker == "Ren":
                         content_str = str(content)
                         result_chunks.append(content_str)
-                        
-                        # 发送流式数据到前端
-                        self.stream_chunk.emit(content_str)
-                        
-                        # 发送文本到语音集成模块
-                        try:
-                            from voice.voice_integration import get_voice_integration
-                            voice_integration = get_voice_integration()
-                            voice_integration.receive_text_chunk(content_str)
-                        except Exception as e:
-                            print(f"语音集成错误: {e}")
-                        
-                        # 更新缓冲区用于实时显示
-                        self.streaming_buffer += content_str
-                        word_count += len(content_str)
+                        coalescer.add(content_str)
                 else:
                     content_str = str(chunk)
                     result_chunks.append(content_str)
-                    self.stream_chunk.emit(content_str)
-                    
-                    # 发送文本到语音集成模块
-                    try:
-                        from voice.voice_integration import get_voice_integration
-                        voice_integration = get_voice_integration()
-                        voice_integration.receive_text_chunk(content_str)
-                    except Exception as e:
-                        print(f"语音集成错误: {e}")
-                    
-                    self.streaming_buffer += content_str
-                    word_count += len(content_str)
-                
-                # 动态更新状态
-                if word_count < 50:
-                    status = "开始回复..."
-                    progress = 35
-                elif word_count < 200:
-                    status = "正在详细解答..."
-                    progress = 50
-                elif word_count < 500:
-                    status = "完善回答内容..."
-                    progress = 70
-                else:
-                    status = "整理最终回复..."
-                    progress = 85
-                    
-                self.progress_updated.emit(progress, f"{status} ({word_count}字)")
-                
-                # 短暂休眠让UI更新
-                await asyncio.sleep(0.005)
+                    coalescer.add(content_str)
+            coalescer.flush()
+            word_count = len(self.streaming_buffer)
             
             if not self.is_cancelled:
                 # 发送最终完整文本到语音集成模块
@@ -245,6 +238,39 @@ class StreamingWorker(EnhancedWorker):
         except Exception as e:
             self.error_occurred.emit(f"流式处理错误: {str(e)}")
             raise
+    
+    def _emit_stream_text(self, content_str):
+        """推送一段合并后的流式文本：前端、语音集成与进度状态"""
+        # 发送流式数据到前端
+        self.stream_chunk.emit(content_str)
+        
+        # 发送文本到语音集成模块
+        try:
+            from voice.voice_integration import get_voice_integration
+            voice_integration = get_voice_integration()
+            voice_integration.receive_text_chunk(content_str)
+        except Exception as e:
+            print(f"语音集成错误: {e}")
+        
+        # 更新缓冲区用于实时显示
+        self.streaming_buffer += content_str
+        word_count = len(self.streaming_buffer)
+        
+        # 动态更新状态
+        if word_count < 50:
+            status = "开始回复..."
+            progress = 35
+        elif word_count < 200:
+            status = "正在详细解答..."
+            progress = 50
+        elif word_count < 500:
+            status = "完善回答内容..."
+            progress = 70
+        else:
+            status = "整理最终回复..."
+            progress = 85
+            
+        self.progress_updated.emit(progress, f"{status} ({word_count}字)")
 
 
 class BatchWorker(EnhancedWorker):